@@ -9,37 +9,148 @@ import sqlite3
 import bcrypt
 import jwt
 import secrets
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Tuple
 import os
+from flask import g, request
 from logger_config import logger
+from timing_wheel import expiry_wheel
+from sqlite_pool import SQLiteConnectionPool
+from config import (AUTH_DB_POOL_SIZE, AUTH_DB_CHECKOUT_TIMEOUT,
+                    AUTH_DB_CONN_MAX_AGE, AUTH_DB_LEAK_THRESHOLD,
+                    AUTH_HASH_WORKERS, AUTH_HASH_MAX_PENDING, AUTH_HASH_TIMEOUT)
 
 
 # JWT 配置
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', secrets.token_hex(32))
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24  # token有效期24小时
+JWT_CACHE_MAX_SIZE = 1024  # 已验证token缓存条数
+
+
+class AuthBusyError(Exception):
+    """密码哈希线程池繁忙（排队已满或等待超时），调用方应返回 503 让客户端稍后重试"""
+
+
+def _bcrypt_hashpw(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+
+def _bcrypt_checkpw(password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except Exception:
+        return False
+
+
+class PasswordHasher:
+    """
+    bcrypt 专用有界线程池
+    
+    每次 bcrypt 计算耗时数百毫秒且占满一个 CPU 核，登录洪峰会挤占识别请求的算力。
+    计算统一交给固定数量的工作线程，排队数超过上限时立即拒绝，等待超时也放弃，
+    从而把认证负载与识别延迟隔离开。
+    """
+    
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_HASH_MAX_PENDING,
+                 timeout: float = AUTH_HASH_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='PasswordHasher')
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.run_total = 0.0
+    
+    def _run(self, func, submitted_at: float, args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self.lock:
+                waited = started - submitted_at
+                self.completed += 1
+                self.queue_wait_total += waited
+                self.queue_wait_max = max(self.queue_wait_max, waited)
+                self.run_total += finished - started
+    
+    def _done(self, _future):
+        with self.lock:
+            self.pending -= 1
+    
+    def submit(self, func, *args):
+        """在工作线程执行 func(*args) 并等待结果；繁忙时抛出 AuthBusyError"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise AuthBusyError(f'认证服务繁忙（{self.pending} 个密码校验排队中），请稍后重试')
+            self.pending += 1
+        future = self.executor.submit(self._run, func, time.perf_counter(), args)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 尚未开始的任务直接取消，已在计算的任务跑完后自然释放排队名额
+            future.cancel()
+            with self.lock:
+                self.timeouts += 1
+            raise AuthBusyError(f'认证服务繁忙（等待超过 {self.timeout} 秒），请稍后重试')
+    
+    def hash(self, password: str) -> str:
+        return self.submit(_bcrypt_hashpw, password)
+    
+    def verify(self, password: str, password_hash: str) -> bool:
+        return self.submit(_bcrypt_checkpw, password, password_hash)
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'queue_wait_avg_ms': self.queue_wait_total / self.completed * 1000 if self.completed else 0,
+                'queue_wait_max_ms': self.queue_wait_max * 1000,
+                'run_avg_ms': self.run_total / self.completed * 1000 if self.completed else 0,
+            }
+
+
+password_hasher = PasswordHasher()
 
 
 class UserDatabase:
     """用户数据库管理类"""
     
     def __init__(self, db_path: str = 'users.db'):
-        """初始化数据库连接"""
+        """初始化数据库连接池"""
         self.db_path = db_path
+        self.pool = SQLiteConnectionPool(db_path, AUTH_DB_POOL_SIZE, AUTH_DB_CHECKOUT_TIMEOUT,
+                                         AUTH_DB_CONN_MAX_AGE, AUTH_DB_LEAK_THRESHOLD)
         self._init_database()
     
-    def _get_connection(self) -> sqlite3.Connection:
-        """获取数据库连接"""
-        conn = sqlite3.Connection(self.db_path)
-        conn.row_factory = sqlite3.Row  # 使返回结果可以通过列名访问
-        return conn
-    
     def _init_database(self):
         """初始化数据库表结构"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self.pool.connection() as conn:
+            self._create_tables(conn.cursor())
+            conn.commit()
         
+        logger.info(f"✅ 用户数据库初始化完成: {self.db_path}")
+    
+    def _create_tables(self, cursor: sqlite3.Cursor):
+        """创建用户表与索引"""
         # 创建用户表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -67,27 +178,14 @@ class UserDatabase:
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_username ON users(username)
         ''')
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"✅ 用户数据库初始化完成: {self.db_path}")
     
     def hash_password(self, password: str) -> str:
-        """使用bcrypt加密密码（密码已经是SHA256）"""
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password_bytes, salt)
-        return hashed.decode('utf-8')
+        """使用bcrypt加密密码（密码已经是SHA256），在专用线程池中计算"""
+        return password_hasher.hash(password)
     
     def verify_password(self, password: str, password_hash: str) -> bool:
-        """验证密码（密码已经是SHA256）"""
-        try:
-            password_bytes = password.encode('utf-8')
-            hash_bytes = password_hash.encode('utf-8')
-            return bcrypt.checkpw(password_bytes, hash_bytes)
-        except:
-            return False
+        """验证密码（密码已经是SHA256），在专用线程池中计算，繁忙时抛出 AuthBusyError"""
+        return password_hasher.verify(password, password_hash)
     
     def create_user(self, username: str, password_sha256: str, email: str = None, 
                    is_admin: bool = False) -> Tuple[bool, str]:
@@ -103,35 +201,33 @@ class UserDatabase:
         Returns:
             (成功标志, 消息)
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
             # 检查用户名是否已存在
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                return False, '用户名已存在'
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+                if cursor.fetchone():
+                    return False, '用户名已存在'
             
-            # 加密密码
+            # 加密密码（不占用数据库连接）
             password_hash = self.hash_password(password_sha256)
             
-            # 插入新用户
+            # 插入新用户（并发创建同名用户时由唯一约束拒绝）
             now = datetime.now().isoformat()
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, email, is_active, is_admin, 
-                                 created_at, updated_at)
-                VALUES (?, ?, ?, 1, ?, ?, ?)
-            ''', (username, password_hash, email, 1 if is_admin else 0, now, now))
-            
-            conn.commit()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, email, is_active, is_admin, 
+                                     created_at, updated_at)
+                    VALUES (?, ?, ?, 1, ?, ?, ?)
+                ''', (username, password_hash, email, 1 if is_admin else 0, now, now))
+                conn.commit()
             logger.info(f"✅ 创建用户成功: {username} (管理员: {is_admin})")
             return True, '用户创建成功'
             
         except Exception as e:
             logger.error(f"❌ 创建用户失败: {str(e)}")
             return False, f'创建用户失败: {str(e)}'
-        finally:
-            conn.close()
     
     def authenticate(self, username: str, password_sha256: str) -> Optional[Dict]:
         """
@@ -144,18 +240,17 @@ class UserDatabase:
         Returns:
             用户信息字典，验证失败返回None
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 查询用户
-            cursor.execute('''
-                SELECT id, username, password_hash, email, is_active, is_admin, 
-                       created_at, last_login, password_changed
-                FROM users WHERE username = ?
-            ''', (username,))
+            # 查询用户（查询完即归还连接，bcrypt 校验期间不占用连接池）
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, username, password_hash, email, is_active, is_admin, 
+                           created_at, last_login, password_changed
+                    FROM users WHERE username = ?
+                ''', (username,))
+                user_row = cursor.fetchone()
             
-            user_row = cursor.fetchone()
             if not user_row:
                 return None
             
@@ -172,9 +267,9 @@ class UserDatabase:
             
             # 更新最后登录时间
             now = datetime.now().isoformat()
-            cursor.execute('UPDATE users SET last_login = ? WHERE id = ?', 
-                         (now, user['id']))
-            conn.commit()
+            with self.pool.connection() as conn:
+                conn.execute('UPDATE users SET last_login = ? WHERE id = ?', (now, user['id']))
+                conn.commit()
             
             # 移除敏感信息
             del user['password_hash']
@@ -182,18 +277,18 @@ class UserDatabase:
             
             return user
             
+        except AuthBusyError:
+            # 繁忙不等于密码错误，交给调用方返回 503，不计入登录失败
+            raise
         except Exception as e:
             logger.error(f"❌ 用户认证失败: {str(e)}")
             return None
-        finally:
-            conn.close()
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """根据ID获取用户信息"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute('''
                 SELECT id, username, email, is_active, is_admin, created_at, 
                        updated_at, last_login, password_changed
@@ -202,16 +297,12 @@ class UserDatabase:
             
             user_row = cursor.fetchone()
             return dict(user_row) if user_row else None
-            
-        finally:
-            conn.close()
     
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """根据用户名获取用户信息"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute('''
                 SELECT id, username, email, is_active, is_admin, created_at, 
                        updated_at, last_login
@@ -220,9 +311,6 @@ class UserDatabase:
             
             user_row = cursor.fetchone()
             return dict(user_row) if user_row else None
-            
-        finally:
-            conn.close()
     
     def change_password(self, user_id: int, old_password_sha256: str, 
                        new_password_sha256: str) -> Tuple[bool, str]:
@@ -237,13 +325,12 @@ class UserDatabase:
         Returns:
             (成功标志, 消息)
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 获取当前密码哈希
-            cursor.execute('SELECT password_hash FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
+            # 获取当前密码哈希（bcrypt 校验与加密期间不占用连接池）
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT password_hash FROM users WHERE id = ?', (user_id,))
+                row = cursor.fetchone()
             if not row:
                 return False, '用户不存在'
             
@@ -256,89 +343,210 @@ class UserDatabase:
             # 加密新密码
             new_hash = self.hash_password(new_password_sha256)
             
-            # 更新密码并标记为已修改
+            # 更新密码并标记为已修改；期间密码已被并发修改时不覆盖
             now = datetime.now().isoformat()
-            cursor.execute('''
-                UPDATE users SET password_hash = ?, updated_at = ?, password_changed = 1 WHERE id = ?
-            ''', (new_hash, now, user_id))
-            
-            conn.commit()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users SET password_hash = ?, updated_at = ?, password_changed = 1
+                    WHERE id = ? AND password_hash = ?
+                ''', (new_hash, now, user_id, current_hash))
+                conn.commit()
+                if cursor.rowcount == 0:
+                    return False, '密码已被修改，请重试'
             logger.info(f"✅ 用户 {user_id} 密码修改成功，已标记为已修改")
             return True, '密码修改成功'
             
+        except AuthBusyError:
+            raise
         except Exception as e:
             logger.error(f"❌ 修改密码失败: {str(e)}")
             return False, f'修改密码失败: {str(e)}'
-        finally:
-            conn.close()
     
     def list_all_users(self) -> list:
         """获取所有用户列表"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute('''
                 SELECT id, username, email, is_active, is_admin, created_at, last_login
                 FROM users ORDER BY created_at DESC
             ''')
             
             return [dict(row) for row in cursor.fetchall()]
-            
-        finally:
-            conn.close()
     
     def delete_user(self, user_id: int) -> Tuple[bool, str]:
         """删除用户"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # 检查是否存在
-            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
-            if not row:
-                return False, '用户不存在'
-            
-            username = row['username']
-            
-            # 删除用户
-            cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            conn.commit()
-            
-            logger.info(f"✅ 删除用户成功: {username}")
-            return True, '用户删除成功'
-            
-        except Exception as e:
-            logger.error(f"❌ 删除用户失败: {str(e)}")
-            return False, f'删除用户失败: {str(e)}'
-        finally:
-            conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                # 检查是否存在
+                cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return False, '用户不存在'
+                
+                username = row['username']
+                
+                # 删除用户
+                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                conn.commit()
+                
+                logger.info(f"✅ 删除用户成功: {username}")
+                return True, '用户删除成功'
+                
+            except Exception as e:
+                logger.error(f"❌ 删除用户失败: {str(e)}")
+                return False, f'删除用户失败: {str(e)}'
     
     def update_user_status(self, user_id: int, is_active: bool) -> Tuple[bool, str]:
         """更新用户激活状态"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            now = datetime.now().isoformat()
-            cursor.execute('''
-                UPDATE users SET is_active = ?, updated_at = ? WHERE id = ?
-            ''', (1 if is_active else 0, now, user_id))
-            
-            if cursor.rowcount == 0:
-                return False, '用户不存在'
-            
-            conn.commit()
-            status = '启用' if is_active else '禁用'
-            logger.info(f"✅ 用户 {user_id} 已{status}")
-            return True, f'用户已{status}'
-            
-        except Exception as e:
-            logger.error(f"❌ 更新用户状态失败: {str(e)}")
-            return False, f'更新失败: {str(e)}'
-        finally:
-            conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                now = datetime.now().isoformat()
+                cursor.execute('''
+                    UPDATE users SET is_active = ?, updated_at = ? WHERE id = ?
+                ''', (1 if is_active else 0, now, user_id))
+                
+                if cursor.rowcount == 0:
+                    return False, '用户不存在'
+                
+                conn.commit()
+                status = '启用' if is_active else '禁用'
+                logger.info(f"✅ 用户 {user_id} 已{status}")
+                return True, f'用户已{status}'
+                
+            except Exception as e:
+                logger.error(f"❌ 更新用户状态失败: {str(e)}")
+                return False, f'更新失败: {str(e)}'
+    
+    def get_pool_stats(self) -> Dict:
+        """连接池诊断信息"""
+        return self.pool.get_stats()
+
+
+class VerifiedTokenCache:
+    """
+    已验证 JWT 的 LRU 缓存
+
+    以 token 的 SHA256 摘要为键，条目在 token 的 exp 到期时失效；
+    同时维护吊销列表（单个 token 或某用户在某时刻之前签发的全部 token）。
+    吊销列表只在本进程内：多进程部署时，某个进程处理的登出 / 改密码不会让其他进程中的 token 失效
+    （直至 token 过期，最长 JWT_EXPIRATION_HOURS 小时）；需要即时全局吊销时请以单进程运行。
+    """
+    
+    def __init__(self, max_size: int = JWT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # digest -> payload
+        self.revoked_tokens = {}  # digest -> exp，到期后由时间轮移除
+        self.revoked_users = {}  # user_id -> 毫秒时间戳，在该时刻及之前签发的 token 均失效
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+    
+    def get(self, digest: str) -> Optional[Dict]:
+        with self.lock:
+            if digest in self.revoked_tokens:
+                self.entries.pop(digest, None)
+                return None
+            payload = self.entries.get(digest)
+            if payload is None:
+                self.misses += 1
+                return None
+            if payload.get('exp', 0) <= time.time():
+                del self.entries[digest]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return payload
+    
+    def put(self, digest: str, payload: Dict):
+        with self.lock:
+            self._put_locked(digest, payload)
+    
+    def put_if_not_revoked(self, digest: str, payload: Dict) -> bool:
+        """
+        检查吊销并放入缓存，两步在同一把锁内完成，返回是否未被吊销。
+        分开调用时，两步之间执行的 revoke / revoke_user 会让已吊销的 token 进入缓存并继续通过验证
+        """
+        with self.lock:
+            if self._is_revoked_locked(digest, payload):
+                return False
+            self._put_locked(digest, payload)
+            return True
+    
+    def _put_locked(self, digest: str, payload: Dict):
+        self.entries[digest] = payload
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def is_revoked(self, digest: str, payload: Dict) -> bool:
+        with self.lock:
+            return self._is_revoked_locked(digest, payload)
+    
+    def _is_revoked_locked(self, digest: str, payload: Dict) -> bool:
+        if digest in self.revoked_tokens:
+            return True
+        revoked_before = self.revoked_users.get(payload.get('user_id'))
+        return revoked_before is not None and self.issued_ms(payload) <= revoked_before
+    
+    @staticmethod
+    def issued_ms(payload: Dict) -> int:
+        """token 的签发时刻（毫秒）；旧 token 没有 iat_ms，按 iat（秒）所在的整秒开头计，同一秒内吊销时仍视为失效"""
+        iat_ms = payload.get('iat_ms')
+        return iat_ms if iat_ms is not None else int(payload.get('iat', 0)) * 1000
+    
+    def revoke(self, digest: str, exp: float):
+        with self.lock:
+            self.entries.pop(digest, None)
+            self.revoked_tokens[digest] = exp
+        expiry_wheel.schedule(exp, self._forget_revoked_token, digest)
+    
+    def _forget_revoked_token(self, digest: str):
+        """token 自然过期后无需再保留吊销记录"""
+        with self.lock:
+            self.revoked_tokens.pop(digest, None)
+    
+    def revoke_user(self, user_id: int):
+        # 按毫秒比较：iat 只精确到秒，按秒比较会让吊销后同一秒内重新登录签发的 token 整个有效期都被拒绝
+        revoked_before = int(time.time() * 1000)
+        with self.lock:
+            self.revoked_users[user_id] = revoked_before
+            for digest in [d for d, p in self.entries.items() if p.get('user_id') == user_id]:
+                del self.entries[digest]
+        # 超过 token 有效期后，此前签发的 token 都已过期
+        expiry_wheel.schedule(revoked_before / 1000 + JWT_EXPIRATION_HOURS * 3600 + 1,
+                              self._forget_revoked_user, user_id, revoked_before)
+    
+    def _forget_revoked_user(self, user_id: int, revoked_before: int):
+        with self.lock:
+            if self.revoked_users.get(user_id) == revoked_before:
+                del self.revoked_users[user_id]
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0,
+                'revoked_tokens': len(self.revoked_tokens),
+                'revoked_users': len(self.revoked_users),
+            }
+
+
+token_cache = VerifiedTokenCache()
 
 
 class JWTManager:
@@ -362,7 +570,8 @@ class JWTManager:
             'username': username,
             'is_admin': is_admin,
             'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
-            'iat': datetime.utcnow()
+            'iat': datetime.utcnow(),
+            'iat_ms': int(time.time() * 1000)  # 毫秒级签发时刻，用于按用户吊销
         }
         
         token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
@@ -371,23 +580,45 @@ class JWTManager:
     @staticmethod
     def verify_token(token: str) -> Optional[Dict]:
         """
-        验证JWT token
+        验证JWT token（已验证过的token直接命中缓存，不再重复解码）
         
         Args:
             token: JWT token字符串
             
         Returns:
-            解码后的payload字典，验证失败返回None
+            解码后的payload字典，验证失败或已吊销返回None
         """
+        digest = VerifiedTokenCache.digest(token)
+        payload = token_cache.get(digest)
+        if payload is not None:
+            return payload
         try:
             payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            return payload
         except jwt.ExpiredSignatureError:
             logger.warning("⚠️  Token已过期")
             return None
         except jwt.InvalidTokenError as e:
             logger.warning(f"⚠️  无效的Token: {str(e)}")
             return None
+        if not token_cache.put_if_not_revoked(digest, payload):
+            logger.warning("⚠️  Token已被吊销")
+            return None
+        return payload
+    
+    @staticmethod
+    def revoke_token(token: str):
+        """吊销单个token（登出时调用）"""
+        try:
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            # 无效或已过期的token本身就不会通过验证
+            return
+        token_cache.revoke(VerifiedTokenCache.digest(token), payload.get('exp', time.time()))
+    
+    @staticmethod
+    def revoke_user_tokens(user_id: int):
+        """吊销该用户此前签发的全部token（修改密码时调用）"""
+        token_cache.revoke_user(user_id)
     
     @staticmethod
     def extract_token_from_header(auth_header: str) -> Optional[str]:
@@ -408,3 +639,19 @@ class JWTManager:
             return None
         
         return parts[1]
+
+
+def get_request_auth() -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    获取当前请求的认证上下文
+    
+    同一请求内 token 只提取、验证一次，结果保存在 flask.g 中供装饰器与限流键函数复用。
+    
+    Returns:
+        (token, payload)，缺少token时两者均为None，token无效时payload为None
+    """
+    if 'auth_context' not in g:
+        token = JWTManager.extract_token_from_header(request.headers.get('Authorization'))
+        payload = JWTManager.verify_token(token) if token else None
+        g.auth_context = (token, payload)
+    return g.auth_context
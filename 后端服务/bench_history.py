@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别历史读写争用基准测试
+多个写线程持续 add_record，同时多个读线程执行分页查询与统计，对比两种读取方式下写入延迟：
+  locked   - 读取时持有写锁（旧实现的行为）
+  snapshot - 读取无锁快照（当前实现）
+用法: python bench_history.py [--records 200000] [--writers 4] [--readers 2] [--seconds 5]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+# 使用临时目录，避免导入 history 时读写正式的历史数据
+_BENCH_DIR = tempfile.mkdtemp(prefix='bench_history_')
+os.environ['CAPTCHA_HISTORY_DIR'] = os.path.join(_BENCH_DIR, 'default')
+os.environ['CAPTCHA_HISTORY_BACKEND'] = 'memory'
+
+from history import RecognitionHistory  # noqa: E402
+
+
+def make_record(i):
+    return {
+        'ocr_type': (1, 4, 5)[i % 3],
+        'host': f'site{i % 50}.example.com',
+        'model': 'default',
+        'success': i % 7 != 0,
+        'result': f'r{i}',
+        'duration': 0.01 * (i % 100),
+        'preprocessing': [],
+        'api_key': f'key{i % 10}',
+        'api_key_name': f'客户端{i % 10}',
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(mode, args):
+    history = RecognitionHistory(max_records=args.records, history_file=os.path.join(_BENCH_DIR, 'none.json'),
+                                 log_dir=os.path.join(_BENCH_DIR, mode))
+    history.wait_loaded()
+    for i in range(args.records):
+        history.add_record(make_record(i))
+    history.save_history()  # 预填充的记录先落盘，计时阶段只测读写争用
+
+    stop = threading.Event()
+    latencies = [[] for _ in range(args.writers)]
+    reads = [0] * args.readers
+
+    def writer(index):
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            history.add_record(make_record(i))
+            latencies[index].append(time.perf_counter() - start)
+            i += 1
+            time.sleep(0.0005)  # 模拟识别请求之间的间隔
+
+    def read_once(i):
+        history.query_page(limit=50, host=f'site{i % 50}.example.com')
+        history.get_filtered_stats(status='failed')
+        history.get_stats(time_range=86400)
+
+    def reader(index):
+        i = 0
+        while not stop.is_set():
+            if mode == 'locked':
+                with history.lock:
+                    read_once(i)
+            else:
+                read_once(i)
+            reads[index] += 1
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    merged = [v for per_thread in latencies for v in per_thread]
+    return {
+        'writes': len(merged) / args.seconds,
+        'reads': sum(reads) / args.seconds,
+        'p50': percentile(merged, 50) * 1000,
+        'p99': percentile(merged, 99) * 1000,
+        'max': max(merged) * 1000 if merged else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='识别历史读写争用基准测试')
+    parser.add_argument('--records', type=int, default=200000, help='预先写入并保留的记录数')
+    parser.add_argument('--writers', type=int, default=4, help='写线程数（模拟 /hello 请求）')
+    parser.add_argument('--readers', type=int, default=2, help='读线程数（模拟管理后台查询）')
+    parser.add_argument('--seconds', type=float, default=5, help='每种模式的运行秒数')
+    args = parser.parse_args()
+
+    print(f"📊 记录数 {args.records}，写线程 {args.writers}，读线程 {args.readers}，每轮 {args.seconds} 秒")
+    print(f"{'模式':<10}{'写入/秒':>10}{'查询/秒':>10}{'写p50(ms)':>12}{'写p99(ms)':>12}{'写max(ms)':>12}")
+    try:
+        for mode in ('locked', 'snapshot'):
+            r = run(mode, args)
+            print(f"{mode:<10}{r['writes']:>10.0f}{r['reads']:>10.1f}{r['p50']:>12.3f}{r['p99']:>12.3f}{r['max']:>12.2f}")
+    finally:
+        shutil.rmtree(_BENCH_DIR, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
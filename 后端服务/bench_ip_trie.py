@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP 前缀树基准测试
+构建大规模 CIDR 列表（默认 100 万条，IPv4 / IPv6 混合），测量导入耗时与单次查询延迟。
+
+用法:
+    python bench_ip_trie.py --prefixes 1000000 --lookups 200000
+"""
+
+import time
+import random
+import argparse
+import ipaddress
+from ip_trie import IPPrefixTrie
+
+
+def random_prefixes(count, ipv6_ratio, seed):
+    rng = random.Random(seed)
+    prefixes = set()
+    while len(prefixes) < count:
+        if rng.random() < ipv6_ratio:
+            plen = rng.randint(32, 128)
+            network = rng.getrandbits(128) >> (128 - plen) << (128 - plen)
+            prefixes.add(str(ipaddress.IPv6Network((network, plen))))
+        else:
+            plen = rng.randint(16, 32)
+            network = rng.getrandbits(32) >> (32 - plen) << (32 - plen)
+            prefixes.add(str(ipaddress.IPv4Network((network, plen))))
+    return sorted(prefixes)
+
+
+def random_addresses(count, ipv6_ratio, seed):
+    rng = random.Random(seed)
+    return [str(ipaddress.IPv6Address(rng.getrandbits(128))) if rng.random() < ipv6_ratio
+            else str(ipaddress.IPv4Address(rng.getrandbits(32)))
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP 前缀树基准测试')
+    parser.add_argument('--prefixes', type=int, default=1000000, help='前缀数量')
+    parser.add_argument('--lookups', type=int, default=200000, help='查询次数')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.2, help='IPv6 前缀/地址所占比例')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    prefixes = random_prefixes(args.prefixes, args.ipv6_ratio, args.seed)
+    trie = IPPrefixTrie()
+    started = time.perf_counter()
+    for prefix in prefixes:
+        trie.add(prefix)
+    build = time.perf_counter() - started
+    print(f'导入 {len(trie)} 个前缀耗时 {build:.1f}s（{len(trie) / build:.0f} 条/秒）')
+
+    # 一半查询命中已有网段内的地址，一半为随机地址
+    hits = [str(ipaddress.ip_network(p).network_address) for p in random.Random(args.seed).sample(prefixes, args.lookups // 2)]
+    addresses = hits + random_addresses(args.lookups - len(hits), args.ipv6_ratio, args.seed + 1)
+    random.Random(args.seed).shuffle(addresses)
+
+    latencies = []
+    matched = 0
+    for address in addresses:
+        started = time.perf_counter()
+        if trie.match(address) is not None:
+            matched += 1
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    count = len(latencies)
+
+    def pct(p):
+        return latencies[min(count - 1, int(count * p))] * 1e6
+
+    print(f'查询 {count} 次，命中 {matched} 次：p50 {pct(0.50):.1f}µs  p99 {pct(0.99):.1f}µs  '
+          f'max {latencies[-1] * 1e6:.1f}µs  平均 {sum(latencies) / count * 1e6:.1f}µs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+限流状态后端基准测试
+对比进程内 RateLimiter 与 SQLite 共享后端的单次检查耗时，并验证多进程下的限额是否被正确共享。
+
+用法:
+    python bench_shared_state.py --iterations 20000 --threads 4 --processes 4
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+
+def run_threads(limiter, iterations, threads, identifiers):
+    """多线程调用 is_allowed，返回每次调用耗时（秒）列表"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        local = []
+        for i in range(iterations // threads):
+            key = f'bench_{(worker_id * 7919 + i) % identifiers}'
+            started = time.perf_counter()
+            limiter.is_allowed(key, 10 ** 9, 60)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, time.perf_counter() - started
+
+
+def report(name, latencies, elapsed):
+    latencies.sort()
+    count = len(latencies)
+
+    def pct(p):
+        return latencies[min(count - 1, int(count * p))] * 1e6
+
+    print(f'{name:<10} {count:>8} 次  {count / elapsed:>10.0f} 次/秒  '
+          f'p50 {pct(0.50):>7.1f}µs  p99 {pct(0.99):>7.1f}µs  max {latencies[-1] * 1e6:>8.1f}µs')
+
+
+def shared_worker(db_path, attempts, limit, queue):
+    from shared_state import SQLiteSharedState
+    from security import RateLimiter
+    limiter = RateLimiter(backend=SQLiteSharedState(db_path))
+    allowed = sum(1 for _ in range(attempts) if limiter.is_allowed('shared_key', limit, 60)[0])
+    queue.put(allowed)
+
+
+def check_cross_process(db_path, processes, limit):
+    """多个进程同时争抢同一个 key，允许的总次数必须恰好等于限额"""
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=shared_worker, args=(db_path, limit, limit, queue))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    total = sum(queue.get() for _ in procs)
+    status = '✅' if total == limit else '❌'
+    print(f'{status} {processes} 个进程共享限额 {limit}/分钟，实际放行 {total} 次')
+    return total == limit
+
+
+def main():
+    parser = argparse.ArgumentParser(description='限流状态后端基准测试')
+    parser.add_argument('--iterations', type=int, default=20000, help='每个后端的调用总次数')
+    parser.add_argument('--threads', type=int, default=4, help='并发线程数')
+    parser.add_argument('--identifiers', type=int, default=1000, help='不同标识数量')
+    parser.add_argument('--processes', type=int, default=4, help='跨进程校验使用的进程数')
+    parser.add_argument('--limit', type=int, default=100, help='跨进程校验使用的限额')
+    args = parser.parse_args()
+
+    from security import RateLimiter
+    from shared_state import SQLiteSharedState
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f'迭代 {args.iterations} 次，{args.threads} 线程，{args.identifiers} 个标识')
+        latencies, elapsed = run_threads(RateLimiter(), args.iterations, args.threads, args.identifiers)
+        report('memory', latencies, elapsed)
+
+        db_path = os.path.join(tmpdir, 'bench_state.db')
+        limiter = RateLimiter(backend=SQLiteSharedState(db_path))
+        latencies, elapsed = run_threads(limiter, args.iterations, args.threads, args.identifiers)
+        report('sqlite', latencies, elapsed)
+
+        check_cross_process(os.path.join(tmpdir, 'bench_shared.db'), args.processes, args.limit)
+
+
+if __name__ == '__main__':
+    main()
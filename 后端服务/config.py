@@ -5,6 +5,8 @@
 说明：不在此存储密钥/口令，密钥使用环境变量或独立安全存储。
 """
 
+import os
+
 DEFAULT_HOST = '0.0.0.0'
 DEFAULT_PORT = 1205
 SESSION_LIFETIME_HOURS = 1
@@ -12,11 +14,57 @@ SESSION_LIFETIME_HOURS = 1
 # 限流默认值
 RATE_LIMIT_DEFAULT_MAX = 100
 RATE_LIMIT_DEFAULT_WINDOW = 60
+# 识别接口 /hello 每个 API Key 每分钟的请求上限（回放采集流量做压测时可临时调高）
+HELLO_RATE_LIMIT = int(os.getenv('CAPTCHA_HELLO_RATE_LIMIT', 100))
+# 限流与登录锁定状态的分片锁数量
+SECURITY_LOCK_STRIPES = 16
+# 限流与登录锁定状态后端：memory（进程内）或 sqlite（多进程共享，WAL 模式）
+SHARED_STATE_BACKEND = os.getenv('CAPTCHA_STATE_BACKEND', 'memory')
+SHARED_STATE_DB = os.getenv('CAPTCHA_STATE_DB', 'shared_state.db')
+# 白/黑名单修改后延迟写入配置文件的时间（秒），期间的多次修改合并为一次写入
+SECURITY_SAVE_DEBOUNCE = 1.0
+# 过期时间轮的 tick 间隔（秒）
+EXPIRY_WHEEL_TICK = 1.0
 
-# 历史记录
-HISTORY_MAX_RECORDS = 10000
-HISTORY_FLUSH_INTERVAL = 60
-
+# 用户数据库连接池：最大连接数、取连接最长等待（秒）、连接最长存活（秒）、疑似泄漏的持有时长（秒）
+AUTH_DB_POOL_SIZE = 4
+AUTH_DB_CHECKOUT_TIMEOUT = 5.0
+AUTH_DB_CONN_MAX_AGE = 3600
+AUTH_DB_LEAK_THRESHOLD = 30
+# 密码哈希（bcrypt）专用线程池：并发计算上限、排队上限、单次排队加计算的最长等待（秒）
+AUTH_HASH_WORKERS = 2
+AUTH_HASH_MAX_PENDING = 32
+AUTH_HASH_TIMEOUT = 5.0
 
+# 历史记录：内存保留条数、定时落盘间隔（秒）
+HISTORY_MAX_RECORDS = int(os.getenv('CAPTCHA_HISTORY_MAX_RECORDS', 10000))
+HISTORY_FLUSH_INTERVAL = 60
+# 历史记录分段日志目录与每段记录数，段写满后滚动，滚动时整段删除最旧的段
+HISTORY_LOG_DIR = os.getenv('CAPTCHA_HISTORY_DIR', 'history_log')
+HISTORY_SEGMENT_RECORDS = 5000
+# 历史记录后端：memory（内存 + 分段日志，按条数保留）或 sqlite（WAL，按天数保留，查询走索引）
+HISTORY_BACKEND = os.getenv('CAPTCHA_HISTORY_BACKEND', 'memory')
+HISTORY_DB = os.getenv('CAPTCHA_HISTORY_DB', 'history.db')
+HISTORY_RETENTION_DAYS = int(os.getenv('CAPTCHA_HISTORY_RETENTION_DAYS', 30))
+# 时间桶预聚合：分钟桶保留小时数、小时桶保留天数（远长于原始记录的保留期）
+HISTORY_ROLLUP_MINUTE_HOURS = int(os.getenv('CAPTCHA_HISTORY_ROLLUP_MINUTE_HOURS', 48))
+HISTORY_ROLLUP_HOUR_DAYS = int(os.getenv('CAPTCHA_HISTORY_ROLLUP_HOUR_DAYS', 90))
+# 后台压缩预聚合桶（丢弃过期的分钟桶 / 小时桶）的间隔（秒）
+HISTORY_COMPACT_INTERVAL = 60
+# 识别历史持久化强度：none（只写入系统缓冲）、batch（每批落盘后 fsync）、interval（至多每 HISTORY_FSYNC_INTERVAL 秒 fsync 一次）
+HISTORY_DURABILITY = os.getenv('CAPTCHA_HISTORY_DURABILITY', 'none')
+HISTORY_FSYNC_INTERVAL = 1.0
+# 关闭服务时等待识别历史落盘的最长秒数
+HISTORY_CLOSE_TIMEOUT = 10.0
 
+# 识别流量采集（供 replay_traffic.py 回放）：默认关闭；采样率、目录与总大小上限（MB）
+TRAFFIC_CAPTURE_ENABLED = os.getenv('CAPTCHA_CAPTURE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+TRAFFIC_CAPTURE_DIR = os.getenv('CAPTCHA_CAPTURE_DIR', 'traffic_capture')
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv('CAPTCHA_CAPTURE_SAMPLE_RATE', 0.1))
+TRAFFIC_CAPTURE_MAX_MB = int(os.getenv('CAPTCHA_CAPTURE_MAX_MB', 500))
 
+# 验证码规则存储：json（整个文件原子替换）或 sqlite（每个网站一行，只写入改动的网站）；
+# 修改后延迟保存的秒数，期间的多次修改合并为一次写入
+RULES_BACKEND = os.getenv('CAPTCHA_RULES_BACKEND', 'json')
+RULES_DB = os.getenv('CAPTCHA_RULES_DB', 'rules.db')
+RULES_SAVE_DEBOUNCE = 1.0
@@ -185,6 +185,17 @@ REQUIRED_FILES=(
     "captcha-server.service"
     "history.py"
     "security.py"
+    "shared_state.py"
+    "timing_wheel.py"
+    "ip_trie.py"
+    "history_log.py"
+    "history_sqlite.py"
+    "history_ring.py"
+    "history_rollup.py"
+    "traffic_capture.py"
+    "replay_traffic.py"
+    "rules_store.py"
+    "sqlite_pool.py"
     "logger_config.py"
     "config.py"
     "reset_password.py"
@@ -272,7 +283,7 @@ done
 
 # 复制Python模块
 log_info "复制Python模块..."
-for file in history.py security.py logger_config.py config.py reset_password.py; do
+for file in history.py history_log.py history_sqlite.py history_ring.py history_rollup.py traffic_capture.py replay_traffic.py rules_store.py sqlite_pool.py security.py shared_state.py timing_wheel.py ip_trie.py logger_config.py config.py reset_password.py; do
     if [[ -f "$SCRIPT_DIR/$file" ]]; then
         sudo cp -f "$SCRIPT_DIR/$file" "$INSTALL_DIR/" || error_exit "复制 $file 失败"
         log_info "复制: $file"
@@ -8,17 +8,177 @@
 import time
 import json
 import os
+import io
+import csv
 import threading
-from collections import deque, defaultdict
+from collections import defaultdict, Counter
 from datetime import datetime
 from logger_config import logger
+from config import (HISTORY_MAX_RECORDS, HISTORY_FLUSH_INTERVAL, HISTORY_LOG_DIR, HISTORY_SEGMENT_RECORDS,
+                    HISTORY_BACKEND, HISTORY_DB, HISTORY_RETENTION_DAYS, HISTORY_DURABILITY,
+                    HISTORY_FSYNC_INTERVAL, HISTORY_CLOSE_TIMEOUT, HISTORY_COMPACT_INTERVAL)
+from history_log import SegmentLog
+from history_sqlite import SQLiteHistoryStore
+from history_ring import ColumnarHistoryRing
+from history_rollup import TimeBucketRollup
+
+
+def _write_json_atomic(path, data, fsync=False, **dump_kwargs):
+    """先写临时文件再替换，进程中途退出也不会留下写到一半的文件"""
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def encode_cursor(record):
+    """分页游标：'时间戳:序号'，时间戳用 repr 保证往返精确"""
+    return f"{record['timestamp']!r}:{record['seq']}"
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误抛出 ValueError"""
+    timestamp, seq = cursor.rsplit(':', 1)
+    return float(timestamp), int(seq)
+
+
+# 导出格式 -> (MIME 类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'columnar': ('application/x-ndjson', 'columnar.jsonl'),
+}
+EXPORT_FIELDS = ('seq', 'timestamp', 'datetime', 'ocr_type', 'host', 'model', 'success', 'result',
+                 'duration', 'preprocessing', 'api_key', 'api_key_name')
+
+
+def export_chunks(batches, fmt):
+    """
+    把分批的记录编码为导出文本，逐批产出：
+    jsonl 每行一条记录；csv 带表头，预处理选项以 ; 连接；columnar 首行为字段表，之后每批一行、按列排列
+    """
+    if fmt == 'csv':
+        yield '\ufeff'  # BOM，便于 Excel 识别 UTF-8
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for batch in batches:
+            for record in batch:
+                writer.writerow([';'.join(map(str, record.get(field) or ())) if field == 'preprocessing'
+                                 else record.get(field) for field in EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    elif fmt == 'columnar':
+        yield json.dumps({'fields': EXPORT_FIELDS}) + '\n'
+        for batch in batches:
+            columns = {field: [record.get(field) for record in batch] for field in EXPORT_FIELDS}
+            yield json.dumps(columns, ensure_ascii=False) + '\n'
+    else:
+        for batch in batches:
+            yield ''.join(json.dumps({field: record.get(field) for field in EXPORT_FIELDS}, ensure_ascii=False) + '\n'
+                          for record in batch)
+
+
+# 趋势查询：汇总粒度 -> 秒数；分项名 -> 预聚合桶中的维度
+TREND_STEPS = {'minute': 60, 'hour': 3600, 'day': 86400}
+TREND_DIMENSIONS = {'ocr_type': 'by_type', 'host': 'by_host', 'model': 'by_model', 'api_key': 'by_api_key'}
+
+
+class DistinctValues:
+    """
+    网站与 API Key（含名称）的去重计数：记录写入时递增，记录被淘汰 / 清理时递减，计数归零即删除，
+    筛选项接口只需遍历现存的不同取值。写入由 RecognitionHistory.lock 串行化，读取先复制条目
+    """
+
+    def __init__(self):
+        self.hosts = Counter()
+        self.api_keys = Counter()  # (api_key, api_key_name) -> 记录数
+
+    def add(self, record):
+        host = record.get('host')
+        self.hosts['unknown' if host is None else host] += 1
+        self.api_keys[(record.get('api_key'), record.get('api_key_name'))] += 1
+
+    def merge(self, hosts, api_keys):
+        for host, count in hosts.items():
+            self.hosts['unknown' if host is None else host] += count
+        self.api_keys.update(api_keys)
+
+    def discard(self, hosts, api_keys):
+        for counter, counts in ((self.hosts, {'unknown' if h is None else h: c for h, c in hosts.items()}),
+                                (self.api_keys, api_keys)):
+            for value, count in counts.items():
+                remaining = counter.get(value, 0) - count
+                if remaining > 0:
+                    counter[value] = remaining
+                else:
+                    counter.pop(value, None)
+
+    def clear(self):
+        self.hosts = Counter()
+        self.api_keys = Counter()
+
+    def snapshot(self, prefix=None, limit=None):
+        """
+        返回 (hosts, api_keys)：hosts 为 [(网站, 记录数)]，api_keys 为 [(名称, key, 记录数)]（同一名称取记录最多的 key）。
+        给出 prefix 时按前缀（不区分大小写）过滤网站与名称 / key，并按记录数从多到少取前 limit 个；否则按名称排序
+        """
+        hosts = list(self.hosts.items())
+        by_name = {}
+        for (key, name), count in list(self.api_keys.items()):
+            if not name or name == 'unknown':
+                continue
+            entry = by_name.setdefault(name, [key or name, 0, 0])
+            entry[2] += count
+            if count > entry[1]:
+                entry[0], entry[1] = key or name, count
+        api_keys = [(name, key, total) for name, (key, _, total) in by_name.items()]
+        if prefix:
+            prefix = prefix.lower()
+            hosts = [h for h in hosts if str(h[0]).lower().startswith(prefix)]
+            api_keys = [k for k in api_keys if k[0].lower().startswith(prefix) or str(k[1]).lower().startswith(prefix)]
+            hosts.sort(key=lambda h: -h[1])
+            api_keys.sort(key=lambda k: -k[2])
+            return hosts[:limit], api_keys[:limit]
+        hosts.sort(key=lambda h: str(h[0]))
+        api_keys.sort()
+        return hosts, api_keys
 
 
 class RecognitionHistory:
-    def __init__(self, max_records=10000, history_file='recognition_history.json'):
+    def __init__(self, max_records=HISTORY_MAX_RECORDS, history_file='recognition_history.json',
+                 log_dir=HISTORY_LOG_DIR, backend=HISTORY_BACKEND, durability=HISTORY_DURABILITY):
         self.max_records = max_records
+        # 旧版整文件 JSON，仅用于首次启动时迁移到分段日志
         self.history_file = history_file
-        self.records = deque(maxlen=max_records)
+        # none：只写入系统缓冲；batch：每批落盘后 fsync；interval：至多每 HISTORY_FSYNC_INTERVAL 秒 fsync 一次
+        if durability not in ('none', 'batch', 'interval'):
+            logger.warning(f'⚠️  [识别历史] 未知的持久化模式 {durability}，使用 none')
+            durability = 'none'
+        self.durability = durability
+        self.last_sync_time = time.time()
+        self.unsynced = False
+        self.log = SegmentLog(log_dir, HISTORY_SEGMENT_RECORDS, sync_on_roll=durability != 'none')
+        # sqlite 后端：记录写入数据库，按时间保留，查询走索引；memory 后端：内存列式缓冲 + 分段日志
+        self.sql_store = SQLiteHistoryStore(HISTORY_DB, HISTORY_RETENTION_DAYS,
+                                            synchronous='FULL' if durability == 'batch' else 'NORMAL') \
+            if backend == 'sqlite' else None
+        self.last_purge_time = 0
+        self.stats_file = os.path.join(log_dir, 'stats.json')
+        self.ring = ColumnarHistoryRing(max_records, on_evict=self._on_evict)
+        # 筛选项用的去重计数（网站、API Key、Key 名称）
+        self.distinct = DistinctValues()
+        # 分钟 / 小时预聚合桶：按时间范围统计时不再扫描记录，保留期远长于原始记录
+        self.rollup = TimeBucketRollup()
+        self.rollup_file = os.path.join(log_dir, 'rollups.json')
+        self.last_rollup_save = 0
+        self.last_compact_time = 0
+        # 已进入内存但尚未追加到日志的记录
+        self.pending = []
         self.stats = {
             'total': 0,
             'success': 0,
@@ -27,47 +187,116 @@ class RecognitionHistory:
             'by_host': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
             'by_model': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
         }
+        # 只串行化写入与落盘；记录查询与时间范围统计读取无锁快照，不会让 add_record 等待
         self.lock = threading.Lock()
-        import queue
-        self.write_queue = queue.Queue()
+        # 串行化多个落盘者（后台线程、关闭时保存、清空）；落盘的文件写入不持有 self.lock
+        self.flush_lock = threading.Lock()
+        self.flush_stats = {
+            'flushes': 0,
+            'failures': 0,
+            'records': 0,
+            'last_duration_ms': 0.0,
+            'max_duration_ms': 0.0,
+            'last_lock_hold_ms': 0.0,
+            'max_lock_hold_ms': 0.0,
+        }
+        # 攒够一批时由 add_record 唤醒后台线程；关闭时由 close 唤醒
+        self.flush_cond = threading.Condition(self.lock)
+        self.closing = False
         self.unsaved_count = 0
         self.BATCH_SIZE = 10
-        self.flush_interval = 60
+        self.flush_interval = HISTORY_FLUSH_INTERVAL
         self.last_save_time = time.time()
+        # 后台载入结束（成功或失败）时置位；清空历史时递增代数，丢弃尚未拼接的载入结果
+        self.loaded = threading.Event()
+        self.clear_generation = 0
         self._start_background_writer()
         self.load_history()
-        logger.info('📊 [识别历史] 初始化完成（异步批量写入已启用）')
+        logger.info(f'📊 [识别历史] 初始化完成（异步批量写入已启用，持久化模式 {durability}）')
 
     def _start_background_writer(self):
-        def background_writer():
-            while True:
-                try:
-                    if not self.write_queue.empty() or time.time() - self.last_save_time > self.flush_interval:
-                        if self.unsaved_count > 0:
-                            with self.lock:
-                                self._save_history_internal()
-                                self.unsaved_count = 0
-                                self.last_save_time = time.time()
-                                logger.debug(f"💾 [识别历史] 后台批量保存了 {len(self.records)} 条记录")
-                        time.sleep(1)
-                    else:
-                        time.sleep(5)
-                except Exception as e:
-                    logger.error(f"❌ [识别历史] 后台写入线程异常: {str(e)}")
-                    time.sleep(5)
-        threading.Thread(target=background_writer, daemon=True, name="HistoryWriter").start()
+        self.writer_thread = threading.Thread(target=self._background_writer, daemon=True, name="HistoryWriter")
+        self.writer_thread.start()
         logger.info("📝 [识别历史] 后台写入线程已启动")
 
+    def _next_wakeup(self, now, idle_deadline):
+        """距离下一次必须醒来的秒数：有未落盘记录时到落盘间隔，interval 模式下有未同步数据时到 fsync 间隔"""
+        deadline = self.last_save_time + self.flush_interval if self.unsaved_count else idle_deadline
+        if self.durability == 'interval' and self.unsynced:
+            deadline = min(deadline, self.last_sync_time + HISTORY_FSYNC_INTERVAL)
+        return deadline - now
+
+    def _background_writer(self):
+        """
+        条件变量驱动：攒够一批、到达落盘间隔或收到关闭请求时才醒来落盘，不再轮询；
+        空闲时每个落盘间隔醒来一次，顺带执行 sqlite 保留期清理
+        """
+        while True:
+            try:
+                with self.flush_cond:
+                    idle_deadline = time.time() + self.flush_interval
+                    while not self.closing and self.unsaved_count < self.BATCH_SIZE:
+                        remaining = self._next_wakeup(time.time(), idle_deadline)
+                        if remaining <= 0:
+                            break
+                        self.flush_cond.wait(remaining)
+                    closing = self.closing
+                if self.unsaved_count > 0 or closing:
+                    with self.flush_lock:
+                        self._save_history_internal(force_rollups=closing)
+                    logger.debug(f"💾 [识别历史] 后台批量追加写入完成，内存中共 {len(self.ring)} 条记录")
+                if self.durability == 'interval' and self.unsynced and \
+                        (closing or time.time() - self.last_sync_time >= HISTORY_FSYNC_INTERVAL):
+                    self._sync_storage()
+                if closing:
+                    return
+                self._purge_expired()
+                self._compact_rollups()
+            except Exception as e:
+                logger.error(f"❌ [识别历史] 后台写入线程异常: {str(e)}")
+                if self.closing:
+                    return
+                time.sleep(1)
+
+    def _sync_storage(self):
+        """把已追加的记录 fsync 到磁盘（sqlite 的同步由 synchronous 设置负责）"""
+        with self.flush_lock:
+            if self.sql_store is None:
+                self.log.sync()
+            self.unsynced = False
+            self.last_sync_time = time.time()
+
+    def close(self, timeout=HISTORY_CLOSE_TIMEOUT):
+        """
+        通知后台线程做最后一次落盘后退出，最多等待 timeout 秒，返回是否按时完成。
+        可重复调用（atexit 与信号处理都会调用）
+        """
+        with self.flush_cond:
+            self.closing = True
+            self.flush_cond.notify_all()
+        self.writer_thread.join(timeout)
+        if self.writer_thread.is_alive():
+            logger.warning(f'⚠️  [识别历史] {timeout} 秒内未完成落盘，{len(self.pending)} 条记录未保存')
+            return False
+        with self.flush_lock:
+            self.log.close()
+            if self.sql_store is not None:
+                self.sql_store.close()
+        return True
+
     def add_record(self, record_data):
         with self.lock:
             record = {'timestamp': time.time(), 'datetime': datetime.now().isoformat(), **record_data}
-            self.records.append(record)
+            if self.sql_store is None:
+                # 序号随记录写入日志，重启后据此接续
+                record['seq'] = self.ring.append(record)
+            self.pending.append(record)
             self._update_stats(record)
+            self.rollup.add(record)
+            self.distinct.add(record)
             self.unsaved_count += 1
-            if self.unsaved_count >= self.BATCH_SIZE:
-                self.write_queue.put(('save',))
-            if time.time() - self.last_save_time > self.flush_interval:
-                self.write_queue.put(('save',))
+            if self.unsaved_count == self.BATCH_SIZE:
+                self.flush_cond.notify()
 
     def _update_stats(self, record):
         self.stats['total'] += 1
@@ -94,186 +323,435 @@ class RecognitionHistory:
         else:
             self.stats['by_model'][model]['failed'] += 1
 
-    def get_recent_records(self, limit=50, ocr_type=None, host=None, api_key=None, status=None, start_date=None, end_date=None):
+    def _on_evict(self, chunk):
+        """列式缓冲整块淘汰时（已持有 self.lock）扣减去重计数"""
+        self.distinct.discard(*self.ring.value_counts(chunk))
+
+    def _purge_expired(self):
+        """sqlite 后端每小时按保留期清理一次（数据库操作不持有内存锁）"""
+        if self.sql_store is None or time.time() - self.last_purge_time < 3600:
+            return
+        self.last_purge_time = time.time()
+        cutoff = time.time() - self.sql_store.retention_days * 86400
+        hosts, api_keys = self.sql_store.distinct_counts(cutoff)
+        if self.sql_store.purge_before(cutoff):
+            with self.lock:
+                self.distinct.discard(hosts, api_keys)
+
+    def _compact_rollups(self):
+        """
+        分层保留的后台压缩：每 HISTORY_COMPACT_INTERVAL 秒丢弃超过保留期的分钟桶与小时桶，
+        内存与 rollups.json 的大小只与保留期内的桶数有关（只删除字典条目，持锁时间很短）
+        """
+        now = time.time()
+        if now - self.last_compact_time < HISTORY_COMPACT_INTERVAL:
+            return
+        self.last_compact_time = now
         with self.lock:
-            records = list(self.records)
-            if ocr_type is not None:
-                records = [r for r in records if r.get('ocr_type') == ocr_type]
-            if host is not None:
-                records = [r for r in records if r.get('host') == host]
-            if api_key is not None:
-                records = [r for r in records if r.get('api_key') == api_key]
-            if status is not None:
-                if status == 'success':
-                    records = [r for r in records if r.get('success', False)]
-                elif status == 'failed':
-                    records = [r for r in records if not r.get('success', False)]
-            if start_date is not None:
-                records = [r for r in records if r.get('timestamp', 0) >= start_date]
-            if end_date is not None:
-                records = [r for r in records if r.get('timestamp', 0) <= end_date]
-            return records[-limit:][::-1]
+            minutes, hours = self.rollup.compact(now)
+        if minutes or hours:
+            logger.debug(f'🧹 [识别历史] 压缩预聚合：丢弃 {minutes} 个分钟桶、{hours} 个小时桶')
+
+    def get_filter_values(self, prefix=None, limit=20):
+        """筛选项：现存记录中的网站与 API Key（含记录数），耗时只与不同取值的个数有关"""
+        return self.distinct.snapshot(prefix=prefix, limit=limit)
+
+    def _flush_for_read(self):
+        """
+        sqlite 后端查询前把待写记录落盘，使刚识别的记录立即可查（内存后端记录写入时即进入列式缓冲）。
+        持 flush_lock 同时等待进行中的落盘完成：其记录已移出待写缓冲、尚未写入数据库
+        """
+        if self.sql_store is None:
+            return
+        with self.flush_lock:
+            if self.pending:
+                self._save_history_internal()
+
+    def query_page(self, limit=50, before=None, after=None, ocr_type=None, host=None, api_key=None,
+                   status=None, start_date=None, end_date=None):
+        """
+        游标分页查询：before / after 为 (timestamp, seq) 游标，分别取更旧 / 更新的一页，记录按时间倒序。
+        首页（不带游标）同时返回筛选统计，翻页时不再重复统计，每页开销只与页大小有关。
+        返回 {'records', 'stats', 'next_cursor', 'prev_cursor'}
+        """
+        filters = dict(ocr_type=ocr_type, host=host, api_key=api_key, status=status,
+                       start_date=start_date, end_date=end_date)
+        first_page = before is None and after is None
+        # 多取一条用于判断游标方向上是否还有记录
+        if self.sql_store is not None:
+            self._flush_for_read()
+            records, stats = self.sql_store.query(limit=limit + 1, with_stats=first_page,
+                                                  before=before, after=after, **filters)
+        else:
+            records, stats = self.ring.query(limit=limit + 1, with_stats=first_page,
+                                             before=before and before[1], after=after and after[1], **filters)
+        has_more = len(records) > limit
+        if after is not None:
+            page = records[-limit:] if limit > 0 else []
+            next_cursor = encode_cursor(page[-1]) if page else None
+            prev_cursor = encode_cursor(page[0]) if has_more else None
+        else:
+            page = records[:limit]
+            next_cursor = encode_cursor(page[-1]) if has_more else None
+            prev_cursor = encode_cursor(page[0]) if before is not None and page else None
+        return {'records': page, 'stats': stats, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+    def get_recent_records(self, limit=50, ocr_type=None, host=None, api_key=None, status=None, start_date=None, end_date=None):
+        filters = dict(ocr_type=ocr_type, host=host, api_key=api_key, status=status,
+                       start_date=start_date, end_date=end_date)
+        if self.sql_store is not None:
+            self._flush_for_read()
+            return self.sql_store.query_records(limit=limit, **filters)
+        return self.ring.query_records(limit=limit, **filters)
+
+    def iter_records(self, batch_size=1000, ocr_type=None, host=None, api_key=None, status=None,
+                     start_date=None, end_date=None):
+        """
+        按时间倒序分批产出筛选后的全部记录，供流式导出使用。
+        以游标逐页查询，每批各取一次无锁快照（SQLite 为一次独立查询），内存占用只与批大小有关
+        """
+        filters = dict(ocr_type=ocr_type, host=host, api_key=api_key, status=status,
+                       start_date=start_date, end_date=end_date)
+        before = None
+        self._flush_for_read()
+        while True:
+            if self.sql_store is not None:
+                records, _ = self.sql_store.query(limit=batch_size, with_stats=False, before=before, **filters)
+            else:
+                records, _ = self.ring.query(limit=batch_size, with_stats=False,
+                                             before=before and before[1], **filters)
+            if records:
+                yield records
+            if len(records) < batch_size:
+                return
+            before = (records[-1]['timestamp'], records[-1]['seq'])
 
     def get_filtered_stats(self, ocr_type=None, host=None, api_key=None, status=None, start_date=None, end_date=None):
+        filters = dict(ocr_type=ocr_type, host=host, api_key=api_key, status=status,
+                       start_date=start_date, end_date=end_date)
+        if self.sql_store is not None:
+            self._flush_for_read()
+            return self.sql_store.filtered_stats(**filters)
+        return self.ring.filtered_stats(**filters)
+
+    def get_stats(self, time_range=None, start=None, end=None):
+        """
+        指定时间窗口（最近 time_range 秒，或 [start, end]）时累加预聚合桶，耗时只与窗口内的桶数有关；
+        否则返回累计统计，耗时分位数取自预聚合的整个保留期；
+        累计统计不按 API Key 计数，by_api_key（计数与耗时分位数）同样取自预聚合的整个保留期
+        """
+        now = time.time()
+        if time_range is not None or start is not None or end is not None:
+            end = now if end is None else end
+            if start is None:
+                start = end - time_range if time_range is not None else 0
+            return self.rollup.query(start, end)
+        windowed = self.rollup.query(0, now)
         with self.lock:
-            records = list(self.records)
-            if ocr_type is not None:
-                records = [r for r in records if r.get('ocr_type') == ocr_type]
-            if host is not None:
-                records = [r for r in records if r.get('host') == host]
-            if api_key is not None:
-                records = [r for r in records if r.get('api_key') == api_key]
-            if status is not None:
-                if status == 'success':
-                    records = [r for r in records if r.get('success', False)]
-                elif status == 'failed':
-                    records = [r for r in records if not r.get('success', False)]
-            if start_date is not None:
-                records = [r for r in records if r.get('timestamp', 0) >= start_date]
-            if end_date is not None:
-                records = [r for r in records if r.get('timestamp', 0) <= end_date]
-
-            total = len(records)
-            success = sum(1 for r in records if r.get('success', False))
-            failed = total - success
             stats = {
-                'total': total,
-                'success': success,
-                'failed': failed,
-                'success_rate': success / total if total > 0 else 0,
-                'by_type': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                'by_host': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                'by_model': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                'by_api_key': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
+                'total': self.stats['total'],
+                'success': self.stats['success'],
+                'failed': self.stats['failed'],
+                'success_rate': self.stats['success'] / self.stats['total'] if self.stats['total'] > 0 else 0,
+                'by_type': {k: dict(v) for k, v in self.stats['by_type'].items()},
+                'by_host': {k: dict(v) for k, v in self.stats['by_host'].items()},
+                'by_model': {k: dict(v) for k, v in self.stats['by_model'].items()},
             }
-            for record in records:
-                ocr_type_val = str(record.get('ocr_type', 'unknown'))
-                host_val = record.get('host', 'unknown')
-                model_val = record.get('model', 'unknown')
-                api_key_val = record.get('api_key_name', record.get('api_key', 'unknown'))
-                success_val = record.get('success', False)
-                stats['by_type'][ocr_type_val]['total'] += 1
-                stats['by_host'][host_val]['total'] += 1
-                stats['by_model'][model_val]['total'] += 1
-                stats['by_api_key'][api_key_val]['total'] += 1
-                if success_val:
-                    stats['by_type'][ocr_type_val]['success'] += 1
-                    stats['by_host'][host_val]['success'] += 1
-                    stats['by_model'][model_val]['success'] += 1
-                    stats['by_api_key'][api_key_val]['success'] += 1
-                else:
-                    stats['by_type'][ocr_type_val]['failed'] += 1
-                    stats['by_host'][host_val]['failed'] += 1
-                    stats['by_model'][model_val]['failed'] += 1
-                    stats['by_api_key'][api_key_val]['failed'] += 1
-            stats['by_type'] = dict(stats['by_type'])
-            stats['by_host'] = dict(stats['by_host'])
-            stats['by_model'] = dict(stats['by_model'])
-            stats['by_api_key'] = dict(stats['by_api_key'])
-            return stats
-
-    def get_stats(self, time_range=None):
+        stats['latency'] = windowed['latency']
+        stats['by_api_key'] = windowed['by_api_key']
+        for dimension in ('by_type', 'by_host', 'by_model'):
+            for label, entry in stats[dimension].items():
+                entry['latency'] = windowed[dimension].get(label, {}).get('latency')
+        return stats
+
+    def get_trends(self, start, end, step='hour', dimension=None, value=None, group_by=None, limit=10):
+        """
+        长期趋势：按 step（minute / hour / day）汇总 [start, end] 内的预聚合桶，时间范围可远超原始记录的保留期。
+        dimension / value 只看某一分项（如 host='www.example.com'）；group_by 按分项分组，返回记录数最多的 limit 组
+        """
+        seconds = TREND_STEPS[step]
+        if group_by is not None:
+            return {'step': step, 'groups': self.rollup.breakdown(start, end, seconds, TREND_DIMENSIONS[group_by], limit)}
+        return {'step': step, 'series': self.rollup.series(start, end, seconds,
+                                                           dimension and TREND_DIMENSIONS[dimension], value)}
+
+    def _stats_snapshot(self):
+        """复制累计统计（分项也逐个复制），供锁外序列化"""
+        return {
+            'total': self.stats['total'],
+            'success': self.stats['success'],
+            'failed': self.stats['failed'],
+            'by_type': {k: dict(v) for k, v in self.stats['by_type'].items()},
+            'by_host': {k: dict(v) for k, v in self.stats['by_host'].items()},
+            'by_model': {k: dict(v) for k, v in self.stats['by_model'].items()},
+        }
+
+    def _save_rollups(self):
+        """预聚合桶较大，按落盘间隔单独保存（复制不需要持锁）"""
+        _write_json_atomic(self.rollup_file, self.rollup.to_dict(), separators=(',', ':'))
+        self.last_rollup_save = time.time()
+
+    def _save_history_internal(self, force_rollups=False):
+        """
+        把尚未落盘的记录追加到分段日志（或 SQLite），并更新统计快照（记录本身不会重复写入）。
+        持锁只交换待写缓冲并复制统计，序列化与文件写入都在锁外进行，不阻塞 add_record。
+        调用方需持有 flush_lock，且不能持有 self.lock
+        """
+        started = time.perf_counter()
         with self.lock:
-            if time_range is None:
-                return {
-                    'total': self.stats['total'],
-                    'success': self.stats['success'],
-                    'failed': self.stats['failed'],
-                    'success_rate': self.stats['success'] / self.stats['total'] if self.stats['total'] > 0 else 0,
-                    'by_type': dict(self.stats['by_type']),
-                    'by_host': dict(self.stats['by_host']),
-                    'by_model': dict(self.stats['by_model']),
-                }
-            else:
-                cutoff_time = time.time() - time_range
-                recent_records = [r for r in self.records if r['timestamp'] >= cutoff_time]
-                stats = {
-                    'total': len(recent_records),
-                    'success': sum(1 for r in recent_records if r.get('success', False)),
-                    'failed': sum(1 for r in recent_records if not r.get('success', False)),
-                    'by_type': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                    'by_host': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                    'by_model': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                }
-                stats['success_rate'] = stats['success'] / stats['total'] if stats['total'] > 0 else 0
-                for record in recent_records:
-                    ocr_type = str(record.get('ocr_type', 'unknown'))
-                    host = record.get('host', 'unknown')
-                    model = record.get('model', 'unknown')
-                    success = record.get('success', False)
-                    stats['by_type'][ocr_type]['total'] += 1
-                    stats['by_host'][host]['total'] += 1
-                    stats['by_model'][model]['total'] += 1
-                    if success:
-                        stats['by_type'][ocr_type]['success'] += 1
-                        stats['by_host'][host]['success'] += 1
-                        stats['by_model'][model]['success'] += 1
-                    else:
-                        stats['by_type'][ocr_type]['failed'] += 1
-                        stats['by_host'][host]['failed'] += 1
-                        stats['by_model'][model]['failed'] += 1
-                stats['by_type'] = dict(stats['by_type'])
-                stats['by_host'] = dict(stats['by_host'])
-                stats['by_model'] = dict(stats['by_model'])
-                return stats
-
-    def _save_history_internal(self):
+            pending, self.pending = self.pending, []
+            self.unsaved_count = 0
+            self.last_save_time = time.time()
+            stats = self._stats_snapshot()
+            next_seq = self.ring.next_seq
+        lock_held = time.perf_counter() - started
+        written = 0
         try:
-            data = {
-                'records': list(self.records),
-                'stats': {
-                    'total': self.stats['total'],
-                    'success': self.stats['success'],
-                    'failed': self.stats['failed'],
-                    'by_type': dict(self.stats['by_type']),
-                    'by_host': dict(self.stats['by_host']),
-                    'by_model': dict(self.stats['by_model']),
-                },
-                'saved_at': datetime.now().isoformat()
-            }
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.info(f'💾 [识别历史] 已保存 {len(self.records)} 条记录')
+            if pending:
+                if self.sql_store is not None:
+                    written = self.sql_store.insert_many(pending)
+                else:
+                    written = self.log.append(pending)
+                    self.log.compact(self.max_records)
+                    if self.durability == 'batch':
+                        self.log.sync()
+                self.unsynced = self.durability != 'batch'
         except Exception as e:
+            # 写入失败的记录放回缓冲头部，下次落盘重试
+            with self.lock:
+                self.pending[:0] = pending
+                self.unsaved_count += len(pending)
+            self.flush_stats['failures'] += 1
             logger.error(f'❌ [识别历史] 保存失败: {str(e)}')
+            return
+        try:
+            _write_json_atomic(self.stats_file, {'stats': stats, 'next_seq': next_seq,
+                                                 'saved_at': datetime.now().isoformat()},
+                               fsync=self.durability == 'batch')
+            if force_rollups or time.time() - self.last_rollup_save >= self.flush_interval:
+                self._save_rollups()
+        except Exception as e:
+            self.flush_stats['failures'] += 1
+            logger.error(f'❌ [识别历史] 保存统计失败: {str(e)}')
+        duration = time.perf_counter() - started
+        metrics = self.flush_stats
+        metrics['flushes'] += 1
+        metrics['records'] += written
+        metrics['last_duration_ms'] = round(duration * 1000, 3)
+        metrics['max_duration_ms'] = max(metrics['max_duration_ms'], metrics['last_duration_ms'])
+        metrics['last_lock_hold_ms'] = round(lock_held * 1000, 3)
+        metrics['max_lock_hold_ms'] = max(metrics['max_lock_hold_ms'], metrics['last_lock_hold_ms'])
+        if written:
+            logger.info(f'💾 [识别历史] 已追加 {written} 条记录'
+                        f'（耗时 {duration * 1000:.1f} ms，持锁 {lock_held * 1000:.3f} ms）')
 
     def save_history(self):
-        with self.lock:
-            self._save_history_internal()
+        with self.flush_lock:
+            self._save_history_internal(force_rollups=True)
+
+    def get_flush_stats(self):
+        """落盘诊断：次数、失败数、耗时与持锁时间，以及尚未落盘的记录数"""
+        return {**self.flush_stats, 'pending': len(self.pending), 'durability': self.durability,
+                'rollup': self.rollup.get_info()}
+
+    def _merge_stats(self, stats_data):
+        """把持久化的累计统计加到当前统计上（启动时当前统计为空；迁移旧版文件时与载入期间的新记录相加）"""
+        for key in ('total', 'success', 'failed'):
+            self.stats[key] += stats_data.get(key, 0)
+        for key in ('by_type', 'by_host', 'by_model'):
+            for label, bucket in stats_data.get(key, {}).items():
+                target = self.stats[key][label]
+                for field in ('total', 'success', 'failed'):
+                    target[field] += bucket.get(field, 0)
 
     def load_history(self):
+        """
+        同步部分只读小文件：累计统计、预聚合桶、日志末尾的序号，随后即可接收新记录；
+        记录本身由后台线程分段流式载入，完成后接到内存缓冲的最前面，进度见 get_load_progress
+        """
+        rebuild_rollups = migrate = import_log = False
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.records = deque(data.get('records', []), maxlen=self.max_records)
-                stats_data = data.get('stats', {})
-                self.stats['total'] = stats_data.get('total', 0)
-                self.stats['success'] = stats_data.get('success', 0)
-                self.stats['failed'] = stats_data.get('failed', 0)
-                for key in ['by_type', 'by_host', 'by_model']:
-                    if key in stats_data:
-                        self.stats[key] = defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}, stats_data[key])
-                logger.info(f'📥 [识别历史] 已加载 {len(self.records)} 条记录')
+            persisted_next_seq = 0
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                self._merge_stats(saved.get('stats', {}))
+                persisted_next_seq = saved.get('next_seq', 0)
+            # 没有预聚合文件（首次升级）时用载入的记录重建
+            rebuild_rollups = not os.path.exists(self.rollup_file)
+            if not rebuild_rollups:
+                with open(self.rollup_file, 'r', encoding='utf-8') as f:
+                    self.rollup.load_dict(json.load(f))
+            migrate = self.log.is_empty() and os.path.exists(self.history_file)
+            if self.sql_store is not None:
+                # 首次切换到 sqlite 时导入分段日志中的记录
+                import_log = migrate or (self.sql_store.is_empty() and not self.log.is_empty())
+            else:
+                # 新记录的序号接在已持久化的记录之后（旧版无序号的记录按日志中的位置编号）
+                last = self.log.read_last() or {}
+                self.ring.next_seq = max(persisted_next_seq, self.log.total_records, last.get('seq', -1) + 1)
         except Exception as e:
-            logger.warning(f'⚠️  [识别历史] 加载失败: {str(e)}，使用空记录')
-    
-    def clear_history(self):
-        """清除所有识别历史记录"""
+            logger.warning(f'⚠️  [识别历史] 读取统计失败: {str(e)}')
+        self.load_progress = {'state': 'loading', 'loaded': 0, 'expected': 0,
+                              'started_at': time.time(), 'duration_ms': None}
+        threading.Thread(target=self._background_load, args=(rebuild_rollups, migrate, import_log),
+                         daemon=True, name='HistoryLoader').start()
+
+    def _migrate_legacy_file(self):
+        """
+        旧版 recognition_history.json 迁移为序号最小的日志段（序号取负数，排在所有新记录之前），
+        累计统计与载入期间的新记录相加，迁移后改名保留。返回迁移的记录
+        """
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        records = data.get('records', [])
+        for i, record in enumerate(records):
+            record['seq'] = i - len(records)
+        with self.flush_lock:
+            self.log.prepend_segment(records)
         with self.lock:
-            self.records.clear()
-            self.stats = {
-                'total': 0,
-                'success': 0,
-                'failed': 0,
-                'by_type': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                'by_host': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-                'by_model': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
-            }
-            self.unsaved_count = 0
-            # 保存空历史到文件
-            self._save_history_internal()
-            logger.info('🗑️ [识别历史] 所有记录已清除')
+            self._merge_stats(data.get('stats', {}))
+        os.replace(self.history_file, self.history_file + '.migrated')
+        logger.info(f'📦 [识别历史] 已将旧版历史文件迁移到分段日志（{len(records)} 条记录）')
+        return records
+
+    def _background_load(self, rebuild_rollups, migrate, import_log):
+        """后台载入：在私有缓冲中流式解析，最后持锁拼接，期间 add_record 不受影响"""
+        started = time.time()
+        generation = self.clear_generation
+        rollup = TimeBucketRollup() if rebuild_rollups else None
+        try:
+            legacy = self._migrate_legacy_file() if migrate else None
+            if self.sql_store is not None:
+                if import_log:
+                    self._import_log_to_sqlite(legacy, rollup)
+                hosts, api_keys = self.sql_store.distinct_counts(cutoff=started)
+                with self.lock:
+                    if generation == self.clear_generation:
+                        self.distinct.merge(hosts, api_keys)
+                        if rollup is not None:
+                            self.rollup.merge(rollup)
+            else:
+                loaded = self._load_ring(legacy, rollup)
+                # 去重计数要用载入缓冲自己的字典解码，须在改写编码之前统计
+                hosts, api_keys = Counter(), Counter()
+                for chunk in loaded.chunks:
+                    chunk_hosts, chunk_keys = loaded.value_counts(chunk)
+                    hosts.update(chunk_hosts)
+                    api_keys.update(chunk_keys)
+                with self.lock:
+                    remap, splice = self.ring.adopt(loaded)
+                remap()
+                with self.lock:
+                    if generation == self.clear_generation:
+                        self.distinct.merge(hosts, api_keys)
+                        splice()
+                        if rollup is not None:
+                            self.rollup.merge(rollup)
+                logger.info(f'📥 [识别历史] 已加载 {loaded.count} 条记录'
+                            f'（列存储 {self.ring.get_memory_usage() / 1024 / 1024:.1f} MB，'
+                            f'耗时 {time.time() - started:.2f} 秒）')
+            self.load_progress['state'] = 'ready'
+        except Exception as e:
+            self.load_progress['state'] = 'failed'
+            logger.warning(f'⚠️  [识别历史] 加载失败: {str(e)}，仅保留启动后的新记录')
+        self.load_progress['duration_ms'] = round((time.time() - started) * 1000, 1)
+        self.loaded.set()
+
+    def _load_ring(self, legacy, rollup):
+        """把最近的记录流式读入一个私有列式缓冲（序号都小于启动后的新记录）"""
+        loaded = ColumnarHistoryRing(self.max_records, chunk_size=self.ring.chunk_size)
+        live_start = self.ring.next_seq
+        if legacy is not None:
+            source = legacy[-self.max_records:] if self.max_records else []
+            position = 0
+            self.load_progress['expected'] = len(source)
+        else:
+            with self.flush_lock:
+                segments = self.log.select_recent(self.max_records)
+                # 旧版无序号的记录按其在日志中的位置编号
+                position = self.log.total_records - sum(count for _, count in segments)
+            self.load_progress['expected'] = sum(count for _, count in segments)
+            source = self.log.read_recent(self.max_records, segments=segments)
+        last_seq = None
+        for record in source:
+            seq = record.get('seq')
+            if seq is None:
+                seq = position
+            if last_seq is not None and seq <= last_seq:
+                seq = last_seq + 1
+            position += 1
+            if seq >= live_start:
+                break  # 启动后写入的记录已在内存中
+            loaded.append(record, seq=seq)
+            last_seq = seq
+            if rollup is not None:
+                rollup.add(record)
+            self.load_progress['loaded'] += 1
+        return loaded
+
+    def _import_log_to_sqlite(self, legacy, rollup, batch_size=5000):
+        """把分段日志（或刚迁移的旧版记录）分批导入 SQLite"""
+        with self.flush_lock:
+            segments = self.log.select_recent(self.log.total_records)
+        source = legacy if legacy is not None else self.log.read_recent(0, segments=segments)
+        self.load_progress['expected'] = len(legacy) if legacy is not None else sum(c for _, c in segments)
+        batch = []
+        imported = 0
+        for record in source:
+            if record.get('timestamp', 0) >= self.load_progress['started_at']:
+                break  # 启动后写入的记录已由后台写入线程存入数据库
+            batch.append(record)
+            if rollup is not None:
+                rollup.add(record)
+            if len(batch) >= batch_size:
+                imported += self.sql_store.insert_many(batch)
+                self.load_progress['loaded'] = imported
+                batch = []
+        imported += self.sql_store.insert_many(batch)
+        self.load_progress['loaded'] = imported
+        logger.info(f'📦 [识别历史] 已将分段日志中的 {imported} 条记录导入 SQLite')
+
+    def wait_loaded(self, timeout=None):
+        """等待后台载入结束，返回是否已结束"""
+        return self.loaded.wait(timeout)
+
+    def get_load_progress(self):
+        """后台载入进度，供 /health 展示"""
+        progress = dict(self.load_progress)
+        expected = progress['expected']
+        progress['progress'] = 1.0 if progress['state'] != 'loading' else \
+            (round(min(progress['loaded'] / expected, 1.0), 3) if expected else 0.0)
+        return progress
+
+    def clear_history(self):
+        """
+        清除所有识别历史记录：持 self.lock 只换入空的内存状态，删除日志段 / 数据库记录在锁外进行，不阻塞 add_record。
+        全程持有 flush_lock，期间新增的记录留在待写缓冲，清除后才落盘，不会被一并删除
+        """
+        with self.flush_lock:
+            with self.lock:
+                self.ring.clear()
+                self.rollup.clear()
+                self.distinct.clear()
+                self.clear_generation += 1
+                self.stats = {
+                    'total': 0,
+                    'success': 0,
+                    'failed': 0,
+                    'by_type': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
+                    'by_host': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
+                    'by_model': defaultdict(lambda: {'total': 0, 'success': 0, 'failed': 0}),
+                }
+                self.unsaved_count = 0
+                self.pending = []
+            # 删除日志段（或数据库记录）
+            self.log.clear()
+            if self.sql_store is not None:
+                self.sql_store.clear()
+            # 保存空统计（仍持有 flush_lock，期间不会有其他落盘）
+            self._save_history_internal(force_rollups=True)
+        logger.info('🗑️ [识别历史] 所有记录已清除')
 
 
 class ModelManager:
@@ -333,6 +811,7 @@ class ModelManager:
 recognition_history = RecognitionHistory()
 model_manager = ModelManager()
 
-__all__ = ['RecognitionHistory', 'ModelManager', 'recognition_history', 'model_manager']
+__all__ = ['RecognitionHistory', 'DistinctValues', 'ModelManager', 'recognition_history', 'model_manager', 'encode_cursor', 'decode_cursor',
+           'EXPORT_FORMATS', 'export_chunks', 'TREND_STEPS', 'TREND_DIMENSIONS']
 
 
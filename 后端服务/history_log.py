@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别历史分段日志模块：追加写的 JSONL 段文件，每条记录只写一次。
+当前段写满后滚动到新段，压缩时整段删除最旧的段以控制总条数；启动时只读回最近的若干段。
+新代码可 from history_log import SegmentLog
+"""
+
+import os
+import re
+import json
+from logger_config import logger
+
+_SEGMENT_PATTERN = re.compile(r'^segment-(\d{6,})\.jsonl$')
+
+
+def _count_lines(path):
+    """按块统计换行符数量，无需逐行解析 JSON"""
+    count = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                return count
+            count += block.count(b'\n')
+
+
+class SegmentLog:
+    """
+    分段 JSONL 日志
+
+    目录下的段文件按序号命名（segment-000001.jsonl ...），序号越大越新。
+    只有最新的段处于追加状态，其余段都是只读的，压缩时整段删除即可，无需重写。
+    """
+
+    def __init__(self, directory, segment_records=5000, sync_on_roll=False):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.sync_on_roll = sync_on_roll  # 写满的段关闭前 fsync，之后不再有机会同步它
+        os.makedirs(directory, exist_ok=True)
+        self.segments = []  # [[序号, 记录条数]]，按序号升序
+        for name in os.listdir(directory):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                index = int(match.group(1))
+                self.segments.append([index, _count_lines(self._path(index))])
+        self.segments.sort()
+        self._active = None  # 当前追加段的文件句柄
+
+    def _path(self, index):
+        return os.path.join(self.directory, f'segment-{index:06d}.jsonl')
+
+    @property
+    def total_records(self):
+        return sum(count for _, count in self.segments)
+
+    def is_empty(self):
+        return self.total_records == 0
+
+    def _open_active(self):
+        if not self.segments or self.segments[-1][1] >= self.segment_records:
+            self._roll()
+        if self._active is None:
+            path = self._path(self.segments[-1][0])
+            # 上次崩溃留下的半行不能与新记录粘连，先补一个换行
+            needs_newline = False
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    needs_newline = f.read(1) != b'\n'
+            self._active = open(path, 'a', encoding='utf-8')
+            if needs_newline:
+                self._active.write('\n')
+        return self._active
+
+    def _roll(self):
+        """关闭当前段并开启新段"""
+        self.close()
+        index = self.segments[-1][0] + 1 if self.segments else 1
+        self.segments.append([index, 0])
+
+    def append(self, records):
+        """追加记录，返回写入条数"""
+        written = 0
+        for record in records:
+            f = self._open_active()
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.segments[-1][1] += 1
+            written += 1
+            if self.segments[-1][1] >= self.segment_records:
+                f.flush()
+                if self.sync_on_roll:
+                    os.fsync(f.fileno())
+                self.close()
+        if self._active is not None:
+            self._active.flush()
+        return written
+
+    def prepend_segment(self, records):
+        """把一批比现有记录都旧的记录写成序号最小的段（迁移旧版历史文件时使用），返回写入条数"""
+        index = self.segments[0][0] - 1 if self.segments else 0
+        if index < 0:
+            # 序号已用到 0，无法再往前插入，退化为追加
+            return self.append(records)
+        path = self._path(index)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(path + '.tmp', path)
+        self.segments.insert(0, [index, len(records)])
+        return len(records)
+
+    def compact(self, max_records):
+        """删除最旧的整段，保证剩余记录仍不少于 max_records，返回删除的段数"""
+        removed = 0
+        while len(self.segments) > 1 and self.total_records - self.segments[0][1] >= max_records:
+            index, count = self.segments.pop(0)
+            try:
+                os.remove(self._path(index))
+                removed += 1
+            except OSError as e:
+                logger.warning(f'⚠️  [识别历史] 删除旧日志段失败: {str(e)}')
+                self.segments.insert(0, [index, count])
+                break
+        if removed:
+            logger.info(f'🧹 [识别历史] 压缩日志：删除 {removed} 个旧段，剩余 {self.total_records} 条')
+        return removed
+
+    def select_recent(self, max_records):
+        """最近的若干段（至少包含 max_records 条），返回 [[序号, 条数]] 的副本，按序号升序"""
+        selected = []
+        accumulated = 0
+        for index, count in reversed(self.segments):
+            if accumulated >= max_records:
+                break
+            selected.append([index, count])
+            accumulated += count
+        return selected[::-1]
+
+    def read_recent(self, max_records, segments=None):
+        """
+        从旧到新逐行读回最近的记录（至少 max_records 条所在的段），跳过损坏的行。
+        segments 为 select_recent 事先取得的段列表时，每段只读当时记录的条数，不会读到之后追加的行
+        """
+        bounded = segments is not None
+        for index, count in (segments if bounded else self.select_recent(max_records)):
+            path = self._path(index)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f):
+                    if bounded and line_no >= count:
+                        break
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # 进程崩溃时最后一行可能只写了一半
+                        logger.warning(f'⚠️  [识别历史] 跳过损坏的日志行: {os.path.basename(path)}')
+
+    def read_last(self):
+        """只读最新一段的末尾，返回最后一条完整的记录（没有则返回 None）"""
+        for index, count in reversed(self.segments):
+            path = self._path(index)
+            if not count or not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().split(b'\n')
+            for line in reversed(lines):
+                try:
+                    return json.loads(line.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    continue
+        return None
+
+    def clear(self):
+        """删除所有段"""
+        self.close()
+        for index, _ in self.segments:
+            try:
+                os.remove(self._path(index))
+            except OSError:
+                pass
+        self.segments = []
+
+    def sync(self):
+        """把当前追加段刷入磁盘（fsync）"""
+        if self._active is not None:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+
+    def close(self):
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+
+__all__ = ['SegmentLog']
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别历史列式环形缓冲模块：记录按列存放在定长 NumPy 数组块中，
+网站 / API Key / 模型等重复字符串做字典编码；写满的块建立按类型 / 网站 / API Key 的二级索引，
+时间范围在块内二分定位，一次查询同时得出分页记录与筛选统计，只有真正返回给客户端的记录才还原为 dict。
+已写入的行不再修改、块元组整体替换，查询在无锁快照上进行，不阻塞写入。
+新代码可 from history_ring import ColumnarHistoryRing
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+import numpy as np
+
+_UNKNOWN = 'unknown'
+# 建立二级索引的列（筛选条件中的等值列）
+_INDEXED_COLUMNS = ('ocr_type', 'host', 'api_key')
+_EMPTY_ROWS = np.empty(0, dtype=np.int64)
+
+
+class _Dictionary:
+    """字符串（或任意可哈希值）到整数编码的双向字典，编码只增不减"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        """查询已有编码，不存在返回 None（用于筛选条件）"""
+        return self.codes.get(value)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class _Chunk:
+    """一块定长列存储，写满后不再修改"""
+
+    __slots__ = ('size', 'monotonic', 'index', 'seq', 'timestamp', 'duration', 'success', 'ocr_type', 'host',
+                 'model', 'api_key', 'api_key_name', 'preprocessing', 'result')
+    _COLUMNS = __slots__[3:]
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.monotonic = True  # 块内时间戳非递减时才能二分定位时间范围
+        self.index = None  # 写满后建立的 _ChunkIndex
+        self.seq = np.empty(capacity, dtype=np.int64)
+        self.timestamp = np.empty(capacity, dtype=np.float64)
+        self.duration = np.empty(capacity, dtype=np.float32)  # 缺失为 NaN
+        self.success = np.empty(capacity, dtype=np.bool_)
+        self.ocr_type = np.empty(capacity, dtype=np.int32)
+        self.host = np.empty(capacity, dtype=np.int32)
+        self.model = np.empty(capacity, dtype=np.int32)
+        self.api_key = np.empty(capacity, dtype=np.int32)
+        self.api_key_name = np.empty(capacity, dtype=np.int32)
+        self.preprocessing = np.empty(capacity, dtype=np.int32)
+        self.result = np.empty(capacity, dtype=object)  # 识别结果各不相同，不做编码
+
+    def nbytes(self):
+        size = sum(getattr(self, name).nbytes for name in self._COLUMNS)
+        return size + (self.index.nbytes() if self.index is not None else 0)
+
+    def seal(self):
+        """块写满后不再修改，建立二级索引"""
+        self.index = _ChunkIndex(self)
+
+
+class _ChunkIndex:
+    """
+    封存块的二级索引：每个索引列按编码稳定排序后的行号，以及各编码在其中的起止位置。
+    查找某个编码为一次二分，返回的行号升序（即时间顺序）。
+    """
+
+    __slots__ = ('postings',)
+
+    def __init__(self, chunk):
+        self.postings = {}
+        for column in _INDEXED_COLUMNS:
+            codes = getattr(chunk, column)[:chunk.size]
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            keys, starts = np.unique(codes[order], return_index=True)
+            bounds = np.append(starts, chunk.size).astype(np.int32)
+            self.postings[column] = (keys, bounds, order)
+
+    def lookup(self, column, code):
+        keys, bounds, order = self.postings[column]
+        i = int(np.searchsorted(keys, code))
+        if i >= keys.size or keys[i] != code:
+            return _EMPTY_ROWS
+        return order[bounds[i]:bounds[i + 1]]
+
+    def nbytes(self):
+        return sum(a.nbytes for arrays in self.postings.values() for a in arrays)
+
+
+class _Snapshot:
+    """某一时刻的只读视图：块元组、最后一块已写入的行数、各字典的长度"""
+
+    __slots__ = ('chunks', 'last_size', 'dict_sizes')
+
+    def __init__(self, chunks, last_size, dict_sizes):
+        self.chunks = chunks
+        self.last_size = last_size
+        self.dict_sizes = dict_sizes
+
+    def rows_in(self, i):
+        return self.last_size if i == len(self.chunks) - 1 else self.chunks[i].size
+
+
+def _empty_bucket():
+    return {'total': 0, 'success': 0, 'failed': 0}
+
+
+class ColumnarHistoryRing:
+    """
+    列式环形缓冲
+
+    由若干定长块组成，最新的块追加写入，旧块整块淘汰；
+    淘汰只在换块时进行：换块时剩余记录少于 max_records + chunk_size，新块再写满 chunk_size 条，
+    因此保留的记录数在 max_records 与 max_records + 2 * chunk_size - 1 之间（块大小默认不超过 max_records 的 1/8）。
+
+    并发约定：append 由调用方串行化（单写者）；查询无需加锁。写入先填各列再递增块的 size，
+    块的增减通过替换整个 chunks 元组完成，读者持有的旧元组与已写入的行都不会再变化。
+    """
+
+    def __init__(self, max_records, chunk_size=None, on_evict=None):
+        self.max_records = max_records
+        self.on_evict = on_evict  # 整块淘汰时回调 on_evict(chunk)，用于维护去重计数等派生数据
+        self.chunk_size = chunk_size or min(4096, max(64, max_records // 8))
+        self.chunks = ()
+        self.count = 0
+        self.next_seq = 0
+        self.ocr_types = _Dictionary()
+        self.hosts = _Dictionary()
+        self.models = _Dictionary()
+        self.api_keys = _Dictionary()
+        self.api_key_names = _Dictionary()
+        self.preprocessings = _Dictionary()  # 预处理选项组合，编码为元组
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record, seq=None):
+        """追加一条记录（dict），返回序号；seq 用于载入已持久化的记录，须大于已有序号"""
+        if not self.chunks or self.chunks[-1].size >= self.chunk_size:
+            if self.chunks:
+                self.chunks[-1].seal()
+            chunks = list(self.chunks)
+            chunks.append(_Chunk(self.chunk_size))
+            # 淘汰最旧的整块，只要剩余记录仍不少于 max_records
+            while len(chunks) > 1 and self.count - chunks[0].size >= self.max_records:
+                evicted = chunks.pop(0)
+                self.count -= evicted.size
+                if self.on_evict is not None:
+                    self.on_evict(evicted)
+            self.chunks = tuple(chunks)  # 整体替换，正在读旧元组的查询不受影响
+        chunk = self.chunks[-1]
+        row = chunk.size
+        if seq is None:
+            seq = self.next_seq
+        duration = record.get('duration')
+        timestamp = record.get('timestamp', 0)
+        if row and timestamp < chunk.timestamp[row - 1]:
+            chunk.monotonic = False  # 系统时钟回拨等情况，该块退回逐行比较
+        chunk.seq[row] = seq
+        chunk.timestamp[row] = timestamp
+        chunk.duration[row] = np.nan if duration is None else duration
+        chunk.success[row] = bool(record.get('success', False))
+        chunk.ocr_type[row] = self.ocr_types.encode(record.get('ocr_type'))
+        chunk.host[row] = self.hosts.encode(record.get('host'))
+        chunk.model[row] = self.models.encode(record.get('model'))
+        chunk.api_key[row] = self.api_keys.encode(record.get('api_key'))
+        chunk.api_key_name[row] = self.api_key_names.encode(record.get('api_key_name'))
+        chunk.preprocessing[row] = self.preprocessings.encode(tuple(record.get('preprocessing') or ()))
+        chunk.result[row] = record.get('result')
+        chunk.size = row + 1
+        self.count += 1
+        self.next_seq = seq + 1
+        return seq
+
+    def clear(self):
+        self.chunks = ()
+        self.count = 0
+
+    def snapshot(self):
+        """
+        取得无锁快照：先读块元组，再读最后一块的行数，最后读字典长度，
+        快照内任一行引用的字典编码都小于记录下的长度
+        """
+        chunks = self.chunks
+        last_size = chunks[-1].size if chunks else 0
+        dict_sizes = {name: len(getattr(self, name)) for name in
+                      ('ocr_types', 'hosts', 'models', 'api_keys', 'api_key_names')}
+        return _Snapshot(chunks, last_size, dict_sizes)
+
+    def adopt(self, loaded):
+        """
+        把后台载入的另一个缓冲（序号都小于本缓冲）接到最前面，分三步以缩短持锁时间：
+        adopt 本身（持锁调用）只把对方字典中的取值编码进本缓冲字典，返回 (remap, splice)；
+        remap（锁外调用）改写对方各列的编码并重建索引；splice（持锁调用）拼接块元组并按上限淘汰最旧的块
+        """
+        mappings = {}
+        for column, name in (('ocr_type', 'ocr_types'), ('host', 'hosts'), ('model', 'models'),
+                             ('api_key', 'api_keys'), ('api_key_name', 'api_key_names'),
+                             ('preprocessing', 'preprocessings')):
+            target = getattr(self, name)
+            mappings[column] = np.array([target.encode(value) for value in getattr(loaded, name).values],
+                                        dtype=np.int32)
+
+        def remap():
+            for chunk in loaded.chunks:
+                n = chunk.size
+                for column, mapping in mappings.items():
+                    if mapping.size:
+                        values = getattr(chunk, column)
+                        values[:n] = mapping[values[:n]]
+                chunk.seal()
+
+        def splice():
+            # 载入的最后一块可能未写满但已建索引，新记录须写入其后的块
+            chunks = list(loaded.chunks) + (list(self.chunks) or [_Chunk(self.chunk_size)])
+            self.count += loaded.count
+            self.next_seq = max(self.next_seq, loaded.next_seq)
+            while len(chunks) > 1 and self.count - chunks[0].size >= self.max_records:
+                evicted = chunks.pop(0)
+                self.count -= evicted.size
+                if self.on_evict is not None:
+                    self.on_evict(evicted)
+            self.chunks = tuple(chunks)
+
+        return remap, splice
+
+    def value_counts(self, chunk):
+        """统计一块中各网站、各 (api_key, api_key_name) 组合的出现次数"""
+        n = chunk.size
+        hosts = {self.hosts.values[code]: int(count)
+                 for code, count in enumerate(np.bincount(chunk.host[:n])) if count}
+        width = len(self.api_key_names)
+        pairs, counts = np.unique(chunk.api_key[:n].astype(np.int64) * width + chunk.api_key_name[:n],
+                                  return_counts=True)
+        api_keys = {(self.api_keys.values[pair // width], self.api_key_names.values[pair % width]): int(count)
+                    for pair, count in zip(pairs.tolist(), counts)}
+        return hosts, api_keys
+
+    def _materialize(self, chunk, row):
+        """把一行还原为与原先 dict 记录相同结构的字典"""
+        timestamp = float(chunk.timestamp[row])
+        duration = float(chunk.duration[row])
+        return {
+            'seq': int(chunk.seq[row]),
+            'timestamp': timestamp,
+            'datetime': datetime.fromtimestamp(timestamp).isoformat(),
+            'ocr_type': self.ocr_types.values[chunk.ocr_type[row]],
+            'host': self.hosts.values[chunk.host[row]],
+            'model': self.models.values[chunk.model[row]],
+            'success': bool(chunk.success[row]),
+            'result': chunk.result[row],
+            'duration': None if duration != duration else duration,
+            'preprocessing': list(self.preprocessings.values[chunk.preprocessing[row]]),
+            'api_key': self.api_keys.values[chunk.api_key[row]],
+            'api_key_name': self.api_key_names.values[chunk.api_key_name[row]],
+        }
+
+    def _resolve_filters(self, ocr_type=None, host=None, api_key=None, status=None,
+                         start_date=None, end_date=None):
+        """把筛选值转换为字典编码；任一值从未出现过则返回 None，表示结果必为空"""
+        codes = []
+        for column, dictionary, value in (('ocr_type', self.ocr_types, ocr_type),
+                                          ('host', self.hosts, host),
+                                          ('api_key', self.api_keys, api_key)):
+            if value is None:
+                continue
+            code = dictionary.lookup(value)
+            if code is None:
+                return None
+            codes.append((column, code))
+        success = {'success': True, 'failed': False}.get(status)
+        return codes, success, start_date, end_date
+
+    @staticmethod
+    def _select_rows(chunk, n, resolved, lo=0, hi=None):
+        """
+        单块查询计划：在前 n 行的 [lo, hi) 内先按时间二分缩小范围，再取最短的索引倒排行号，
+        其余条件只在候选行上向量化比较，返回升序的命中行号
+        """
+        codes, success, start_date, end_date = resolved
+        hi = n if hi is None else min(hi, n)
+        if lo >= hi:
+            return _EMPTY_ROWS
+        time_pending = not chunk.monotonic
+        if chunk.monotonic:
+            timestamps = chunk.timestamp[:n]
+            if start_date is not None:
+                lo = max(lo, int(np.searchsorted(timestamps, start_date, 'left')))
+            if end_date is not None:
+                hi = min(hi, int(np.searchsorted(timestamps, end_date, 'right')))
+            if lo >= hi:
+                return _EMPTY_ROWS
+        remaining = codes
+        if chunk.index is not None and codes:
+            best = None
+            for column, code in codes:
+                rows = chunk.index.lookup(column, code)
+                if best is None or rows.size < best[1].size:
+                    best = (column, rows)
+            # 索引覆盖整块，快照可能只看到其中前 n 行，总是按行范围截取
+            rows = best[1]
+            rows = rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+            remaining = [(column, code) for column, code in codes if column != best[0]]
+        else:
+            rows = np.arange(lo, hi)
+        if rows.size == 0:
+            return _EMPTY_ROWS
+        mask = None
+        for column, code in remaining:
+            hit = getattr(chunk, column)[rows] == code
+            mask = hit if mask is None else mask & hit
+        if success is not None:
+            hit = chunk.success[rows] if success else ~chunk.success[rows]
+            mask = hit if mask is None else mask & hit
+        if time_pending and start_date is not None:
+            hit = chunk.timestamp[rows] >= start_date
+            mask = hit if mask is None else mask & hit
+        if time_pending and end_date is not None:
+            hit = chunk.timestamp[rows] <= end_date
+            mask = hit if mask is None else mask & hit
+        return rows if mask is None else rows[mask]
+
+    def _walk(self, view, resolved, before=None, after=None):
+        """
+        按块首序号二分定位游标所在的块，块内再二分定位行（载入的记录序号可能不连续），依次产出 (chunk, 命中行号)。
+        默认从新到旧；给出 after 时从游标处由旧到新。内存缓冲中序号与时间同序，游标只用序号定位
+        """
+        count = len(view.chunks) - (0 if view.last_size else 1)  # 刚滚动出的空块不参与
+        if count <= 0:
+            return
+        chunks = view.chunks[:count]
+        if before is None and after is None:
+            for i in range(count - 1, -1, -1):
+                yield chunks[i], self._select_rows(chunks[i], view.rows_in(i), resolved)
+            return
+        starts = [int(chunk.seq[0]) for chunk in chunks]
+        if after is not None:
+            for i in range(max(bisect_right(starts, after) - 1, 0), count):
+                n = view.rows_in(i)
+                lo = int(np.searchsorted(chunks[i].seq[:n], after, 'right'))
+                yield chunks[i], self._select_rows(chunks[i], n, resolved, lo=lo)
+            return
+        for i in range(min(bisect_right(starts, before - 1), count) - 1, -1, -1):
+            n = view.rows_in(i)
+            hi = int(np.searchsorted(chunks[i].seq[:n], before, 'left'))
+            yield chunks[i], self._select_rows(chunks[i], n, resolved, hi=hi)
+
+    def query(self, limit=50, with_stats=True, before=None, after=None, **filters):
+        """
+        单遍查询：从新到旧逐块选出命中行，取前 limit 条还原为记录，同时对命中行做 bincount 统计。
+        before / after 为游标序号：只取更旧 / 更新的记录（after 取紧挨游标的 limit 条），记录始终按时间倒序返回。
+        返回 (records, stats)；with_stats=False 时凑满一页即停止，stats 为 None。在无锁快照上执行
+        """
+        view = self.snapshot()
+        dimensions = (('by_type', 'ocr_type', self.ocr_types, view.dict_sizes['ocr_types']),
+                      ('by_host', 'host', self.hosts, view.dict_sizes['hosts']),
+                      ('by_model', 'model', self.models, view.dict_sizes['models']),
+                      ('by_api_key', 'api_key_name', self.api_key_names, view.dict_sizes['api_key_names']))
+        totals = {key: np.zeros(size, dtype=np.int64) for key, _, _, size in dimensions}
+        successes = {key: np.zeros(size, dtype=np.int64) for key, _, _, size in dimensions}
+        total = success = 0
+        records = []
+        if not with_stats and limit <= 0:
+            return records, None
+        resolved = self._resolve_filters(**filters)
+        if resolved is not None:
+            for chunk, rows in self._walk(view, resolved, before, after):
+                if rows.size == 0:
+                    continue
+                page_rows = rows[:max(limit - len(records), 0)] if after is not None else \
+                    rows[::-1][:max(limit - len(records), 0)]
+                for row in page_rows:
+                    records.append(self._materialize(chunk, row))
+                if not with_stats:
+                    if len(records) >= limit:
+                        break
+                    continue
+                hit = rows[chunk.success[rows]]
+                total += int(rows.size)
+                success += int(hit.size)
+                for key, column, _, size in dimensions:
+                    codes = getattr(chunk, column)
+                    totals[key] += np.bincount(codes[rows], minlength=size)[:size]
+                    successes[key] += np.bincount(codes[hit], minlength=size)[:size]
+        if after is not None:
+            records.reverse()
+        if not with_stats:
+            return records, None
+        stats = {
+            'total': total,
+            'success': success,
+            'failed': total - success,
+            'success_rate': success / total if total > 0 else 0,
+        }
+        for key, _, dictionary, _ in dimensions:
+            buckets = {}
+            for code in np.flatnonzero(totals[key]):
+                value = dictionary.values[code]
+                label = _UNKNOWN if value is None else (str(value) if key == 'by_type' else value)
+                bucket = buckets.setdefault(label, _empty_bucket())
+                bucket['total'] += int(totals[key][code])
+                bucket['success'] += int(successes[key][code])
+                bucket['failed'] = bucket['total'] - bucket['success']
+            stats[key] = buckets
+        return records, stats
+
+    def query_records(self, limit=50, **filters):
+        """按时间倒序返回最近的 limit 条匹配记录"""
+        return self.query(limit=limit, with_stats=False, **filters)[0]
+
+    def filtered_stats(self, **filters):
+        """只统计不取记录"""
+        return self.query(limit=0, **filters)[1]
+
+    def get_memory_usage(self):
+        """列数组与二级索引占用的字节数（不含 result 中字符串对象本身）"""
+        return sum(chunk.nbytes() for chunk in self.chunks)
+
+
+__all__ = ['ColumnarHistoryRing']
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别历史时间桶预聚合模块：按分钟、按小时累计总数 / 成功数，以及按类型、网站、模型、API Key 的分项计数，
+总体与各分项还带有耗时的对数直方图（可合并的分位数草图），用于估算 p50 / p90 / p95 / p99。
+add 为 O(维度数)，时间范围统计只需累加 O(桶数) 个桶，保留时间远长于原始记录。
+分层保留：原始记录（见 history_ring / history_log）→ 分钟桶 → 小时桶，过期的桶由后台压缩任务丢弃。
+新代码可 from history_rollup import TimeBucketRollup
+"""
+
+import math
+import time
+from config import HISTORY_ROLLUP_MINUTE_HOURS, HISTORY_ROLLUP_HOUR_DAYS
+
+_DIMENSIONS = ('by_type', 'by_host', 'by_model', 'by_api_key')
+
+# 耗时直方图：相邻桶上下界之比为 1.1，取桶的几何中点作为估计值，相对误差约 5%
+_LATENCY_GAMMA = 1.1
+_LOG_GAMMA = math.log(_LATENCY_GAMMA)
+_LATENCY_FLOOR_MS = 0.01
+_PERCENTILES = (('p50', 0.50), ('p90', 0.90), ('p95', 0.95), ('p99', 0.99))
+
+
+def latency_bin(duration):
+    """耗时（秒）所在的直方图桶编号；没有耗时的记录返回 None"""
+    if not isinstance(duration, (int, float)) or duration != duration:
+        return None
+    return math.floor(math.log(max(duration * 1000, _LATENCY_FLOOR_MS)) / _LOG_GAMMA)
+
+
+def latency_summary(histogram):
+    """由直方图 {桶编号: 次数} 估算分位数（毫秒），空直方图返回 None"""
+    count = sum(histogram.values())
+    if not count:
+        return None
+    bins = sorted(histogram.items())
+    summary = {'count': count}
+    cumulative = 0
+    targets = iter(_PERCENTILES)
+    name, quantile = next(targets)
+    for index, hits in bins:
+        cumulative += hits
+        while name is not None and cumulative >= math.ceil(quantile * count):
+            summary[name] = round(_LATENCY_GAMMA ** (index + 0.5), 2)
+            name, quantile = next(targets, (None, None))
+    summary['max'] = round(_LATENCY_GAMMA ** (bins[-1][0] + 1), 2)  # 最大值所在桶的上界
+    return summary
+
+
+def record_labels(record):
+    """记录在各统计维度上的取值，与 get_filtered_stats 的口径一致"""
+    ocr_type = record.get('ocr_type')
+    return (
+        str(ocr_type) if ocr_type is not None else 'unknown',
+        record.get('host') or 'unknown',
+        record.get('model') or 'unknown',
+        record.get('api_key_name') or record.get('api_key') or 'unknown',
+    )
+
+
+def _new_bucket():
+    # 分项计数为 [total, success, 耗时直方图]，便于 JSON 持久化
+    return {'total': 0, 'success': 0, 'latency': {},
+            'by_type': {}, 'by_host': {}, 'by_model': {}, 'by_api_key': {}}
+
+
+def _accumulate(bucket, labels, success, latency):
+    bucket['total'] += 1
+    bucket['success'] += success
+    if latency is not None:
+        bucket['latency'][latency] = bucket['latency'].get(latency, 0) + 1
+    for dimension, label in zip(_DIMENSIONS, labels):
+        counts = bucket[dimension].get(label)
+        if counts is None:
+            counts = bucket[dimension][label] = [0, 0, {}]
+        counts[0] += 1
+        counts[1] += success
+        if latency is not None:
+            counts[2][latency] = counts[2].get(latency, 0) + 1
+
+
+def _merge_histogram(target, histogram):
+    for index, hits in list(histogram.items()):
+        target[index] = target.get(index, 0) + hits
+
+
+def _merge(target, bucket):
+    target['total'] += bucket['total']
+    target['success'] += bucket['success']
+    _merge_histogram(target['latency'], bucket['latency'])
+    for dimension in _DIMENSIONS:
+        merged = target[dimension]
+        # 当前分钟 / 小时的桶可能正被写入，先复制条目（list(dict.items()) 在 GIL 下一次完成）
+        for label, (total, success, histogram) in list(bucket[dimension].items()):
+            counts = merged.get(label)
+            if counts is None:
+                counts = merged[label] = [0, 0, {}]
+            counts[0] += total
+            counts[1] += success
+            _merge_histogram(counts[2], histogram)
+
+
+def _copy_bucket(bucket):
+    """逐层复制一个桶；每层都用 list(dict.items()) 或 dict() 一次取出，可与 add 并发"""
+    copied = {'total': bucket['total'], 'success': bucket['success'], 'latency': dict(bucket['latency'])}
+    for dimension in _DIMENSIONS:
+        copied[dimension] = {label: [total, success, dict(histogram)]
+                             for label, (total, success, histogram) in list(bucket[dimension].items())}
+    return copied
+
+
+def _add_point(points, start, counts):
+    point = points.get(start)
+    if point is None:
+        point = points[start] = [0, 0, {}]
+    point[0] += counts[0]
+    point[1] += counts[1]
+    _merge_histogram(point[2], counts[2])
+
+
+def _format_point(start, counts):
+    total, success, histogram = counts
+    return {
+        'time': start,
+        'total': total,
+        'success': success,
+        'failed': total - success,
+        'success_rate': success / total if total > 0 else 0,
+        'latency': latency_summary(histogram),
+    }
+
+
+def _load_bucket(bucket):
+    """从 JSON 恢复一个桶：直方图的键还原为整数，旧版文件没有耗时直方图"""
+    bucket['latency'] = {int(index): hits for index, hits in bucket.get('latency', {}).items()}
+    for dimension in _DIMENSIONS:
+        for label, counts in bucket[dimension].items():
+            histogram = counts[2] if len(counts) > 2 else {}
+            bucket[dimension][label] = [counts[0], counts[1],
+                                        {int(index): hits for index, hits in histogram.items()}]
+    return bucket
+
+
+class TimeBucketRollup:
+    """
+    分钟 / 小时两级预聚合
+
+    两级同时累计：查询时整小时部分用小时桶，首尾不足一小时的部分用分钟桶；
+    分钟桶已过保留期的部分退化为整个小时桶。时间范围精确到分钟。
+    add 只累加、不淘汰，过期的桶由 compact 定期丢弃（分钟桶的计数写入时已同时累加进小时桶）。
+    add / compact 由调用方串行化；query / series 只按键取桶、复制条目后累加，可不加锁与写入并发。
+    """
+
+    def __init__(self, minute_retention=HISTORY_ROLLUP_MINUTE_HOURS * 3600,
+                 hour_retention=HISTORY_ROLLUP_HOUR_DAYS * 86400):
+        self.minute_retention = minute_retention
+        self.hour_retention = hour_retention
+        self.minutes = {}  # 分钟起点 -> 桶（记录大致按时间到达，dict 插入顺序即时间顺序）
+        self.hours = {}
+        self.minute_floor = 0  # 早于该时间的分钟桶可能已被淘汰
+
+    def add(self, record):
+        timestamp = record.get('timestamp', 0)
+        labels = record_labels(record)
+        success = 1 if record.get('success', False) else 0
+        latency = latency_bin(record.get('duration'))
+        minute = int(timestamp // 60) * 60
+        for buckets, start in ((self.minutes, minute), (self.hours, int(timestamp // 3600) * 3600)):
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = _new_bucket()
+            _accumulate(bucket, labels, success, latency)
+
+    def prune(self, now):
+        """丢弃超过保留期的桶；按插入顺序从最旧处开始检查，遇到未过期的桶即停止"""
+        for buckets, retention in ((self.minutes, self.minute_retention), (self.hours, self.hour_retention)):
+            cutoff = now - retention
+            if buckets is self.minutes:
+                self.minute_floor = max(self.minute_floor, cutoff)
+            while buckets:
+                oldest = next(iter(buckets))
+                if oldest >= cutoff:
+                    break
+                del buckets[oldest]
+
+    def compact(self, now):
+        """后台压缩：丢弃超过保留期的分钟桶与小时桶，返回 (丢弃的分钟桶数, 丢弃的小时桶数)"""
+        minutes, hours = len(self.minutes), len(self.hours)
+        self.prune(now)
+        return minutes - len(self.minutes), hours - len(self.hours)
+
+    def query(self, start, end):
+        """汇总 [start, end] 内的桶，返回与 get_filtered_stats 相同结构的统计，另附耗时分位数"""
+        result = _new_bucket()
+        # 起点早于最旧的桶时从最旧的桶开始，避免逐小时空转
+        start = max(start, min(list(self.hours), default=end))
+        minute_start = int(start // 60) * 60
+        first_full_hour = -(-minute_start // 3600) * 3600
+        last_hour_end = int(end // 3600) * 3600
+        if first_full_hour >= last_hour_end:
+            # 范围不足一个整小时：全部用分钟桶
+            self._merge_minutes(result, minute_start, int(end // 60) * 60 + 60)
+        else:
+            self._merge_minutes(result, minute_start, first_full_hour)
+            for hour in range(first_full_hour, last_hour_end, 3600):
+                bucket = self.hours.get(hour)
+                if bucket is not None:
+                    _merge(result, bucket)
+            self._merge_minutes(result, last_hour_end, int(end // 60) * 60 + 60)
+        return self._format(result)
+
+    def _merge_minutes(self, result, start, end):
+        """合并 [start, end) 的分钟桶；分钟桶已被淘汰时改用所在的整小时桶"""
+        if start >= end:
+            return
+        if start < self.minute_floor:
+            hour = int(start // 3600) * 3600
+            bucket = self.hours.get(hour)
+            if bucket is not None:
+                _merge(result, bucket)
+            start = hour + 3600
+        for minute in range(start, end, 60):
+            bucket = self.minutes.get(minute)
+            if bucket is not None:
+                _merge(result, bucket)
+
+    def series(self, start, end, step=3600, dimension=None, label=None):
+        """
+        按 step 秒（60 / 3600 / 86400）汇总 [start, end] 内的桶，返回按时间升序的
+        [{time, total, success, failed, success_rate, latency}]，没有记录的时间点不出现。
+        dimension / label 只统计某一分项（如 'by_host', 'www.example.com'）
+        """
+        points = {}
+        for point, bucket in self._buckets_by_step(start, end, step):
+            if dimension is None:
+                counts = (bucket['total'], bucket['success'], bucket['latency'])
+            else:
+                counts = bucket[dimension].get(label)
+            if counts:
+                _add_point(points, point, counts)
+        return [_format_point(t, counts) for t, counts in sorted(points.items())]
+
+    def breakdown(self, start, end, step, dimension, limit=10):
+        """按分项分组的时间序列：取窗口内记录数最多的 limit 个取值，返回 {取值: 时间序列}"""
+        groups = {}
+        for point, bucket in self._buckets_by_step(start, end, step):
+            for label, counts in list(bucket[dimension].items()):
+                _add_point(groups.setdefault(label, {}), point, counts)
+        top = sorted(groups.items(), key=lambda item: -sum(counts[0] for counts in item[1].values()))[:limit]
+        return {label: [_format_point(t, counts) for t, counts in sorted(points.items())] for label, points in top}
+
+    def _buckets_by_step(self, start, end, step):
+        """
+        窗口内的 (时间点, 桶)：按分钟汇总用分钟桶（只覆盖分钟桶的保留期），按小时 / 天汇总用小时桶，
+        按天汇总时对齐本地时区的零点
+        """
+        if step not in (60, 3600, 86400):
+            raise ValueError(f'不支持的汇总粒度: {step}')
+        buckets, width = (self.minutes, 60) if step == 60 else (self.hours, 3600)
+        first = int(start // width) * width
+        for bucket_start, bucket in list(buckets.items()):
+            if first <= bucket_start <= end:
+                if step == 86400:
+                    bucket_start -= (bucket_start + time.localtime(bucket_start).tm_gmtoff) % 86400
+                yield bucket_start, bucket
+
+    @staticmethod
+    def _format(bucket):
+        total, success = bucket['total'], bucket['success']
+        stats = {
+            'total': total,
+            'success': success,
+            'failed': total - success,
+            'success_rate': success / total if total > 0 else 0,
+            'latency': latency_summary(bucket['latency']),
+        }
+        for dimension in _DIMENSIONS:
+            stats[dimension] = {label: {'total': t, 'success': s, 'failed': t - s, 'latency': latency_summary(h)}
+                                for label, (t, s, h) in bucket[dimension].items()}
+        return stats
+
+    def clear(self):
+        self.minutes = {}
+        self.hours = {}
+        self.minute_floor = 0
+
+    def to_dict(self):
+        """复制出可序列化的数据，可与 add 并发"""
+        def copy_level(buckets):
+            return {start: _copy_bucket(bucket) for start, bucket in list(buckets.items())}
+        return {'minutes': copy_level(self.minutes), 'hours': copy_level(self.hours),
+                'minute_floor': self.minute_floor}
+
+    def load_dict(self, data):
+        """从持久化数据恢复（JSON 的键是字符串，按时间排序后重建插入顺序）"""
+        for name in ('minutes', 'hours'):
+            items = sorted((int(start), _load_bucket(bucket)) for start, bucket in data.get(name, {}).items())
+            setattr(self, name, dict(items))
+        self.minute_floor = data.get('minute_floor', 0)
+
+    def merge(self, other):
+        """
+        把另一份预聚合（后台载入时用旧记录重建的）并入；
+        两边时间交错，合并后按时间重建插入顺序，整体替换 dict 以免干扰无锁查询
+        """
+        for name in ('minutes', 'hours'):
+            merged = {start: _copy_bucket(bucket) for start, bucket in getattr(self, name).items()}
+            for start, bucket in getattr(other, name).items():
+                target = merged.get(start)
+                if target is None:
+                    target = merged[start] = _new_bucket()
+                _merge(target, bucket)
+            setattr(self, name, dict(sorted(merged.items())))
+
+    def get_info(self):
+        return {
+            'minute_buckets': len(self.minutes),
+            'hour_buckets': len(self.hours),
+            'oldest_hour': next(iter(self.hours), None),
+        }
+
+
+__all__ = ['TimeBucketRollup', 'record_labels', 'latency_bin', 'latency_summary']
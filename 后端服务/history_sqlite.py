@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别历史 SQLite 存储模块：WAL 模式，按时间保留数据，筛选与统计走索引查询。
+启用方式：环境变量 CAPTCHA_HISTORY_BACKEND=sqlite
+新代码可 from history_sqlite import SQLiteHistoryStore
+"""
+
+import json
+from collections import defaultdict
+from logger_config import logger
+from sqlite_pool import SQLiteConnectionPool
+
+_COLUMNS = ('timestamp', 'datetime', 'ocr_type', 'host', 'model', 'success', 'result',
+            'duration', 'preprocessing', 'api_key', 'api_key_name')
+
+
+def _empty_bucket():
+    return {'total': 0, 'success': 0, 'failed': 0}
+
+
+class SQLiteHistoryStore:
+    """识别历史的 SQLite 存储：批量插入、按时间清理、索引化的筛选与分组统计"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path='history.db', retention_days=30, synchronous='NORMAL'):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        # WAL 下 NORMAL 在检查点时同步；FULL 每次提交都同步
+        self.pool = SQLiteConnectionPool(db_path, synchronous=synchronous)
+        self._init_database()
+        logger.info(f'🗄️  [识别历史] SQLite 存储已启用: {db_path}（保留 {retention_days} 天）')
+
+    def _init_database(self):
+        with self.pool.connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY,
+                    timestamp REAL NOT NULL,
+                    datetime TEXT,
+                    ocr_type INTEGER,
+                    host TEXT,
+                    model TEXT,
+                    success INTEGER NOT NULL,
+                    result TEXT,
+                    duration REAL,
+                    preprocessing TEXT,
+                    api_key TEXT,
+                    api_key_name TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records(timestamp);
+                CREATE INDEX IF NOT EXISTS idx_records_host ON records(host, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_records_api_key ON records(api_key, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_records_ocr_type ON records(ocr_type, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_records_success ON records(success, timestamp);
+            ''')
+
+    @staticmethod
+    def _row_values(record):
+        return (
+            record.get('timestamp'),
+            record.get('datetime'),
+            record.get('ocr_type'),
+            record.get('host'),
+            record.get('model'),
+            1 if record.get('success', False) else 0,
+            record.get('result'),
+            record.get('duration'),
+            json.dumps(record.get('preprocessing') or [], ensure_ascii=False),
+            record.get('api_key'),
+            record.get('api_key_name'),
+        )
+
+    @staticmethod
+    def _row_to_record(row):
+        record = {'seq': row['id'], **{column: row[column] for column in _COLUMNS}}
+        record['success'] = bool(record['success'])
+        record['preprocessing'] = json.loads(record['preprocessing']) if record['preprocessing'] else []
+        return record
+
+    @staticmethod
+    def _where(ocr_type=None, host=None, api_key=None, status=None, start_date=None, end_date=None):
+        """把筛选条件转换为 WHERE 子句，每个条件都能命中 (列, timestamp) 复合索引"""
+        clauses, params = [], []
+        if ocr_type is not None:
+            clauses.append('ocr_type = ?')
+            params.append(ocr_type)
+        if host is not None:
+            clauses.append('host = ?')
+            params.append(host)
+        if api_key is not None:
+            clauses.append('api_key = ?')
+            params.append(api_key)
+        if status == 'success':
+            clauses.append('success = 1')
+        elif status == 'failed':
+            clauses.append('success = 0')
+        if start_date is not None:
+            clauses.append('timestamp >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            clauses.append('timestamp <= ?')
+            params.append(end_date)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def insert_many(self, records):
+        """一个事务内批量插入，返回插入条数"""
+        if not records:
+            return 0
+        with self.pool.connection() as conn:
+            conn.executemany(
+                f'INSERT INTO records ({", ".join(_COLUMNS)}) VALUES ({", ".join("?" * len(_COLUMNS))})',
+                [self._row_values(r) for r in records])
+            conn.commit()
+        return len(records)
+
+    def query(self, limit=50, with_stats=True, before=None, after=None, **filters):
+        """
+        同一连接上先取一页记录再做分组统计，返回 (records, stats)。
+        before / after 为 (timestamp, id) 游标，用行值比较直接在索引上定位，翻到多深都只读一页
+        """
+        with self.pool.connection() as conn:
+            records = self._query_records(conn, limit, filters, before, after)
+            return records, self._filtered_stats(conn, filters) if with_stats else None
+
+    def query_records(self, limit=50, **filters):
+        """按时间倒序返回最近的 limit 条记录"""
+        with self.pool.connection() as conn:
+            return self._query_records(conn, limit, filters)
+
+    def filtered_stats(self, **filters):
+        with self.pool.connection() as conn:
+            return self._filtered_stats(conn, filters)
+
+    def _query_records(self, conn, limit, filters, before=None, after=None):
+        where, params = self._where(**filters)
+        order = 'DESC'
+        if before is not None or after is not None:
+            where += ' AND ' if where else ' WHERE '
+            where += '(timestamp, id) < (?, ?)' if after is None else '(timestamp, id) > (?, ?)'
+            params += list(before if after is None else after)
+            order = 'DESC' if after is None else 'ASC'
+        rows = conn.execute(
+            f'SELECT id, {", ".join(_COLUMNS)} FROM records{where} '
+            f'ORDER BY timestamp {order}, id {order} LIMIT ?',
+            params + [limit]).fetchall()
+        records = [self._row_to_record(row) for row in rows]
+        if order == 'ASC':
+            records.reverse()
+        return records
+
+    def _filtered_stats(self, conn, filters):
+        """分组聚合后在 Python 中汇总，返回结构与内存实现一致"""
+        where, params = self._where(**filters)
+        rows = conn.execute(f'''
+            SELECT ocr_type, host, model, COALESCE(api_key_name, api_key), success, COUNT(*)
+            FROM records{where}
+            GROUP BY ocr_type, host, model, COALESCE(api_key_name, api_key), success
+        ''', params).fetchall()
+        stats = {
+            'total': 0,
+            'success': 0,
+            'failed': 0,
+            'by_type': defaultdict(_empty_bucket),
+            'by_host': defaultdict(_empty_bucket),
+            'by_model': defaultdict(_empty_bucket),
+            'by_api_key': defaultdict(_empty_bucket),
+        }
+        for ocr_type, host, model, api_key_name, success, count in rows:
+            outcome = 'success' if success else 'failed'
+            stats['total'] += count
+            stats[outcome] += count
+            for key, value in (('by_type', str(ocr_type if ocr_type is not None else 'unknown')),
+                               ('by_host', host or 'unknown'),
+                               ('by_model', model or 'unknown'),
+                               ('by_api_key', api_key_name or 'unknown')):
+                stats[key][value]['total'] += count
+                stats[key][value][outcome] += count
+        stats['success_rate'] = stats['success'] / stats['total'] if stats['total'] > 0 else 0
+        for key in ('by_type', 'by_host', 'by_model', 'by_api_key'):
+            stats[key] = dict(stats[key])
+        return stats
+
+    def distinct_counts(self, cutoff=None):
+        """
+        各网站、各 (api_key, api_key_name) 组合的记录数，返回 (hosts, api_keys) 两个 dict；
+        给出 cutoff 时只统计其之前（即将被清理）的记录
+        """
+        where, params = ('', []) if cutoff is None else (' WHERE timestamp < ?', [cutoff])
+        with self.pool.connection() as conn:
+            hosts = {host: count for host, count in conn.execute(
+                f'SELECT host, COUNT(*) FROM records{where} GROUP BY host', params)}
+            api_keys = {(key, name): count for key, name, count in conn.execute(
+                f'SELECT api_key, api_key_name, COUNT(*) FROM records{where} GROUP BY api_key, api_key_name',
+                params)}
+        return hosts, api_keys
+
+    def purge_before(self, cutoff, batch_size=10000):
+        """分批删除 cutoff 之前的记录，避免长时间持有写锁，返回删除条数"""
+        deleted = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.execute('''
+                    DELETE FROM records WHERE id IN (
+                        SELECT id FROM records WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                    )
+                ''', (cutoff, batch_size))
+                conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        if deleted:
+            logger.info(f'🧹 [识别历史] 按保留期清理了 {deleted} 条记录')
+        return deleted
+
+    def is_empty(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT 1 FROM records LIMIT 1').fetchone() is None
+
+    def clear(self):
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM records')
+            conn.commit()
+
+    def close(self):
+        self.pool.close_all()
+
+
+__all__ = ['SQLiteHistoryStore']
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP 前缀树模块：基于路径压缩的二叉基数树（Patricia trie）存储 IPv4 / IPv6 CIDR 前缀。
+查询耗时只与地址位数相关（最多 32 / 128 步），与列表规模无关。
+新代码可 from ip_trie import IPPrefixTrie, normalize_ip_entry
+"""
+
+import ipaddress
+
+
+def normalize_ip_entry(entry):
+    """
+    规范化白/黑名单条目
+
+    单个 IP 保持原样（如 192.168.1.1），网段统一为网络地址形式（如 10.0.0.0/8）。
+    格式非法时抛出 ValueError。
+    """
+    entry = str(entry).strip()
+    if '/' not in entry:
+        return str(ipaddress.ip_address(entry))
+    network = ipaddress.ip_network(entry, strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class _Node:
+    __slots__ = ('prefix', 'length', 'left', 'right', 'terminal')
+
+    def __init__(self, prefix, length, terminal=False):
+        self.prefix = prefix      # 前 length 位的整数值
+        self.length = length
+        self.left = None
+        self.right = None
+        self.terminal = terminal  # 该节点本身是否为一个已存储的前缀
+
+
+class _FamilyTrie:
+    """单一地址族（位宽固定）的 Patricia 树"""
+
+    def __init__(self, width):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _child(self, node, bit):
+        return node.right if bit else node.left
+
+    def _set_child(self, node, bit, child):
+        if bit:
+            node.right = child
+        else:
+            node.left = child
+
+    def insert(self, key, plen):
+        """插入前缀（key 为完整地址整数），新增返回 True，已存在返回 False"""
+        width = self.width
+        node = self.root
+        while True:
+            if plen == node.length:
+                if node.terminal:
+                    return False
+                node.terminal = True
+                self.size += 1
+                return True
+            bit = (key >> (width - node.length - 1)) & 1
+            child = self._child(node, bit)
+            if child is None:
+                self._set_child(node, bit, _Node(key >> (width - plen), plen, True))
+                self.size += 1
+                return True
+            # 求 child 与新前缀的公共前缀长度
+            m = min(child.length, plen)
+            diff = (child.prefix >> (child.length - m)) ^ (key >> (width - m))
+            common = m - diff.bit_length()
+            if common == child.length:
+                node = child
+                continue
+            # 分裂：先构造完整的中间节点再挂接，保证无锁读者看到的总是一致的树
+            mid = _Node(key >> (width - common), common, common == plen)
+            child_bit = (child.prefix >> (child.length - common - 1)) & 1
+            self._set_child(mid, child_bit, child)
+            if common != plen:
+                self._set_child(mid, 1 - child_bit, _Node(key >> (width - plen), plen, True))
+            self._set_child(node, bit, mid)
+            self.size += 1
+            return True
+
+    def remove(self, key, plen):
+        """删除前缀，存在并删除返回 True"""
+        width = self.width
+        parent, parent_bit, node = None, 0, self.root
+        while node is not None and node.length < plen:
+            bit = (key >> (width - node.length - 1)) & 1
+            child = self._child(node, bit)
+            if child is None or child.length > plen or \
+                    (key >> (width - child.length)) != child.prefix:
+                return False
+            parent, parent_bit, node = node, bit, child
+        if node is None or node.length != plen or not node.terminal:
+            return False
+        node.terminal = False
+        self.size -= 1
+        # 回收不再需要的节点：无子节点则摘除，单子节点则由子节点顶替
+        if parent is not None:
+            if node.left is None and node.right is None:
+                self._set_child(parent, parent_bit, None)
+            elif node.left is None or node.right is None:
+                self._set_child(parent, parent_bit, node.left or node.right)
+        return True
+
+    def match(self, addr):
+        """返回覆盖 addr 的最长前缀 (prefix, length)，没有则返回 None"""
+        width = self.width
+        node = self.root
+        best = (0, 0) if node.terminal else None
+        while node.length < width:
+            child = node.right if (addr >> (width - node.length - 1)) & 1 else node.left
+            if child is None or (addr >> (width - child.length)) != child.prefix:
+                break
+            if child.terminal:
+                best = (child.prefix, child.length)
+            node = child
+        return best
+
+
+class IPPrefixTrie:
+    """同时支持 IPv4 与 IPv6 的前缀集合"""
+
+    def __init__(self, entries=None):
+        self._tries = {4: _FamilyTrie(32), 6: _FamilyTrie(128)}
+        for entry in entries or ():
+            self.add(entry)
+
+    @staticmethod
+    def _parse(entry):
+        network = ipaddress.ip_network(str(entry).strip(), strict=False)
+        return network.version, int(network.network_address), network.prefixlen
+
+    def add(self, entry):
+        version, key, plen = self._parse(entry)
+        return self._tries[version].insert(key, plen)
+
+    def remove(self, entry):
+        version, key, plen = self._parse(entry)
+        return self._tries[version].remove(key, plen)
+
+    def match(self, ip):
+        """返回覆盖该 IP 的最长前缀（字符串），不匹配或 IP 非法时返回 None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        trie = self._tries[address.version]
+        found = trie.match(int(address))
+        if found is None:
+            return None
+        prefix, length = found
+        network = ipaddress.ip_network((prefix << (trie.width - length), length))
+        return str(network)
+
+    def __contains__(self, ip):
+        return self.match(ip) is not None
+
+    def __len__(self):
+        return self._tries[4].size + self._tries[6].size
+
+
+__all__ = ['IPPrefixTrie', 'normalize_ip_entry']
@@ -6,7 +6,7 @@
 使用 ddddocr 和 opencv 进行识别
 """
 
-from flask import Flask, request, jsonify, session, make_response, render_template, url_for
+from flask import Flask, request, jsonify, session, make_response, render_template, url_for, Response, stream_with_context
 from flask_cors import CORS
 import base64
 import io
@@ -25,7 +25,7 @@ import bcrypt
 from logger_config import logger
 
 # 引入新的认证模块
-from auth import UserDatabase, JWTManager
+from auth import UserDatabase, JWTManager, AuthBusyError, get_request_auth, token_cache, password_hasher
 
 # 引入请求限流模块
 from security import rate_limit, get_api_key_identifier, get_user_identifier
@@ -33,9 +33,15 @@ from security import rate_limit, get_api_key_identifier, get_user_identifier
 # 引入安全管理模块
 from security import security_manager, require_ip_allowed, check_login_lock, require_csrf_token
 
+# 引入规则存储模块
+from rules_store import rules_store, RULES_FILE
+
+# 引入流量采集模块
+from traffic_capture import traffic_capture, REPLAY_HEADER
+
 # 引入识别历史和模型管理模块
-from history import recognition_history, model_manager
-from config import DEFAULT_HOST, DEFAULT_PORT
+from history import recognition_history, model_manager, decode_cursor, EXPORT_FORMATS, export_chunks, TREND_STEPS, TREND_DIMENSIONS
+from config import DEFAULT_HOST, DEFAULT_PORT, HELLO_RATE_LIMIT
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)  # 允许跨域请求并支持凭证
@@ -46,13 +52,12 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
 
-# 规则文件路径（保存在当前目录）
-RULES_FILE = os.path.join(os.path.dirname(__file__), 'captcha_rules.json')
+# 数据文件路径（保存在当前目录；规则文件路径见 rules_store.RULES_FILE）
 APIKEY_FILE = os.path.join(os.path.dirname(__file__), 'api_keys.json')
 ADMIN_CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'admin_config.json')
 
-# 存储规则的内存数据库
-rules_db = {}
+# 存储规则的内存数据库（即 rules_store.rules，只读访问；修改须通过 rules_store 的方法）
+rules_db = rules_store.rules
 
 # 存储 API Key 的内存数据库
 # 结构: {"api_key": {"name": "名称", "created_at": "创建时间", "stats": {"total": 0, "types": {}, "hosts": {}}}}
@@ -79,20 +84,8 @@ user_db = UserDatabase(DB_FILE)
 
 
 def load_rules():
-    """从文件加载规则"""
-    global rules_db
-    try:
-        if os.path.exists(RULES_FILE):
-            with open(RULES_FILE, 'r', encoding='utf-8') as f:
-                rules_db = json.load(f)
-            logger.info(f"📥 加载规则文件: {RULES_FILE}")
-            logger.info(f"✅ 已加载 {len(rules_db)} 个网站的规则")
-        else:
-            logger.info(f"💡 规则文件不存在，将创建新文件: {RULES_FILE}")
-            rules_db = {}
-    except Exception as e:
-        logger.warning(f"⚠️  加载规则失败: {str(e)}，使用空规则库")
-        rules_db = {}
+    """从文件（或 SQLite）加载规则"""
+    rules_store.load()
 
 
 def save_admin_config():
@@ -270,66 +263,6 @@ def migrate_admin_to_database():
         logger.exception(f"❌ 数据迁移失败: {str(e)}")
 
 
-def save_rules():
-    """保存规则到文件"""
-    try:
-        with open(RULES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(rules_db, f, ensure_ascii=False, indent=2)
-        logger.info(f"💾 规则已保存: {RULES_FILE} ({len(rules_db)} 个网站)")
-        return True
-    except Exception as e:
-        logger.error(f"❌ 保存规则失败: {str(e)}")
-        return False
-
-
-def deduplicate_rules():
-    """去除rules_db中的重复规则"""
-    global rules_db
-    total_removed = 0
-    
-    def is_duplicate(rule1, rule2):
-        """检查两条规则是否重复"""
-        # 对于滑动验证码 (ocr_type=4)
-        if rule1.get('ocr_type') == 4 and rule2.get('ocr_type') == 4:
-            return (rule1.get('big_image') == rule2.get('big_image') and
-                    rule1.get('small_image') == rule2.get('small_image') and
-                    rule1.get('move_item') == rule2.get('move_item'))
-        # 对于滑块行为验证码 (ocr_type=5)
-        elif rule1.get('ocr_type') == 5 and rule2.get('ocr_type') == 5:
-            return rule1.get('move_item') == rule2.get('move_item')
-        # 对于英数字验证码 (ocr_type=1 或默认)
-        elif rule1.get('ocr_type', 1) == 1 and rule2.get('ocr_type', 1) == 1:
-            return (rule1.get('img') == rule2.get('img') and
-                    rule1.get('input') == rule2.get('input'))
-        return False
-    
-    for host, rules in rules_db.items():
-        if not isinstance(rules, list) or len(rules) <= 1:
-            continue
-        
-        # 去重
-        unique_rules = []
-        for rule in rules:
-            is_dup = any(is_duplicate(rule, existing) for existing in unique_rules)
-            if not is_dup:
-                unique_rules.append(rule)
-            else:
-                total_removed += 1
-        
-        rules_db[host] = unique_rules
-        
-        if len(rules) != len(unique_rules):
-            logger.info(f"🧽 {host}: 移除了 {len(rules) - len(unique_rules)} 条重复规则")
-    
-    if total_removed > 0:
-        logger.info(f"✅ 总共移除 {total_removed} 条重复规则")
-        save_rules()
-    else:
-        logger.info("✅ 没有发现重复规则")
-    
-    return total_removed
-
-
 def save_api_keys():
     """保存 API Keys 到文件"""
     try:
@@ -424,9 +357,8 @@ def require_admin_login(f):
         if request.method == 'OPTIONS':
             return '', 204
         
-        # 从 Authorization header 获取 token
-        auth_header = request.headers.get('Authorization')
-        token = JWTManager.extract_token_from_header(auth_header)
+        # 从 Authorization header 获取并验证 token（同一请求内只解析一次）
+        token, payload = get_request_auth()
         
         if not token:
             return jsonify({
@@ -434,8 +366,6 @@ def require_admin_login(f):
                 'description': '缺少认证token，请先登录'
             }), 401
         
-        # 验证 token
-        payload = JWTManager.verify_token(token)
         if not payload:
             return jsonify({
                 'code': 401,
@@ -638,13 +568,24 @@ def recognize_slide_captcha(big_img_base64, small_img_base64):
 
 
 @app.route('/hello', methods=['POST', 'OPTIONS'])
-@rate_limit(max_requests=100, time_window=60, key_func=get_api_key_identifier)  # 每分钟最多100次
+@rate_limit(max_requests=HELLO_RATE_LIMIT, time_window=60, key_func=get_api_key_identifier)  # 每个 API Key 每分钟最多 HELLO_RATE_LIMIT 次（默认100）
 @require_api_key
 def identify_captcha():
     """验证码识别接口 - 兼容原脚本"""
     if request.method == 'OPTIONS':
         return '', 204
     
+    if not traffic_capture.enabled or request.headers.get(REPLAY_HEADER):
+        return _identify_captcha()
+    # 流量采集：按采样率记录请求与响应，供 replay_traffic.py 回放
+    started = time.time()
+    response = _identify_captcha()
+    traffic_capture.capture(request.get_json(silent=True), response, time.time() - started)
+    return response
+
+
+def _identify_captcha():
+    """识别请求的处理逻辑"""
     try:
         data = request.json
         ocr_type = data.get('ocr_type', 1)
@@ -822,8 +763,15 @@ def admin_login():
                 'description': '用户名和密码不能为空'
             }), 400
         
-        # 使用新的认证系统
-        user = user_db.authenticate(username, password_sha256)
+        # 使用新的认证系统（bcrypt 在专用线程池中计算，繁忙时直接返回 503）
+        try:
+            user = user_db.authenticate(username, password_sha256)
+        except AuthBusyError as e:
+            logger.warning(f"⚠️  登录繁忙: {str(e)}")
+            return jsonify({
+                'code': 503,
+                'description': str(e)
+            }), 503, {'Retry-After': '1'}
         
         if not user:
             # 记录登录失败
@@ -861,24 +809,10 @@ def admin_login():
         session['username'] = user['username']
         session['login_time'] = datetime.now().isoformat()
         
-        # 🔐 检查是否为默认密码：通过数据库标记判断
-        is_default_password = False
-        try:
-            # 从数据库获取完整用户信息（包含 password_changed 标记）
-            cursor = user_db._get_connection().cursor()
-            cursor.execute('''
-                SELECT password_changed, created_at FROM users WHERE id = ?
-            ''', (user['id'],))
-            user_info = cursor.fetchone()
-            
-            if user_info:
-                password_changed = user_info[0] if user_info[0] is not None else 0
-                is_default_password = (password_changed == 0)
-                
-                if is_default_password:
-                    logger.warning(f"⚠️  用户 {username} 使用默认密码，强制要求修改")
-        except Exception as e:
-            logger.warning(f"检查默认密码失败: {str(e)}")
+        # 🔐 检查是否为默认密码：通过数据库标记判断（authenticate 已返回 password_changed）
+        is_default_password = not user.get('password_changed')
+        if is_default_password:
+            logger.warning(f"⚠️  用户 {username} 使用默认密码，强制要求修改")
         
         # 生成 JWT token
         token = JWTManager.generate_token(
@@ -922,6 +856,11 @@ def admin_logout():
     
     username = session.get('admin_username', 'unknown')
     session.clear()
+    
+    # 吊销当前 token，登出后即使 token 未过期也无法继续使用
+    token, _ = get_request_auth()
+    if token:
+        JWTManager.revoke_token(token)
     print(f"🚺 管理员登出: {username}")
     
     return jsonify({
@@ -954,13 +893,21 @@ def change_password():
         print(f"🔑 用户 {user_id} 请求修改密码")
         
         # 使用新数据库修改密码
-        success, message = user_db.change_password(
-            user_id=user_id,
-            old_password_sha256=old_password_sha256,
-            new_password_sha256=new_password_sha256
-        )
+        try:
+            success, message = user_db.change_password(
+                user_id=user_id,
+                old_password_sha256=old_password_sha256,
+                new_password_sha256=new_password_sha256
+            )
+        except AuthBusyError as e:
+            return jsonify({
+                'code': 503,
+                'description': str(e)
+            }), 503, {'Retry-After': '1'}
         
         if success:
+            # 密码修改后，此前签发的全部 token 失效，需要重新登录
+            JWTManager.revoke_user_tokens(user_id)
             print(f"✅ 用户 {user_id} 密码修改成功")
             return jsonify({
                 'code': 200,
@@ -989,9 +936,8 @@ def admin_status():
     if request.method == 'OPTIONS':
         return '', 204
     
-    # 从 Authorization header 获取 token
-    auth_header = request.headers.get('Authorization')
-    token = JWTManager.extract_token_from_header(auth_header)
+    # 从 Authorization header 获取并验证 token
+    token, payload = get_request_auth()
     
     if not token:
         return jsonify({
@@ -1000,8 +946,6 @@ def admin_status():
             'description': '缺少认证token'
         })
     
-    # 验证 token
-    payload = JWTManager.verify_token(token)
     if not payload:
         return jsonify({
             'code': 401,
@@ -1019,6 +963,29 @@ def admin_status():
     })
 
 
+@app.route('/admin/diagnostics', methods=['GET'])
+@require_admin_login
+def admin_diagnostics():
+    """诊断信息：用户数据库连接池、token 缓存、密码哈希线程池、识别历史落盘、流量采集、规则存储"""
+    try:
+        return jsonify({
+            'code': 200,
+            'data': {
+                'auth_db_pool': user_db.get_pool_stats(),
+                'token_cache': token_cache.get_stats(),
+                'password_hasher': password_hasher.get_stats(),
+                'history_flush': recognition_history.get_flush_stats(),
+                'traffic_capture': traffic_capture.get_stats(),
+                'rules_store': rules_store.get_stats()
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'code': 500,
+            'description': f'获取诊断信息失败: {str(e)}'
+        }), 500
+
+
 @app.route('/admin/config', methods=['GET', 'OPTIONS'])
 def get_system_config():
     """获取系统配置（公开接口，前端需要调用）"""
@@ -1118,53 +1085,24 @@ def add_rules():
         
         # 如果type为0，表示黑名单
         if data.get('type') == 0:
-            rules_db[host] = []
+            rules_store.set_host(host, [])
             print(f"🚫 添加黑名单: {host}")
             
-            # 保存到文件
-            save_rules()
-            
             return jsonify({
                 'code': 530,
                 'description': '已添加到黑名单'
             })
         
-        # 添加或更新规则
-        if host not in rules_db:
-            rules_db[host] = []
-        
-        # 检查是否已存在相同规则（根据关键字段判断）
-        def is_duplicate(existing_rule, new_rule):
-            """检查规则是否重复"""
-            # 对于滑动验证码 (ocr_type=4)
-            if new_rule.get('ocr_type') == 4:
-                return (existing_rule.get('big_image') == new_rule.get('big_image') and
-                        existing_rule.get('small_image') == new_rule.get('small_image') and
-                        existing_rule.get('move_item') == new_rule.get('move_item'))
-            # 对于滑块行为验证码 (ocr_type=5)
-            elif new_rule.get('ocr_type') == 5:
-                return existing_rule.get('move_item') == new_rule.get('move_item')
-            # 对于英数字验证码 (ocr_type=1)
-            else:
-                return (existing_rule.get('img') == new_rule.get('img') and
-                        existing_rule.get('input') == new_rule.get('input'))
-        
-        # 检查是否存在重复
-        is_dup = any(is_duplicate(rule, data) for rule in rules_db[host])
-        
-        if is_dup:
+        # 按规范键（类型 + 定位字段）查重后添加；只记录改动并安排延迟保存，不在请求内写文件
+        if not rules_store.add_rule(host, data):
             print(f"⚠️  规则已存在，跳过添加: {host}")
             return jsonify({
                 'code': 200,
                 'description': '规则已存在'
             })
         
-        rules_db[host].append(data)
         print(f"✅ 添加规则成功: {host}")
         
-        # 保存到文件
-        save_rules()
-        
         return jsonify({
             'code': 200,
             'description': '规则添加成功'
@@ -1187,13 +1125,9 @@ def delete_rules():
         data = request.json
         host = data.get('host')
         
-        if host in rules_db:
-            del rules_db[host]
+        if rules_store.delete_host(host):
             print(f"🗑️  删除规则: {host}")
             
-            # 保存到文件
-            save_rules()
-            
             return jsonify({
                 'code': 200,
                 'description': '规则删除成功'
@@ -1242,12 +1176,9 @@ def update_rule():
             }), 404
         
         # 更新规则
-        rules_db[host][index] = rule_data
+        rules_store.update_rule(host, index, rule_data)
         print(f"✏️  更新规则: {host}[{index}]")
         
-        # 保存到文件
-        save_rules()
-        
         return jsonify({
             'code': 200,
             'description': '规则更新成功'
@@ -1290,17 +1221,12 @@ def delete_single_rule():
             }), 404
         
         # 删除规则
-        deleted_rule = rules_db[host].pop(index)
+        # 删除规则（该网站没有规则后会删除整个host）
+        deleted_rule = rules_store.delete_rule(host, index)
         print(f"🗑️  删除规则: {host}[{index}]")
-        
-        # 如果该网站没有规则了，删除整个host
-        if len(rules_db[host]) == 0:
-            del rules_db[host]
+        if host not in rules_db:
             print(f"🗑️  网站 {host} 已无规则，已删除")
         
-        # 保存到文件
-        save_rules()
-        
         return jsonify({
             'code': 200,
             'description': '规则删除成功'
@@ -1336,34 +1262,20 @@ def import_rules():
                 'description': '规则格式错误'
             }), 400
         
-        global rules_db
-        
         if mode == 'replace':
             # 覆盖模式：直接替换
-            rules_db = imported_rules
-            print(f"📥 覆盖导入规则，共 {len(rules_db)} 个网站")
+            skipped = rules_store.replace_all(imported_rules)
+            print(f"📥 覆盖导入规则，共 {len(rules_db)} 个网站，跳过 {skipped} 条重复规则")
         else:
-            # 合并模式：合并规则
-            for host, rules in imported_rules.items():
-                if host in rules_db:
-                    # 网站已存在，合并规则（去重）
-                    existing_rules = rules_db[host]
-                    for rule in rules:
-                        # 简单去重：检查是否已存在相同规则
-                        if rule not in existing_rules:
-                            existing_rules.append(rule)
-                else:
-                    # 新网站，直接添加
-                    rules_db[host] = rules
-            print(f"📥 合并导入规则，当前共 {len(rules_db)} 个网站")
-        
-        # 保存到文件
-        save_rules()
+            # 合并模式：合并规则（按规范键去重）
+            skipped = rules_store.merge(imported_rules)
+            print(f"📥 合并导入规则，当前共 {len(rules_db)} 个网站，跳过 {skipped} 条重复规则")
         
         return jsonify({
             'code': 200,
             'description': f'规则导入成功（{mode}模式）',
-            'count': len(rules_db)
+            'count': len(rules_db),
+            'skipped': skipped
         })
     except Exception as e:
         return jsonify({
@@ -1380,7 +1292,8 @@ def health_check():
         'timestamp': int(time.time()),
         'ocr_loaded': ocr_instance is not None,
         'slide_loaded': slide_instance is not None,
-        'rules_count': len(rules_db)
+        'rules_count': len(rules_db),
+        'history': recognition_history.get_load_progress()
     })
 
 
@@ -1392,25 +1305,18 @@ def get_all_rules():
         'code': 200,
         'count': len(rules_db),
         'rules': rules_db,
-        'file_path': RULES_FILE
+        'file_path': RULES_FILE if rules_store.backend == 'json' else rules_store.pool.db_path
     })
 
 
 @app.route('/rules/export', methods=['GET'])
 @require_admin_login
 def export_rules():
-    """导出规则文件（直接返回JSON文件）"""
-    from flask import send_file
-    if os.path.exists(RULES_FILE):
-        return send_file(RULES_FILE, 
-                        mimetype='application/json',
-                        as_attachment=True,
-                        download_name='captcha_rules_backup.json')
-    else:
-        return jsonify({
-            'code': 404,
-            'description': '规则文件不存在'
-        }), 404
+    """导出规则文件（由内存中的规则生成 JSON，包含尚未保存的改动，sqlite 后端同样可用）"""
+    response = make_response(json.dumps(rules_store.snapshot(), ensure_ascii=False, indent=2))
+    response.mimetype = 'application/json'
+    response.headers['Content-Disposition'] = 'attachment; filename=captcha_rules_backup.json'
+    return response
 
 
 # ==============================================
@@ -1611,9 +1517,12 @@ def get_history_stats():
     try:
         # 获取时间范围参数（秒）
         time_range = request.args.get('time_range', type=int)
+        # 或指定时间窗口（Unix 时间戳，秒）
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
         
         # 获取统计数据
-        stats = recognition_history.get_stats(time_range=time_range)
+        stats = recognition_history.get_stats(time_range=time_range, start=start, end=end)
         
         return jsonify({
             'code': 200,
@@ -1627,6 +1536,48 @@ def get_history_stats():
         }), 500
 
 
+@app.route('/history/trends', methods=['GET'])
+@require_admin_login
+def get_history_trends():
+    """长期趋势（来自分钟 / 小时预聚合，不受原始记录保留条数限制）"""
+    try:
+        step = request.args.get('step', 'hour', type=str)
+        if step not in TREND_STEPS:
+            return jsonify({
+                'code': 400,
+                'description': f'不支持的汇总粒度，可选: {", ".join(TREND_STEPS)}'
+            }), 400
+        # 时间窗口：最近 time_range 秒（默认 7 天），或 start / end（Unix 时间戳）
+        time_range = request.args.get('time_range', 7 * 86400, type=int)
+        end = request.args.get('end', time.time(), type=float)
+        start = request.args.get('start', end - time_range, type=float)
+        
+        # 分项过滤（最多一个，预聚合桶只保存各分项的边际计数）
+        filters = [(name, request.args.get(name)) for name in TREND_DIMENSIONS if request.args.get(name)]
+        group_by = request.args.get('group_by', type=str)
+        if len(filters) > 1 or (group_by is not None and (filters or group_by not in TREND_DIMENSIONS)):
+            return jsonify({
+                'code': 400,
+                'description': f'只能按一个分项过滤或分组，可选: {", ".join(TREND_DIMENSIONS)}'
+            }), 400
+        dimension, value = filters[0] if filters else (None, None)
+        
+        trends = recognition_history.get_trends(
+            start, end, step=step, dimension=dimension, value=value,
+            group_by=group_by, limit=max(request.args.get('limit', 10, type=int), 0)
+        )
+        return jsonify({
+            'code': 200,
+            'data': trends
+        })
+    except Exception as e:
+        logger.error(f"❌ 获取历史趋势失败: {str(e)}")
+        return jsonify({
+            'code': 500,
+            'description': f'获取趋势失败: {str(e)}'
+        }), 500
+
+
 @app.route('/history/records', methods=['GET'])
 @require_admin_login
 def get_history_records():
@@ -1640,20 +1591,23 @@ def get_history_records():
         status = request.args.get('status', type=str)  # 'success' 或 'failed'
         start_date = request.args.get('start_date', type=float)  # 时间戳
         end_date = request.args.get('end_date', type=float)  # 时间戳
+        # 游标分页：before 取更旧的一页，after 取更新的一页（取值为上次响应的 next_cursor / prev_cursor）
+        before = request.args.get('before', type=str)
+        after = request.args.get('after', type=str)
+        try:
+            before = decode_cursor(before) if before else None
+            after = decode_cursor(after) if after else None
+        except ValueError:
+            return jsonify({
+                'code': 400,
+                'description': '无效的分页游标'
+            }), 400
         
-        # 获取历史记录
-        records = recognition_history.get_recent_records(
-            limit=limit,
-            ocr_type=ocr_type,
-            host=host,
-            api_key=api_key,
-            status=status,
-            start_date=start_date,
-            end_date=end_date
-        )
-        
-        # 获取筛选后的统计数据
-        filtered_stats = recognition_history.get_filtered_stats(
+        # 一次查询同时得到记录与筛选后的统计数据（仅首页统计）
+        page = recognition_history.query_page(
+            limit=max(limit, 0),
+            before=before,
+            after=after,
             ocr_type=ocr_type,
             host=host,
             api_key=api_key,
@@ -1664,9 +1618,11 @@ def get_history_records():
         
         return jsonify({
             'code': 200,
-            'count': len(records),
-            'data': records,
-            'stats': filtered_stats  # 返回筛选后的统计数据
+            'count': len(page['records']),
+            'data': page['records'],
+            'stats': page['stats'],  # 返回筛选后的统计数据
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor']
         })
     except Exception as e:
         logger.error(f"❌ 获取历史记录失败: {str(e)}")
@@ -1676,33 +1632,52 @@ def get_history_records():
         }), 500
 
 
+@app.route('/history/export', methods=['GET'])
+@require_admin_login
+def export_history():
+    """流式导出识别历史（按时间倒序），筛选参数与 /history/records 相同，内存占用与导出范围无关"""
+    fmt = request.args.get('format', 'jsonl', type=str)
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'code': 400,
+            'description': f'不支持的导出格式，可选: {", ".join(EXPORT_FORMATS)}'
+        }), 400
+    
+    batches = recognition_history.iter_records(
+        ocr_type=request.args.get('ocr_type', type=int),
+        host=request.args.get('host', type=str),
+        api_key=request.args.get('api_key', type=str),
+        status=request.args.get('status', type=str),
+        start_date=request.args.get('start_date', type=float),
+        end_date=request.args.get('end_date', type=float)
+    )
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f'recognition_history_{datetime.now():%Y%m%d_%H%M%S}.{extension}'
+    logger.info(f'📤 [识别历史] 开始流式导出 ({fmt})')
+    return Response(
+        stream_with_context(export_chunks(batches, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
 @app.route('/history/filters', methods=['GET'])
 @require_admin_login
 def get_history_filters():
-    """获取历史记录的所有可用筛选项"""
+    """获取历史记录的所有可用筛选项（q 为前缀时用于输入联想，按记录数返回前 limit 个）"""
     try:
-        # 获取所有记录
-        all_records = recognition_history.get_recent_records(limit=10000)  # 获取足够多的记录
-        
-        # 提取唯一值
-        hosts = sorted(set(r.get('host', 'unknown') for r in all_records))
-        api_keys = sorted(set(r.get('api_key', 'unknown') for r in all_records))
-        api_key_names = sorted(set(r.get('api_key_name', 'unknown') for r in all_records))
-        
-        # 构建 API Key 映射（名称 -> key）
-        api_key_map = {}
-        for r in all_records:
-            key = r.get('api_key')
-            name = r.get('api_key_name')
-            if key and name:
-                api_key_map[name] = key
+        prefix = request.args.get('q', type=str)
+        limit = request.args.get('limit', 20, type=int)
+        
+        # 直接读取增量维护的去重计数，无需扫描记录
+        hosts, api_keys = recognition_history.get_filter_values(prefix=prefix, limit=max(limit, 0))
         
         return jsonify({
             'code': 200,
             'data': {
-                'hosts': hosts,
-                'api_keys': [{'key': api_key_map.get(name, name), 'name': name} 
-                            for name in api_key_names if name != 'unknown'],
+                'hosts': [host for host, _ in hosts],
+                'host_counts': {host: count for host, count in hosts},
+                'api_keys': [{'key': key, 'name': name, 'count': count} for name, key, count in api_keys],
                 'types': [
                     {'value': 1, 'label': '英数验证码'},
                     {'value': 4, 'label': '滑动拼图'},
@@ -1894,56 +1869,55 @@ def get_security_stats():
         }), 500
 
 
-@app.route('/security/whitelist', methods=['GET', 'POST', 'DELETE'])
-@require_admin_login
-def manage_whitelist():
-    """管理 IP 白名单"""
+def get_ip_entries_from_request():
+    """从请求体读取单个 ip 或批量 ips 列表，缺失时返回 None"""
+    data = request.json or {}
+    ips = data.get('ips')
+    if ips is None and data.get('ip'):
+        ips = [data.get('ip')]
+    if not isinstance(ips, list) or not ips:
+        return None
+    return ips
+
+
+def manage_ip_list(list_type, list_name):
+    """白名单/黑名单的查询与（批量）增删，批量操作整体校验后一次性生效"""
     try:
         if request.method == 'GET':
-            # 获取白名单
             return jsonify({
                 'code': 200,
                 'data': {
-                    'whitelist': list(security_manager.whitelist),
-                    'enabled': security_manager.config['enable_whitelist']
+                    list_type: security_manager.get_ip_list(list_type),
+                    'enabled': security_manager.config[f'enable_{list_type}']
                 }
             })
         
-        elif request.method == 'POST':
-            # 添加到白名单
-            data = request.json
-            ip = data.get('ip')
-            
-            if not ip:
-                return jsonify({
-                    'code': 400,
-                    'description': '缺少 IP 地址'
-                }), 400
-            
-            security_manager.add_to_whitelist(ip)
-            
+        ips = get_ip_entries_from_request()
+        if ips is None:
             return jsonify({
-                'code': 200,
-                'description': f'IP {ip} 已添加到白名单'
-            })
+                'code': 400,
+                'description': '缺少 IP 地址'
+            }), 400
         
-        elif request.method == 'DELETE':
-            # 从白名单移除
-            data = request.json
-            ip = data.get('ip')
-            
-            if not ip:
-                return jsonify({
-                    'code': 400,
-                    'description': '缺少 IP 地址'
-                }), 400
-            
-            security_manager.remove_from_whitelist(ip)
-            
+        try:
+            if request.method == 'POST':
+                changed = security_manager.add_ip_entries(list_type, ips)
+                action = f'已添加到{list_name}'
+            else:
+                changed = security_manager.remove_ip_entries(list_type, ips)
+                action = f'已从{list_name}移除'
+        except ValueError as e:
             return jsonify({
-                'code': 200,
-                'description': f'IP {ip} 已从白名单移除'
-            })
+                'code': 400,
+                'description': str(e)
+            }), 400
+        
+        description = f'IP {ips[0]} {action}' if len(ips) == 1 else f'{len(ips)} 个 IP {action}（实际变更 {changed} 个）'
+        return jsonify({
+            'code': 200,
+            'description': description,
+            'changed': changed
+        })
     
     except Exception as e:
         return jsonify({
@@ -1952,61 +1926,69 @@ def manage_whitelist():
         }), 500
 
 
+@app.route('/security/whitelist', methods=['GET', 'POST', 'DELETE'])
+@require_admin_login
+def manage_whitelist():
+    """管理 IP 白名单（POST/DELETE 支持 ip 或批量 ips）"""
+    return manage_ip_list('whitelist', '白名单')
+
+
 @app.route('/security/blacklist', methods=['GET', 'POST', 'DELETE'])
 @require_admin_login
 def manage_blacklist():
-    """管理 IP 黑名单"""
+    """管理 IP 黑名单（POST/DELETE 支持 ip 或批量 ips）"""
+    return manage_ip_list('blacklist', '黑名单')
+
+
+def parse_ip_list_text(text):
+    """解析文本格式的 IP 列表：每行一个或以逗号/空白分隔，# 之后为注释"""
+    entries = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        entries.extend(item for item in line.replace(',', ' ').split() if item)
+    return entries
+
+
+@app.route('/security/<list_type>/import', methods=['POST'])
+@require_admin_login
+def import_ip_list(list_type):
+    """批量导入 IP 白名单/黑名单（支持 CIDR 网段与 IPv6）"""
+    if list_type not in ('whitelist', 'blacklist'):
+        return jsonify({
+            'code': 404,
+            'description': f'未知的列表类型: {list_type}'
+        }), 404
+    
     try:
-        if request.method == 'GET':
-            # 获取黑名单
-            return jsonify({
-                'code': 200,
-                'data': {
-                    'blacklist': list(security_manager.blacklist),
-                    'enabled': security_manager.config['enable_blacklist']
-                }
-            })
+        if request.is_json:
+            data = request.json or {}
+            entries = data.get('entries')
+            if entries is None:
+                entries = parse_ip_list_text(data.get('text', ''))
+            mode = data.get('mode', 'merge')
+        else:
+            # 纯文本请求体，如直接上传的封禁列表文件
+            entries = parse_ip_list_text(request.get_data(as_text=True))
+            mode = request.args.get('mode', 'merge')
         
-        elif request.method == 'POST':
-            # 添加到黑名单
-            data = request.json
-            ip = data.get('ip')
-            
-            if not ip:
-                return jsonify({
-                    'code': 400,
-                    'description': '缺少 IP 地址'
-                }), 400
-            
-            security_manager.add_to_blacklist(ip)
-            
+        if not isinstance(entries, list) or not entries:
             return jsonify({
-                'code': 200,
-                'description': f'IP {ip} 已添加到黑名单'
-            })
+                'code': 400,
+                'description': '缺少 IP 列表数据'
+            }), 400
         
-        elif request.method == 'DELETE':
-            # 从黑名单移除
-            data = request.json
-            ip = data.get('ip')
-            
-            if not ip:
-                return jsonify({
-                    'code': 400,
-                    'description': '缺少 IP 地址'
-                }), 400
-            
-            security_manager.remove_from_blacklist(ip)
-            
-            return jsonify({
-                'code': 200,
-                'description': f'IP {ip} 已从黑名单移除'
-            })
+        result = security_manager.import_ip_list(list_type, entries, replace=(mode == 'replace'))
+        
+        return jsonify({
+            'code': 200,
+            'description': f'导入完成（{mode}模式）：新增 {result["added"]} 条，无效 {result["invalid_count"]} 条',
+            'data': result
+        })
     
     except Exception as e:
         return jsonify({
             'code': 500,
-            'description': f'操作失败: {str(e)}'
+            'description': f'导入失败: {str(e)}'
         }), 500
 
 
@@ -2098,10 +2080,13 @@ if __name__ == '__main__':
             logger.info("=" * 60)
             logger.info("🛑 正在关闭服务...")
             
-            # 保存识别历史
+            # 落盘剩余识别历史并停止后台写入线程（限时等待）
             logger.info("💾 正在保存识别历史...")
-            recognition_history.save_history()
-            logger.info("✅ 识别历史已保存")
+            if recognition_history.close():
+                logger.info("✅ 识别历史已保存")
+            
+            # 写入尚未保存的规则改动
+            rules_store.close()
             
             # 保存安全配置
             logger.info("💾 正在保存安全配置...")
@@ -2148,10 +2133,6 @@ if __name__ == '__main__':
     load_rules()
     load_api_keys()
     
-    # 自动去除重复规则
-    logger.info("🧽 检查并移除重复规则...")
-    deduplicate_rules()
-    
     # 加载安全配置
     logger.info("🔒 加载安全配置...")
     security_manager.load_config()
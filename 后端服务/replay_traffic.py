@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别流量回放工具
+读取 traffic_capture 采集的 /hello 请求，按指定并发（尽快发送）或按采集时的到达间隔回放到运行中的服务，
+报告吞吐、延迟分位数，以及与采集时结果不一致的请求。
+
+用法:
+    python replay_traffic.py --api-key sk-xxx --concurrency 8
+    python replay_traffic.py --api-key sk-xxx --timing original --speed 2 --json report.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from config import DEFAULT_PORT, TRAFFIC_CAPTURE_DIR
+from traffic_capture import read_index, load_payload, REPLAY_HEADER
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def send(url, api_key, payload, timeout):
+    """发送一次请求，返回 (状态码, 响应体, 延迟秒数)；网络错误时状态码为 None"""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json', 'X-API-Key': api_key,
+                                              REPLAY_HEADER: '1'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    except Exception as e:
+        return None, {'error': str(e)}, time.perf_counter() - started
+    latency = time.perf_counter() - started
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        body = {}
+    return status, body, latency
+
+
+def replay(args, entries):
+    results = []
+    lock = threading.Lock()
+
+    def run_one(entry):
+        try:
+            payload = load_payload(args.dir, entry)
+        except OSError:
+            status, body, latency = 'missing_blob', {}, 0.0
+        else:
+            status, body, latency = send(args.url, args.api_key, payload, args.timeout)
+        with lock:
+            results.append((entry, status, body, latency))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if args.timing == 'original':
+            # 按采集时的到达间隔（除以 speed）提交；线程池占满时实际发送会落后于计划
+            first = entries[0]['ts']
+            for entry in entries:
+                delay = (entry['ts'] - first) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(run_one, entry)
+        else:
+            for entry in entries:
+                pool.submit(run_one, entry)
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    # 吞吐与延迟只统计 2xx 响应：被限流（429）等错误响应几乎立即返回，计入会让数字好于真实识别路径
+    succeeded = [latency for _, status, _, latency in results if isinstance(status, int) and 200 <= status < 300]
+    statuses = Counter(str(status) for _, status, _, _ in results)
+    diffs = []
+    for entry, status, body, _ in results:
+        # 网络错误与被限流的请求没有识别结果，不参与比较
+        if not isinstance(status, int) or status == 429:
+            continue
+        if body.get('valid') != entry.get('valid') or body.get('data') != entry.get('result'):
+            diffs.append({
+                'host': entry.get('params', {}).get('host'),
+                'ocr_type': entry.get('params', {}).get('ocr_type'),
+                'expected': {'valid': entry.get('valid'), 'data': entry.get('result')},
+                'actual': {'valid': body.get('valid'), 'data': body.get('data'), 'status': status},
+            })
+    captured = [entry['duration'] for entry, *_ in results if entry.get('duration') is not None]
+    return {
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'succeeded': len(succeeded),
+        'rate_limited': statuses.get('429', 0),
+        'failed': len(results) - len(succeeded) - statuses.get('429', 0),
+        'throughput_rps': round(len(succeeded) / elapsed, 2) if elapsed > 0 else 0.0,
+        'statuses': dict(statuses),
+        'latency_ms': {name: round(percentile(succeeded, p) * 1000, 2)
+                       for name, p in (('p50', 50), ('p90', 90), ('p95', 95), ('p99', 99), ('max', 100))},
+        # 采集时服务端的处理耗时（不含网络），供对照
+        'captured_duration_ms': {name: round(percentile(captured, p) * 1000, 2)
+                                 for name, p in (('p50', 50), ('p99', 99))},
+        'result_diffs': len(diffs),
+        'diff_samples': diffs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='识别流量回放工具')
+    parser.add_argument('--dir', default=TRAFFIC_CAPTURE_DIR, help='采集目录（CAPTCHA_CAPTURE_DIR）')
+    parser.add_argument('--url', default=f'http://127.0.0.1:{DEFAULT_PORT}/hello', help='回放目标地址')
+    parser.add_argument('--api-key', required=True, help='回放使用的 API Key（采集时不保存 API Key）')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    parser.add_argument('--timing', choices=('fast', 'original'), default='fast',
+                        help='fast: 以给定并发尽快发送；original: 按采集时的到达间隔发送')
+    parser.add_argument('--speed', type=float, default=1.0, help='original 模式下的回放倍速')
+    parser.add_argument('--limit', type=int, default=0, help='最多回放的请求数（0 为全部）')
+    parser.add_argument('--ocr-type', type=int, help='只回放指定类型')
+    parser.add_argument('--host', help='只回放指定网站')
+    parser.add_argument('--timeout', type=float, default=30, help='单个请求超时（秒）')
+    parser.add_argument('--show-diffs', type=int, default=10, help='最多列出多少条结果差异')
+    parser.add_argument('--json', help='把完整报告写入该 JSON 文件')
+    args = parser.parse_args()
+
+    entries = [entry for entry in read_index(args.dir)
+               if (args.ocr_type is None or entry.get('params', {}).get('ocr_type') == args.ocr_type)
+               and (args.host is None or entry.get('params', {}).get('host') == args.host)]
+    entries.sort(key=lambda entry: entry['ts'])
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print(f'❌ {args.dir} 中没有可回放的请求')
+        return 1
+
+    print(f'🎬 回放 {len(entries)} 个请求 -> {args.url}（{args.timing}，并发 {args.concurrency}）')
+    results, elapsed = replay(args, entries)
+    report = summarize(results, elapsed)
+
+    latency = report['latency_ms']
+    print(f"📊 耗时 {report['elapsed_s']}s，成功 {report['succeeded']} 个，吞吐 {report['throughput_rps']} 请求/秒"
+          f"（仅计 2xx），状态 {report['statuses']}")
+    print(f"⏱️  成功请求延迟(ms) p50 {latency['p50']}  p90 {latency['p90']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {latency['max']}（采集时服务端 p50 {report['captured_duration_ms']['p50']}）")
+    if report['rate_limited']:
+        print(f"⚠️  {report['rate_limited']} 个请求被限流（429），未计入吞吐与延迟：/hello 每个 API Key 每分钟最多 "
+              f"CAPTCHA_HELLO_RATE_LIMIT 次（默认 100），回放前可在服务端调高该环境变量并重启，或降低回放速率")
+    if report['failed']:
+        print(f"⚠️  {report['failed']} 个请求失败（非 2xx 或网络错误），未计入吞吐与延迟")
+    print(f"🔍 结果与采集时不一致: {report['result_diffs']} 个")
+    for diff in report['diff_samples'][:args.show_diffs]:
+        print(f"   {diff['host']} 类型{diff['ocr_type']}: 采集 {diff['expected']} -> 回放 {diff['actual']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'💾 报告已写入 {args.json}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
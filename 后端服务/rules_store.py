@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+验证码规则存储模块：内存中的 {网站: [规则]} 加上延迟合并的持久化。
+每次修改只标记改动的网站并安排一次延迟保存，短时间内的多次修改合并为一次写入：
+json 后端写临时文件再原子替换；sqlite 后端（CAPTCHA_RULES_BACKEND=sqlite）每个网站一行，只写入改动过的网站。
+规则按规范键（类型 + 定位字段）去重：每个网站维护一个键集合，添加、导入、加载时每条规则 O(1) 判重。
+新代码可 from rules_store import rules_store
+"""
+
+import os
+import json
+import time
+import threading
+from logger_config import logger
+from config import RULES_BACKEND, RULES_DB, RULES_SAVE_DEBOUNCE
+from sqlite_pool import SQLiteConnectionPool
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'captcha_rules.json')
+
+# 各验证码类型用于判重的定位字段（其余类型按英数字验证码处理）
+_KEY_FIELDS = {
+    4: ('big_image', 'small_image', 'move_item'),  # 滑动验证码
+    5: ('move_item',),                            # 滑块行为验证码
+}
+_DEFAULT_KEY_FIELDS = ('img', 'input')             # 英数字验证码
+
+
+def _hashable(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def rule_key(rule):
+    """规则的规范键：类型相同且定位字段都相同的两条规则视为重复"""
+    if not isinstance(rule, dict):
+        return (None, _hashable(rule))
+    ocr_type = rule.get('ocr_type', 1)
+    fields = _KEY_FIELDS.get(ocr_type, _DEFAULT_KEY_FIELDS)
+    return (_hashable(ocr_type),) + tuple(_hashable(rule.get(field)) for field in fields)
+
+
+def _unique(rules):
+    """去除列表中的重复规则（保留先出现的一条），返回 (去重后的列表, 键集合)"""
+    if not isinstance(rules, list):
+        return rules, set()
+    unique, keys = [], set()
+    for rule in rules:
+        key = rule_key(rule)
+        if key not in keys:
+            keys.add(key)
+            unique.append(rule)
+    return unique, keys
+
+
+class RulesStore:
+    """
+    规则存储
+
+    self.rules 是常驻内存的规则字典，读取直接访问（/captchaHostQuery 等）；
+    修改须通过本类的方法，在 self.lock 内完成并记录改动的网站，写盘在锁外进行。
+    """
+
+    def __init__(self, rules_file=RULES_FILE, backend=RULES_BACKEND, db_path=RULES_DB,
+                 debounce=RULES_SAVE_DEBOUNCE):
+        self.rules_file = rules_file
+        self.backend = backend
+        self.debounce = debounce
+        self.rules = {}
+        self._keys = {}  # {网站: 规则规范键集合}，与 self.rules 同步维护
+        self.lock = threading.Lock()
+        self._dirty = set()  # 待写入的网站（sqlite 后端按网站写入）
+        self._replace_all = False  # 整体替换后 sqlite 需先清空旧数据
+        # 串行化写盘，并管理延迟保存的定时器
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self.saves = 0
+        self.last_save_ms = 0.0
+        self.pool = SQLiteConnectionPool(db_path, max_size=2) if backend == 'sqlite' else None
+        if self.pool is not None:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rules (
+                        host TEXT PRIMARY KEY,
+                        rules TEXT NOT NULL,
+                        updated_at REAL
+                    )
+                ''')
+                conn.commit()
+
+    # ---------- 加载 ----------
+
+    def load(self):
+        """
+        从 JSON 文件或 SQLite 加载规则（原地更新 self.rules，已有的引用仍然有效）。
+        建立键索引的同时去除重复规则，有重复的网站安排保存。
+        """
+        try:
+            if self.pool is not None:
+                loaded = self._load_sqlite()
+            elif os.path.exists(self.rules_file):
+                with open(self.rules_file, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                logger.info(f"📥 加载规则文件: {self.rules_file}")
+            else:
+                logger.info(f"💡 规则文件不存在，将创建新文件: {self.rules_file}")
+                loaded = {}
+            with self.lock:
+                removed = self._reset(loaded)
+            logger.info(f"✅ 已加载 {len(self.rules)} 个网站的规则")
+            if removed:
+                logger.info(f"🧽 已移除 {removed} 条重复规则")
+                self.schedule_save()
+        except Exception as e:
+            logger.warning(f"⚠️  加载规则失败: {str(e)}，使用空规则库")
+            with self.lock:
+                self.rules.clear()
+                self._keys.clear()
+
+    def _load_sqlite(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT host, rules FROM rules').fetchall()
+        if not os.path.exists(self.rules_file):
+            logger.info(f"📥 从 SQLite 加载规则: {len(rows)} 个网站")
+            return {row['host']: json.loads(row['rules']) for row in rows}
+        # 首次切换到 sqlite：导入原有的 JSON 规则文件，导入后改名保留，之后不再导入
+        # （表为空不代表未导入：管理员可能删光了规则）
+        with open(self.rules_file, 'r', encoding='utf-8') as f:
+            loaded = json.load(f)
+        if rows:
+            logger.warning(f"⚠️  SQLite 中已有 {len(rows)} 个网站的规则，规则文件合并导入（同名网站以规则文件为准）")
+            loaded = {**{row['host']: json.loads(row['rules']) for row in rows}, **loaded}
+        self._write_sqlite(loaded, replace_all=True)
+        os.replace(self.rules_file, self.rules_file + '.migrated')
+        logger.info(f"📦 已将规则文件导入 SQLite（{len(loaded)} 个网站），原文件已改名为 {self.rules_file}.migrated")
+        return loaded
+
+    # ---------- 修改 ----------
+
+    def _changed(self, *hosts):
+        """持锁调用：记录改动的网站"""
+        self._dirty.update(hosts)
+
+    def _reset(self, rules):
+        """持锁调用：整体替换规则并重建键索引，返回移除的重复规则数"""
+        self.rules.clear()
+        self._keys.clear()
+        removed = 0
+        for host, host_rules in rules.items():
+            unique, self._keys[host] = _unique(host_rules)
+            if len(unique) != len(host_rules):
+                removed += len(host_rules) - len(unique)
+                self._changed(host)
+            self.rules[host] = unique
+        return removed
+
+    def set_host(self, host, rules):
+        with self.lock:
+            self.rules[host], self._keys[host] = _unique(rules)
+            self._changed(host)
+        self.schedule_save()
+
+    def add_rule(self, host, rule):
+        """添加一条规则；已存在相同规则时不添加并返回 False"""
+        key = rule_key(rule)
+        with self.lock:
+            keys = self._keys.setdefault(host, set())
+            if key in keys:
+                return False
+            keys.add(key)
+            self.rules.setdefault(host, []).append(rule)
+            self._changed(host)
+        self.schedule_save()
+        return True
+
+    def delete_host(self, host):
+        """删除网站的全部规则，返回是否存在"""
+        with self.lock:
+            if host not in self.rules:
+                return False
+            del self.rules[host]
+            self._keys.pop(host, None)
+            self._changed(host)
+        self.schedule_save()
+        return True
+
+    def update_rule(self, host, index, rule):
+        with self.lock:
+            self.rules[host][index] = rule
+            # 修改与删除只在管理后台进行，直接重建该网站的键集合
+            self._keys[host] = {rule_key(r) for r in self.rules[host]}
+            self._changed(host)
+        self.schedule_save()
+
+    def delete_rule(self, host, index):
+        """删除单条规则并返回它；网站没有规则后整个删除"""
+        with self.lock:
+            rule = self.rules[host].pop(index)
+            if self.rules[host]:
+                self._keys[host] = {rule_key(r) for r in self.rules[host]}
+            else:
+                del self.rules[host]
+                self._keys.pop(host, None)
+            self._changed(host)
+        self.schedule_save()
+        return rule
+
+    def replace_all(self, rules):
+        """覆盖导入，返回跳过的重复规则数"""
+        with self.lock:
+            removed = self._reset(rules)
+            self._dirty.clear()
+            self._replace_all = True
+        self.schedule_save()
+        return removed
+
+    def merge(self, rules):
+        """合并导入：已有网站追加不重复的规则，新网站去重后加入；返回跳过的重复规则数"""
+        skipped = 0
+        with self.lock:
+            for host, host_rules in rules.items():
+                existing_rules = self.rules.get(host)
+                if not isinstance(existing_rules, list):
+                    self.rules[host], self._keys[host] = _unique(host_rules)
+                    if isinstance(host_rules, list):
+                        skipped += len(host_rules) - len(self.rules[host])
+                else:
+                    keys = self._keys.setdefault(host, set())
+                    for rule in host_rules:
+                        key = rule_key(rule)
+                        if key in keys:
+                            skipped += 1
+                            continue
+                        keys.add(key)
+                        existing_rules.append(rule)
+                self._changed(host)
+        self.schedule_save()
+        return skipped
+
+    def snapshot(self):
+        """复制当前规则（每个网站的列表也复制），供导出与锁外序列化"""
+        with self.lock:
+            return {host: list(rules) for host, rules in self.rules.items()}
+
+    # ---------- 保存 ----------
+
+    def schedule_save(self):
+        """延迟保存：短时间内的多次修改合并为一次写入"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.debounce, self._flush_scheduled_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _flush_scheduled_save(self):
+        with self._save_lock:
+            self._save_timer = None
+        self.save()
+
+    def save(self):
+        """立即保存：在锁内取改动的快照，锁外写盘；失败时改动留待下次保存"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            started = time.perf_counter()
+            with self.lock:
+                dirty, self._dirty = self._dirty, set()
+                replace_all, self._replace_all = self._replace_all, False
+                if self.pool is None:
+                    changes = {host: list(rules) for host, rules in self.rules.items()}
+                elif replace_all:
+                    changes = {host: list(rules) for host, rules in self.rules.items()}
+                else:
+                    changes = {host: list(self.rules[host]) if host in self.rules else None for host in dirty}
+            if not dirty and not replace_all:
+                return True
+            try:
+                if self.pool is None:
+                    tmp_file = f'{self.rules_file}.tmp'
+                    with open(tmp_file, 'w', encoding='utf-8') as f:
+                        json.dump(changes, f, ensure_ascii=False, separators=(',', ':'))
+                    os.replace(tmp_file, self.rules_file)
+                else:
+                    self._write_sqlite(changes, replace_all)
+            except Exception as e:
+                with self.lock:
+                    self._dirty |= dirty
+                    self._replace_all |= replace_all
+                logger.error(f"❌ 保存规则失败: {str(e)}")
+                return False
+            self.saves += 1
+            self.last_save_ms = round((time.perf_counter() - started) * 1000, 2)
+            logger.info(f"💾 规则已保存（{len(dirty) if not replace_all else len(changes)} 个网站有改动，"
+                        f"共 {len(self.rules)} 个网站）")
+            return True
+
+    def _write_sqlite(self, changes, replace_all=False):
+        """一个事务内写入改动的网站：None 表示删除"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            if replace_all:
+                conn.execute('DELETE FROM rules')
+            conn.executemany(
+                'INSERT INTO rules (host, rules, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(host) DO UPDATE SET rules = excluded.rules, updated_at = excluded.updated_at',
+                [(host, json.dumps(rules, ensure_ascii=False), now)
+                 for host, rules in changes.items() if rules is not None])
+            conn.executemany('DELETE FROM rules WHERE host = ?',
+                             [(host,) for host, rules in changes.items() if rules is None])
+            conn.commit()
+
+    def close(self):
+        """退出前写入尚未保存的改动"""
+        self.save()
+
+    def get_stats(self):
+        return {
+            'backend': self.backend,
+            'hosts': len(self.rules),
+            'rules': sum(len(rules) for rules in list(self.rules.values())),
+            'pending_hosts': len(self._dirty),
+            'saves': self.saves,
+            'last_save_ms': self.last_save_ms,
+        }
+
+
+rules_store = RulesStore()
+
+__all__ = ['RulesStore', 'rules_store', 'rule_key', 'RULES_FILE']
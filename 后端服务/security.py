@@ -9,9 +9,67 @@ import time
 import secrets
 import threading
 from collections import defaultdict, deque
+from contextlib import contextmanager
 from functools import wraps
 from flask import request, jsonify, session
 from logger_config import logger
+from config import SECURITY_LOCK_STRIPES, SECURITY_SAVE_DEBOUNCE, SHARED_STATE_BACKEND, SHARED_STATE_DB
+from shared_state import create_shared_state
+from timing_wheel import expiry_wheel
+from ip_trie import IPPrefixTrie, normalize_ip_entry
+
+
+# =====================
+# 分片锁
+# =====================
+
+class StripedLock:
+    """按 key 哈希分片的一组锁，同时记录每个分片的锁等待耗时"""
+
+    def __init__(self, stripes=SECURITY_LOCK_STRIPES):
+        self.stripes = max(1, int(stripes))
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        # 以下计数只在持有对应分片锁时修改，读取时无需加锁
+        self._acquired = [0] * self.stripes
+        self._contended = [0] * self.stripes
+        self._wait_total = [0.0] * self.stripes
+        self._wait_max = [0.0] * self.stripes
+
+    def index(self, key):
+        return hash(key) % self.stripes
+
+    @contextmanager
+    def hold(self, index):
+        lock = self._locks[index]
+        waited = 0.0
+        if not lock.acquire(blocking=False):
+            start = time.perf_counter()
+            lock.acquire()
+            waited = time.perf_counter() - start
+        try:
+            self._acquired[index] += 1
+            if waited:
+                self._contended[index] += 1
+                self._wait_total[index] += waited
+                if waited > self._wait_max[index]:
+                    self._wait_max[index] = waited
+            yield
+        finally:
+            lock.release()
+
+    def get_wait_stats(self):
+        acquired = sum(self._acquired)
+        contended = sum(self._contended)
+        wait_total = sum(self._wait_total)
+        return {
+            'stripes': self.stripes,
+            'acquisitions': acquired,
+            'contended': contended,
+            'contention_rate': contended / acquired if acquired > 0 else 0,
+            'wait_total_ms': round(wait_total * 1000, 3),
+            'wait_avg_ms': round(wait_total * 1000 / contended, 3) if contended > 0 else 0,
+            'wait_max_ms': round(max(self._wait_max) * 1000, 3),
+        }
 
 
 # =====================
@@ -19,60 +77,96 @@ from logger_config import logger
 # =====================
 
 class RateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(deque)
-        self.lock = threading.Lock()
-        self.last_cleanup = time.time()
+    def __init__(self, stripes=SECURITY_LOCK_STRIPES, backend=None):
+        # backend 不为空时（如 SQLiteSharedState），限流计数由多个进程共享
+        self.backend = backend
+        self.locks = StripedLock(stripes)
+        self.shards = [{} for _ in range(self.locks.stripes)]
+        # 每个标识使用过的最大窗口，决定其过期回调时间
+        self.windows = [{} for _ in range(self.locks.stripes)]
+        # 每个分片当前跟踪的请求数，在分片锁内维护，供 get_stats 无锁读取
+        self.tracked = [0] * self.locks.stripes
     
     def is_allowed(self, identifier, max_requests, time_window):
         current_time = time.time()
-        with self.lock:
-            if current_time - self.last_cleanup > 300:
-                self._cleanup_old_requests(current_time)
-                self.last_cleanup = current_time
-            q = self.requests[identifier]
+        if self.backend is not None:
+            allowed, current_count, oldest = self.backend.rate_limit_hit(identifier, max_requests, time_window, current_time)
+        else:
+            allowed, current_count, oldest = self._hit_local(identifier, max_requests, time_window, current_time)
+        if not allowed:
+            retry_after = int(oldest + time_window - current_time) + 1
+            return False, {
+                'allowed': False,
+                'limit': max_requests,
+                'remaining': 0,
+                'reset': int(oldest + time_window),
+                'retry_after': retry_after
+            }
+        return True, {
+            'allowed': True,
+            'limit': max_requests,
+            'remaining': max_requests - current_count - 1,
+            'reset': int(current_time + time_window)
+        }
+    
+    def _hit_local(self, identifier, max_requests, time_window, current_time):
+        """进程内检查并计数，返回 (是否允许, 计数前窗口内请求数, 最早请求时间)"""
+        index = self.locks.index(identifier)
+        with self.locks.hold(index):
+            q = self.shards[index].get(identifier)
+            if q is None:
+                # 新标识：交给时间轮在窗口结束后回收
+                q = self.shards[index][identifier] = deque()
+                self.windows[index][identifier] = time_window
+                expiry_wheel.schedule(current_time + time_window, self._expire_identifier, index, identifier)
+            elif time_window > self.windows[index][identifier]:
+                self.windows[index][identifier] = time_window
             cutoff = current_time - time_window
             while q and q[0] < cutoff:
                 q.popleft()
+                self.tracked[index] -= 1
             current_count = len(q)
             if current_count >= max_requests:
-                oldest = q[0]
-                retry_after = int(oldest + time_window - current_time) + 1
-                return False, {
-                    'allowed': False,
-                    'limit': max_requests,
-                    'remaining': 0,
-                    'reset': int(oldest + time_window),
-                    'retry_after': retry_after
-                }
+                return False, current_count, q[0]
             q.append(current_time)
-            return True, {
-                'allowed': True,
-                'limit': max_requests,
-                'remaining': max_requests - current_count - 1,
-                'reset': int(current_time + time_window)
-            }
+            self.tracked[index] += 1
+            return True, current_count, q[0]
     
-    def _cleanup_old_requests(self, current_time):
-        cutoff_time = current_time - 3600
-        to_remove = []
-        for identifier, q in self.requests.items():
-            while q and q[0] < cutoff_time:
+    def _expire_identifier(self, index, identifier):
+        """时间轮回调：清理过期请求，标识不再活跃时释放其内存，否则顺延到最新请求过期时"""
+        current_time = time.time()
+        with self.locks.hold(index):
+            q = self.shards[index].get(identifier)
+            if q is None:
+                return
+            time_window = self.windows[index][identifier]
+            cutoff = current_time - time_window
+            while q and q[0] < cutoff:
                 q.popleft()
+                self.tracked[index] -= 1
             if not q:
-                to_remove.append(identifier)
-        for key in to_remove:
-            del self.requests[key]
+                del self.shards[index][identifier]
+                del self.windows[index][identifier]
+                return
+            expire_at = q[-1] + time_window
+        expiry_wheel.schedule(expire_at, self._expire_identifier, index, identifier)
     
     def get_stats(self):
-        with self.lock:
-            return {
-                'total_identifiers': len(self.requests),
-                'total_requests_tracked': sum(len(q) for q in self.requests.values())
-            }
+        if self.backend is not None:
+            stats = self.backend.get_rate_limit_stats()
+            stats['backend'] = self.backend.get_backend_stats()
+            return stats
+        # 只读取各分片的长度与计数器，不获取任何分片锁
+        return {
+            'total_identifiers': sum(len(shard) for shard in self.shards),
+            'total_requests_tracked': sum(self.tracked),
+            'lock_wait': self.locks.get_wait_stats(),
+            'backend': {'backend': 'memory'},
+        }
 
 
-rate_limiter = RateLimiter()
+shared_state = create_shared_state(SHARED_STATE_BACKEND, SHARED_STATE_DB)
+rate_limiter = RateLimiter(backend=shared_state)
 
 
 def rate_limit(max_requests=100, time_window=60, key_func=None):
@@ -118,13 +212,10 @@ def get_api_key_identifier():
 
 
 def get_user_identifier():
-    from auth import JWTManager
-    auth_header = request.headers.get('Authorization')
-    token = JWTManager.extract_token_from_header(auth_header)
-    if token:
-        payload = JWTManager.verify_token(token)
-        if payload:
-            return f"user_{payload.get('user_id')}"
+    from auth import get_request_auth
+    _, payload = get_request_auth()
+    if payload:
+        return f"user_{payload.get('user_id')}"
     return request.remote_addr
 
 
@@ -137,14 +228,26 @@ import os
 
 
 class SecurityManager:
-    def __init__(self, config_file='security_config.json'):
+    def __init__(self, config_file='security_config.json', backend=None):
         self.config_file = config_file
+        # backend 不为空时，登录失败计数与 IP 锁定状态由多个进程共享
+        self.backend = backend
+        # whitelist / blacklist 保存规范化后的条目（单个 IP 或 CIDR 网段），用于持久化与展示；
+        # 访问检查走对应的前缀树，查询耗时与条目数量无关
         self.whitelist = set()
         self.blacklist = set()
-        self.login_failures = defaultdict(deque)
-        self.locked_ips = {}
-        self.csrf_tokens = {}
+        self.whitelist_trie = IPPrefixTrie()
+        self.blacklist_trie = IPPrefixTrie()
+        # 按 IP / token 分片的状态，每个分片由 state_locks 中对应的锁保护
+        self.state_locks = StripedLock()
+        self.login_failures = [defaultdict(deque) for _ in range(self.state_locks.stripes)]
+        self.locked_ips = [{} for _ in range(self.state_locks.stripes)]
+        self.csrf_tokens = [{} for _ in range(self.state_locks.stripes)]
+        # 保护白/黑名单与配置
         self.lock = threading.Lock()
+        # 串行化配置文件写入，并管理延迟保存的定时器
+        self._save_lock = threading.Lock()
+        self._save_timer = None
         self.config = {
             'enable_whitelist': False,
             'enable_blacklist': True,
@@ -163,28 +266,69 @@ class SecurityManager:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     self.config.update(data.get('config', {}))
-                    self.whitelist = set(data.get('whitelist', []))
-                    self.blacklist = set(data.get('blacklist', []))
+                    self.whitelist, self.whitelist_trie, _ = self._build_ip_list(data.get('whitelist', []))
+                    self.blacklist, self.blacklist_trie, _ = self._build_ip_list(data.get('blacklist', []))
                 logger.info('✅ [安全管理] 配置加载成功')
-                logger.info(f'   白名单: {len(self.whitelist)} 个IP')
-                logger.info(f'   黑名单: {len(self.blacklist)} 个IP')
+                logger.info(f'   白名单: {len(self.whitelist)} 个IP/网段')
+                logger.info(f'   黑名单: {len(self.blacklist)} 个IP/网段')
         except Exception as e:
             logger.warning(f'⚠️  [安全管理] 配置加载失败: {str(e)}，使用默认配置')
     
+    @staticmethod
+    def _build_ip_list(entries):
+        """由条目列表构建 (条目集合, 前缀树, 非法条目列表)"""
+        normalized = set()
+        trie = IPPrefixTrie()
+        invalid = []
+        for entry in entries:
+            try:
+                entry = normalize_ip_entry(entry)
+            except ValueError:
+                invalid.append(entry)
+                continue
+            if entry not in normalized:
+                normalized.add(entry)
+                trie.add(entry)
+        if invalid:
+            logger.warning(f'⚠️  [安全管理] 忽略 {len(invalid)} 个无效的 IP/网段条目')
+        return normalized, trie, invalid
+    
     def save_config(self):
-        try:
-            data = {
-                'config': self.config,
-                'whitelist': list(self.whitelist),
-                'blacklist': list(self.blacklist)
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.info('💾 [安全管理] 配置已保存')
-            return True
-        except Exception as e:
-            logger.error(f'❌ [安全管理] 配置保存失败: {str(e)}')
-            return False
+        """立即保存配置：在锁内取快照，锁外写临时文件再原子替换"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            with self.lock:
+                data = {
+                    'config': dict(self.config),
+                    'whitelist': sorted(self.whitelist),
+                    'blacklist': sorted(self.blacklist)
+                }
+            try:
+                tmp_file = f'{self.config_file}.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_file, self.config_file)
+                logger.info('💾 [安全管理] 配置已保存')
+                return True
+            except Exception as e:
+                logger.error(f'❌ [安全管理] 配置保存失败: {str(e)}')
+                return False
+    
+    def schedule_save(self):
+        """延迟保存：短时间内的多次修改合并为一次写入"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(SECURITY_SAVE_DEBOUNCE, self._flush_scheduled_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def _flush_scheduled_save(self):
+        with self._save_lock:
+            self._save_timer = None
+        self.save_config()
     
     def get_client_ip(self):
         ip = request.headers.get('X-Forwarded-For')
@@ -197,93 +341,230 @@ class SecurityManager:
     def is_ip_allowed(self, ip=None):
         if ip is None:
             ip = self.get_client_ip()
-        if self.config['enable_blacklist'] and ip in self.blacklist:
-            logger.warning(f'🚫 [安全管理] IP 在黑名单中: {ip}')
-            return False, 'IP 已被封禁'
+        if self.config['enable_blacklist']:
+            matched = self.blacklist_trie.match(ip)
+            if matched is not None:
+                logger.warning(f'🚫 [安全管理] IP 在黑名单中: {ip} (匹配 {matched})')
+                return False, 'IP 已被封禁'
         if self.config['enable_whitelist']:
-            if ip not in self.whitelist:
+            if self.whitelist_trie.match(ip) is None:
                 logger.warning(f'🚫 [安全管理] IP 不在白名单中: {ip}')
                 return False, 'IP 未授权访问'
         return True, 'OK'
     
-    def add_to_whitelist(self, ip):
+    def get_ip_list(self, list_type):
         with self.lock:
-            self.whitelist.add(ip)
-            self.save_config()
-            logger.info(f'✅ [安全管理] IP 已添加到白名单: {ip}')
+            return sorted(getattr(self, list_type))
     
-    def remove_from_whitelist(self, ip):
+    def add_ip_entries(self, list_type, entries):
+        """
+        批量添加 IP / CIDR 条目：先整体校验，任一条目非法则全部不生效；
+        全部条目在一次加锁内生效，配置文件只延迟写入一次
+        
+        Returns:
+            新增的条目数（已存在的条目不计）
+        """
+        normalized = self._normalize_all(entries)
         with self.lock:
-            self.whitelist.discard(ip)
-            self.save_config()
-            logger.info(f'✅ [安全管理] IP 已从白名单移除: {ip}')
+            current = getattr(self, list_type)
+            trie = getattr(self, list_type + '_trie')
+            added = 0
+            for entry in normalized:
+                if entry not in current:
+                    current.add(entry)
+                    trie.add(entry)
+                    added += 1
+        self.schedule_save()
+        logger.info(f'✅ [安全管理] {list_type} 新增 {added} 个条目 (提交 {len(normalized)} 个)')
+        return added
     
-    def add_to_blacklist(self, ip):
+    def remove_ip_entries(self, list_type, entries):
+        """批量移除条目，校验与生效方式同 add_ip_entries，返回实际移除的条目数"""
+        normalized = self._normalize_all(entries)
         with self.lock:
-            self.blacklist.add(ip)
-            self.save_config()
-            logger.info(f'🚫 [安全管理] IP 已添加到黑名单: {ip}')
+            current = getattr(self, list_type)
+            trie = getattr(self, list_type + '_trie')
+            removed = 0
+            for entry in normalized:
+                if entry in current:
+                    current.discard(entry)
+                    trie.remove(entry)
+                    removed += 1
+        self.schedule_save()
+        logger.info(f'✅ [安全管理] {list_type} 移除 {removed} 个条目 (提交 {len(normalized)} 个)')
+        return removed
+    
+    @staticmethod
+    def _normalize_all(entries):
+        """规范化全部条目，存在非法条目时抛出 ValueError"""
+        normalized = []
+        invalid = []
+        for entry in entries:
+            try:
+                normalized.append(normalize_ip_entry(entry))
+            except ValueError:
+                invalid.append(entry)
+        if invalid:
+            raise ValueError(f'无效的 IP 地址或网段: {", ".join(map(str, invalid[:20]))}')
+        return normalized
+    
+    def add_to_whitelist(self, ip):
+        """添加 IP 或 CIDR 网段到白名单，格式非法时抛出 ValueError"""
+        self.add_ip_entries('whitelist', [ip])
+    
+    def remove_from_whitelist(self, ip):
+        self.remove_ip_entries('whitelist', [ip])
+    
+    def add_to_blacklist(self, ip):
+        """添加 IP 或 CIDR 网段到黑名单，格式非法时抛出 ValueError"""
+        self.add_ip_entries('blacklist', [ip])
     
     def remove_from_blacklist(self, ip):
+        self.remove_ip_entries('blacklist', [ip])
+    
+    def import_ip_list(self, list_type, entries, replace=False):
+        """
+        批量导入白/黑名单（如大型封禁列表），非法条目跳过，配置文件只延迟写入一次
+        
+        Args:
+            list_type: 'whitelist' 或 'blacklist'
+            entries: IP / CIDR 条目列表
+            replace: True 覆盖现有列表，False 合并
+            
+        Returns:
+            {'added': 新增条目数, 'total': 导入后条目数, 'invalid': 非法条目（最多 20 个）, 'invalid_count': 非法条目数}
+        """
+        if list_type not in ('whitelist', 'blacklist'):
+            raise ValueError(f'未知的列表类型: {list_type}')
         with self.lock:
-            self.blacklist.discard(ip)
-            self.save_config()
-            logger.info(f'✅ [安全管理] IP 已从黑名单移除: {ip}')
+            current = getattr(self, list_type)
+            if replace:
+                normalized, trie, invalid = self._build_ip_list(entries)
+                added = len(normalized - current)
+                # 新树构建完成后整体替换，查询线程不会看到半成品
+                setattr(self, list_type + '_trie', trie)
+                setattr(self, list_type, normalized)
+            else:
+                trie = getattr(self, list_type + '_trie')
+                invalid = []
+                added = 0
+                for entry in entries:
+                    try:
+                        entry = normalize_ip_entry(entry)
+                    except ValueError:
+                        invalid.append(entry)
+                        continue
+                    if entry not in current:
+                        current.add(entry)
+                        trie.add(entry)
+                        added += 1
+            total = len(getattr(self, list_type))
+        self.schedule_save()
+        logger.info(f'📥 [安全管理] {list_type} 导入完成: 新增 {added}，共 {total}，无效 {len(invalid)}')
+        return {'added': added, 'total': total, 'invalid': invalid[:20], 'invalid_count': len(invalid)}
     
     def record_login_failure(self, ip=None):
         if ip is None:
             ip = self.get_client_ip()
         current_time = time.time()
-        with self.lock:
-            failures = self.login_failures[ip]
+        if self.backend is not None:
+            locked, count = self.backend.record_login_failure(
+                ip, self.config['failure_window'], self.config['max_login_failures'],
+                self.config['lockout_duration'], current_time)
+            if locked:
+                logger.warning(f'🔒 [安全管理] IP 已被锁定: {ip} (失败 {count} 次)')
+                return True, self.config['lockout_duration']
+            logger.warning(f'⚠️  [安全管理] 登录失败: {ip} ({count}/{self.config["max_login_failures"]})')
+            return False, count
+        index = self.state_locks.index(ip)
+        with self.state_locks.hold(index):
+            failures = self.login_failures[index][ip]
             cutoff_time = current_time - self.config['failure_window']
             while failures and failures[0] < cutoff_time:
                 failures.popleft()
             failures.append(current_time)
+            expiry_wheel.schedule(current_time + self.config['failure_window'], self._expire_login_failures, index, ip)
             if len(failures) >= self.config['max_login_failures']:
                 unlock_time = current_time + self.config['lockout_duration']
-                self.locked_ips[ip] = unlock_time
+                self.locked_ips[index][ip] = unlock_time
+                expiry_wheel.schedule(unlock_time, self._expire_ip_lock, index, ip)
                 logger.warning(f'🔒 [安全管理] IP 已被锁定: {ip} (失败 {len(failures)} 次)')
                 logger.warning(f'   解锁时间: {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(unlock_time))}')
                 return True, self.config['lockout_duration']
             logger.warning(f'⚠️  [安全管理] 登录失败: {ip} ({len(failures)}/{self.config["max_login_failures"]})')
             return False, len(failures)
     
+    def _expire_login_failures(self, index, ip):
+        """时间轮回调：移除窗口外的失败记录，IP 没有剩余记录且未锁定时释放其条目"""
+        cutoff_time = time.time() - self.config['failure_window']
+        with self.state_locks.hold(index):
+            failures = self.login_failures[index].get(ip)
+            if failures is None:
+                return
+            while failures and failures[0] < cutoff_time:
+                failures.popleft()
+            if not failures and ip not in self.locked_ips[index]:
+                del self.login_failures[index][ip]
+    
+    def _expire_ip_lock(self, index, ip):
+        """时间轮回调：锁定到期后自动解锁"""
+        with self.state_locks.hold(index):
+            unlock_time = self.locked_ips[index].get(ip)
+            # 锁定期间可能被延长，延长后会有新的回调负责
+            if unlock_time is None or unlock_time > time.time():
+                return
+            del self.locked_ips[index][ip]
+            self.login_failures[index].pop(ip, None)
+        logger.info(f'🔓 [安全管理] IP 已解锁: {ip}')
+    
     def is_ip_locked(self, ip=None):
         if ip is None:
             ip = self.get_client_ip()
         current_time = time.time()
-        with self.lock:
-            if ip in self.locked_ips:
-                unlock_time = self.locked_ips[ip]
+        if self.backend is not None:
+            unlock_time = self.backend.get_unlock_time(ip, current_time)
+            if unlock_time is not None:
+                remaining = int(unlock_time - current_time)
+                logger.warning(f'🔒 [安全管理] IP 仍在锁定中: {ip} (剩余 {remaining} 秒)')
+                return True, remaining
+            return False, 0
+        index = self.state_locks.index(ip)
+        with self.state_locks.hold(index):
+            locked_ips = self.locked_ips[index]
+            if ip in locked_ips:
+                unlock_time = locked_ips[ip]
                 if current_time < unlock_time:
                     remaining = int(unlock_time - current_time)
                     logger.warning(f'🔒 [安全管理] IP 仍在锁定中: {ip} (剩余 {remaining} 秒)')
                     return True, remaining
                 else:
-                    del self.locked_ips[ip]
-                    if ip in self.login_failures:
-                        del self.login_failures[ip]
+                    del locked_ips[ip]
+                    self.login_failures[index].pop(ip, None)
                     logger.info(f'🔓 [安全管理] IP 已解锁: {ip}')
         return False, 0
     
     def clear_login_failures(self, ip=None):
         if ip is None:
             ip = self.get_client_ip()
-        with self.lock:
-            if ip in self.login_failures:
-                del self.login_failures[ip]
-            if ip in self.locked_ips:
-                del self.locked_ips[ip]
+        if self.backend is not None:
+            self.backend.clear_login_failures(ip)
+            logger.info(f'✅ [安全管理] 已清除登录失败记录: {ip}')
+            return
+        index = self.state_locks.index(ip)
+        with self.state_locks.hold(index):
+            self.login_failures[index].pop(ip, None)
+            self.locked_ips[index].pop(ip, None)
             logger.info(f'✅ [安全管理] 已清除登录失败记录: {ip}')
     
     def generate_csrf_token(self):
         if not self.config['enable_csrf']:
             return None
         token = secrets.token_urlsafe(32)
-        with self.lock:
-            self.csrf_tokens[token] = time.time()
-            self._cleanup_csrf_tokens()
+        index = self.state_locks.index(token)
+        current_time = time.time()
+        with self.state_locks.hold(index):
+            self.csrf_tokens[index][token] = current_time
+        expiry_wheel.schedule(current_time + self.config['csrf_token_lifetime'], self._expire_csrf_token, index, token)
         return token
     
     def verify_csrf_token(self, token):
@@ -292,35 +573,44 @@ class SecurityManager:
         if not token:
             return False
         current_time = time.time()
-        with self.lock:
-            if token not in self.csrf_tokens:
+        index = self.state_locks.index(token)
+        with self.state_locks.hold(index):
+            csrf_tokens = self.csrf_tokens[index]
+            if token not in csrf_tokens:
                 return False
-            token_time = self.csrf_tokens[token]
-            if current_time - token_time > self.config['csrf_token_lifetime']:
-                del self.csrf_tokens[token]
-                return False
-            del self.csrf_tokens[token]
-            return True
+            token_time = csrf_tokens.pop(token)
+            return current_time - token_time <= self.config['csrf_token_lifetime']
     
-    def _cleanup_csrf_tokens(self):
-        current_time = time.time()
-        expired = [t for t, ts in self.csrf_tokens.items() if current_time - ts > self.config['csrf_token_lifetime']]
-        for t in expired:
-            del self.csrf_tokens[t]
+    def _expire_csrf_token(self, index, token):
+        """时间轮回调：删除过期的 CSRF token（有效期被调大时顺延）"""
+        lifetime = self.config['csrf_token_lifetime']
+        with self.state_locks.hold(index):
+            token_time = self.csrf_tokens[index].get(token)
+            if token_time is None:
+                return
+            if time.time() - token_time >= lifetime:
+                del self.csrf_tokens[index][token]
+                return
+        expiry_wheel.schedule(token_time + lifetime, self._expire_csrf_token, index, token)
     
     def get_stats(self):
-        with self.lock:
-            return {
-                'whitelist_count': len(self.whitelist),
-                'blacklist_count': len(self.blacklist),
-                'locked_ips_count': len(self.locked_ips),
-                'failed_login_ips': len(self.login_failures),
-                'csrf_tokens_active': len(self.csrf_tokens),
-                'config': self.config.copy()
-            }
+        # 各分片只读取长度，不做全局加锁
+        stats = {
+            'whitelist_count': len(self.whitelist),
+            'blacklist_count': len(self.blacklist),
+            'locked_ips_count': sum(len(shard) for shard in self.locked_ips),
+            'failed_login_ips': sum(len(shard) for shard in self.login_failures),
+            'csrf_tokens_active': sum(len(shard) for shard in self.csrf_tokens),
+            'lock_wait': self.state_locks.get_wait_stats(),
+            'expiry_wheel': expiry_wheel.get_stats(),
+            'config': self.config.copy()
+        }
+        if self.backend is not None:
+            stats.update(self.backend.get_login_stats())
+        return stats
 
 
-security_manager = SecurityManager()
+security_manager = SecurityManager(backend=shared_state)
 
 
 def require_ip_allowed(f):
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享状态模块：多个工作进程共享限流窗口与登录锁定状态。
+使用 SQLite WAL 模式，每次检查并计数在一个 BEGIN IMMEDIATE 事务内完成，保证原子性。
+"""
+
+import time
+import sqlite3
+import threading
+from logger_config import logger
+
+
+class SQLiteSharedState:
+    """基于 SQLite (WAL) 的共享限流 / 登录锁定状态"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path='shared_state.db', cleanup_interval=300):
+        self.db_path = db_path
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = time.time()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._call_time = 0.0
+        self._init_database()
+        logger.info(f'🔗 [共享状态] SQLite 后端已启用: {self.db_path}')
+
+    def _get_connection(self):
+        """每个线程复用一个连接（sqlite3 连接不能跨线程使用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由我们显式控制事务
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 状态本身是短期的，进程崩溃丢失最近几次计数可以接受
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+        return conn
+
+    def _init_database(self):
+        conn = self._get_connection()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS rate_events (
+                identifier TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_rate_events ON rate_events(identifier, ts);
+            CREATE TABLE IF NOT EXISTS login_failures (
+                ip TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_login_failures ON login_failures(ip, ts);
+            CREATE TABLE IF NOT EXISTS locked_ips (
+                ip TEXT PRIMARY KEY,
+                unlock_time REAL NOT NULL
+            );
+        ''')
+
+    def _record_call(self, started):
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._calls += 1
+            self._call_time += elapsed
+
+    def _maybe_cleanup(self, conn, now):
+        """定期清理被遗弃的标识（调用方需处于写事务中）"""
+        if now - self.last_cleanup <= self.cleanup_interval:
+            return
+        self.last_cleanup = now
+        conn.execute('DELETE FROM rate_events WHERE ts < ?', (now - 3600,))
+        conn.execute('DELETE FROM locked_ips WHERE unlock_time < ?', (now,))
+        conn.execute('DELETE FROM login_failures WHERE ts < ?', (now - 3600,))
+
+    def rate_limit_hit(self, identifier, max_requests, time_window, now):
+        """
+        原子地检查并计数一次请求
+
+        Returns:
+            (是否允许, 计数前窗口内请求数, 窗口内最早请求时间)
+        """
+        started = time.perf_counter()
+        conn = self._get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._maybe_cleanup(conn, now)
+            conn.execute('DELETE FROM rate_events WHERE identifier = ? AND ts < ?',
+                         (identifier, now - time_window))
+            count, oldest = conn.execute(
+                'SELECT COUNT(*), MIN(ts) FROM rate_events WHERE identifier = ?',
+                (identifier,)
+            ).fetchone()
+            allowed = count < max_requests
+            if allowed:
+                conn.execute('INSERT INTO rate_events (identifier, ts) VALUES (?, ?)', (identifier, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._record_call(started)
+        return allowed, count, oldest
+
+    def record_login_failure(self, ip, failure_window, max_failures, lockout_duration, now):
+        """
+        记录一次登录失败，达到阈值时锁定
+
+        Returns:
+            (是否已锁定, 窗口内失败次数)
+        """
+        started = time.perf_counter()
+        conn = self._get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM login_failures WHERE ip = ? AND ts < ?', (ip, now - failure_window))
+            conn.execute('INSERT INTO login_failures (ip, ts) VALUES (?, ?)', (ip, now))
+            count = conn.execute('SELECT COUNT(*) FROM login_failures WHERE ip = ?', (ip,)).fetchone()[0]
+            locked = count >= max_failures
+            if locked:
+                conn.execute('INSERT OR REPLACE INTO locked_ips (ip, unlock_time) VALUES (?, ?)',
+                             (ip, now + lockout_duration))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._record_call(started)
+        return locked, count
+
+    def get_unlock_time(self, ip, now):
+        """返回 IP 的解锁时间；未锁定或已过期返回 None（过期记录会被顺带清除）"""
+        started = time.perf_counter()
+        conn = self._get_connection()
+        row = conn.execute('SELECT unlock_time FROM locked_ips WHERE ip = ?', (ip,)).fetchone()
+        if row is None:
+            self._record_call(started)
+            return None
+        if now < row[0]:
+            self._record_call(started)
+            return row[0]
+        self.clear_login_failures(ip)
+        self._record_call(started)
+        return None
+
+    def clear_login_failures(self, ip):
+        conn = self._get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM login_failures WHERE ip = ?', (ip,))
+            conn.execute('DELETE FROM locked_ips WHERE ip = ?', (ip,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_rate_limit_stats(self):
+        conn = self._get_connection()
+        identifiers, tracked = conn.execute(
+            'SELECT COUNT(DISTINCT identifier), COUNT(*) FROM rate_events'
+        ).fetchone()
+        return {
+            'total_identifiers': identifiers,
+            'total_requests_tracked': tracked,
+        }
+
+    def get_login_stats(self):
+        conn = self._get_connection()
+        locked = conn.execute('SELECT COUNT(*) FROM locked_ips WHERE unlock_time >= ?', (time.time(),)).fetchone()[0]
+        failed = conn.execute('SELECT COUNT(DISTINCT ip) FROM login_failures').fetchone()[0]
+        return {'locked_ips_count': locked, 'failed_login_ips': failed}
+
+    def get_backend_stats(self):
+        with self._stats_lock:
+            calls, call_time = self._calls, self._call_time
+        return {
+            'backend': self.name,
+            'db_path': self.db_path,
+            'calls': calls,
+            'avg_call_ms': round(call_time * 1000 / calls, 4) if calls > 0 else 0,
+        }
+
+
+def create_shared_state(backend, db_path):
+    """按配置创建共享状态后端；'memory' 表示仅使用进程内状态"""
+    if backend == 'sqlite':
+        return SQLiteSharedState(db_path)
+    if backend not in ('memory', '', None):
+        logger.warning(f'⚠️  [共享状态] 未知的后端类型: {backend}，使用进程内状态')
+    return None
+
+
+__all__ = ['SQLiteSharedState', 'create_shared_state']
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接池模块：用户数据库、识别历史等 SQLite 存储共用的有界连接池。
+新代码可 from sqlite_pool import SQLiteConnectionPool
+"""
+
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+
+class SQLiteConnectionPool:
+    """
+    SQLite 连接池
+    
+    Flask 多线程模式下每个请求都可能运行在新线程里，线程本地连接几乎无法复用，
+    因此使用有上限的共享连接池。连接开启 WAL 与语句缓存；归还时回滚未提交的事务，
+    超过最大存活时间的连接在归还时关闭，下次按需重建。
+    """
+    
+    def __init__(self, db_path: str, max_size: int = 4, timeout: float = 5.0,
+                 max_age: float = 3600, leak_threshold: float = 30, synchronous: str = 'NORMAL'):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.leak_threshold = leak_threshold
+        self.cond = threading.Condition()
+        self.idle = []  # [(conn, created_at)]，后进先出，优先复用最近使用的连接
+        self.in_use = {}  # id(conn) -> (conn, created_at, checkout_at, thread_name)
+        self.created = 0
+        self.recycled = 0
+        self.rollbacks = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def _create(self) -> sqlite3.Connection:
+        # 连接由池在线程间传递，同一时刻只会被一个线程持有
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False,
+                               cached_statements=128)
+        conn.row_factory = sqlite3.Row  # 使返回结果可以通过列名访问
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """取出一个连接，池满时最多等待 timeout 秒"""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        with self.cond:
+            while not self.idle and len(self.in_use) >= self.max_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise sqlite3.OperationalError(f'数据库连接池已耗尽（{self.max_size} 个连接均在使用中）')
+                self.cond.wait(remaining)
+            if self.idle:
+                conn, created_at = self.idle.pop()
+            else:
+                conn, created_at = self._create(), time.time()
+                self.created += 1
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.in_use[id(conn)] = (conn, created_at, time.time(), threading.current_thread().name)
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """归还连接：回滚未提交事务，超龄或异常的连接直接关闭"""
+        healthy = True
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+                self.rollbacks += 1
+            except sqlite3.Error:
+                healthy = False
+        with self.cond:
+            _, created_at, _, _ = self.in_use.pop(id(conn))
+            if healthy and time.time() - created_at < self.max_age:
+                self.idle.append((conn, created_at))
+                conn = None
+            else:
+                self.recycled += 1
+            self.cond.notify()
+        if conn is not None:
+            conn.close()
+    
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... 退出时自动归还"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close_all(self):
+        """关闭所有空闲连接（使用中的连接归还后按需重建）"""
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+    
+    def get_stats(self) -> Dict:
+        now = time.time()
+        with self.cond:
+            # 持有时间超过阈值的连接视为疑似泄漏
+            leaked = [{
+                'thread': thread_name,
+                'held_seconds': round(now - checkout_at, 1)
+            } for _, _, checkout_at, thread_name in self.in_use.values()
+                if now - checkout_at > self.leak_threshold]
+            return {
+                'max_size': self.max_size,
+                'in_use': len(self.in_use),
+                'idle': len(self.idle),
+                'created': self.created,
+                'recycled': self.recycled,
+                'rollbacks': self.rollbacks,
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.timeouts,
+                'checkout_wait_avg_ms': self.wait_total / self.checkouts * 1000 if self.checkouts else 0,
+                'checkout_wait_max_ms': self.wait_max * 1000,
+                'leaked': leaked,
+            }
+
+
+__all__ = ['SQLiteConnectionPool']
@@ -7,6 +7,8 @@
 
 import os
 import sys
+import atexit
+import signal
 
 # 生产环境配置
 PRODUCTION_CONFIG = {
@@ -26,6 +28,16 @@ def main():
     
     # 导入应用
     from local_captcha_server import app, load_admin_config, load_rules, load_api_keys
+    from local_captcha_server import recognition_history, security_manager, rules_store
+    
+    # 退出时限时落盘识别历史，写入未保存的规则改动并保存安全配置；SIGTERM（systemd 停止服务）转为正常退出以触发 atexit
+    def cleanup_on_exit():
+        recognition_history.close()
+        rules_store.close()
+        security_manager.save_config()
+    
+    atexit.register(cleanup_on_exit)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
     # 加载配置
     print("📋 加载配置...")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分层时间轮模块：统一调度 CSRF token、IP 锁定、限流窗口等状态的过期清理。
+添加定时项与每个 tick 的推进均摊 O(1)，由后台线程驱动，请求路径无需做全量扫描。
+新代码可 from timing_wheel import expiry_wheel
+"""
+
+import time
+import threading
+from logger_config import logger
+from config import EXPIRY_WHEEL_TICK
+
+
+class TimingWheel:
+    """
+    分层时间轮（Varghese & Lauck）
+
+    第 L 层每个槽覆盖 slots**L 个 tick；远期定时项放在高层，
+    当低层转完一圈时逐级下沉（cascade），到达第 0 层的槽位时触发回调。
+    """
+
+    def __init__(self, tick=EXPIRY_WHEEL_TICK, slots=64, levels=4, name='ExpiryWheel'):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.name = name
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current_tick = int(time.time() / tick)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.fired = 0
+        self.cascaded = 0
+        self.callback_errors = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """启动后台推进线程（重复调用无副作用）"""
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+            self._thread.start()
+        logger.info(f'⏱️  [时间轮] 后台线程已启动 (tick={self.tick}s)')
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.wait(self.tick):
+            try:
+                self.advance(time.time())
+            except Exception as e:
+                logger.error(f'❌ [时间轮] 推进失败: {str(e)}')
+
+    def schedule(self, expire_at, callback, *args):
+        """在 expire_at（Unix 时间戳）之后调用 callback(*args)，返回可用于 cancel 的句柄"""
+        entry = [int(-(-expire_at // self.tick)), callback, args, False]
+        with self.lock:
+            self._insert(entry, self.current_tick + 1)
+            self.pending += 1
+        if self._thread is None:
+            self.start()
+        return entry
+
+    @staticmethod
+    def cancel(entry):
+        """取消定时项；条目会在原定槽位被跳过，无需查找"""
+        entry[3] = True
+
+    def _insert(self, entry, earliest_tick):
+        """按目标 tick 与当前 tick 的距离选择层级与槽位（调用方需持有锁）"""
+        target = max(entry[0], earliest_tick)
+        delta = target - self.current_tick
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                self.wheels[level][(target // span) % self.slots].append(entry)
+                return
+            span *= self.slots
+        # 超出最高层范围：先放在最高层最远的槽位，下沉时会重新计算
+        span //= self.slots
+        target = self.current_tick + span * self.slots - 1
+        self.wheels[self.levels - 1][(target // span) % self.slots].append(entry)
+
+    def advance(self, now):
+        """推进到 now 对应的 tick，触发所有到期的回调"""
+        now_tick = int(now / self.tick)
+        while True:
+            with self.lock:
+                if self.current_tick >= now_tick:
+                    return
+                self.current_tick += 1
+                tick = self.current_tick
+                # 低层转完一圈时，将上一层对应槽位的条目重新分配
+                span = self.slots
+                for level in range(1, self.levels):
+                    if tick % span:
+                        break
+                    bucket = self.wheels[level][(tick // span) % self.slots]
+                    self.wheels[level][(tick // span) % self.slots] = []
+                    self.cascaded += len(bucket)
+                    for entry in bucket:
+                        # 当前 tick 的第 0 层槽位尚未处理，允许直接落入
+                        self._insert(entry, tick)
+                    span *= self.slots
+                slot = tick % self.slots
+                bucket = self.wheels[0][slot]
+                self.wheels[0][slot] = []
+                due = []
+                for entry in bucket:
+                    if entry[3]:
+                        self.pending -= 1
+                    elif entry[0] > tick:
+                        self._insert(entry, tick + 1)
+                    else:
+                        due.append(entry)
+                self.pending -= len(due)
+                self.fired += len(due)
+            # 回调在锁外执行，回调内部可以再次 schedule
+            for entry in due:
+                try:
+                    entry[1](*entry[2])
+                except Exception as e:
+                    self.callback_errors += 1
+                    logger.error(f'❌ [时间轮] 过期回调执行失败: {str(e)}')
+
+    def get_stats(self):
+        return {
+            'tick': self.tick,
+            'pending': self.pending,
+            'fired': self.fired,
+            'cascaded': self.cascaded,
+            'callback_errors': self.callback_errors,
+        }
+
+
+expiry_wheel = TimingWheel()
+
+__all__ = ['TimingWheel', 'expiry_wheel']
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别流量采集模块：按采样率记录 /hello 请求（图片与元数据），供 replay_traffic.py 回放以对比性能与结果。
+图片等大字段按内容 SHA-256 寻址存为 blobs/，相同图片只存一份；每个请求在 index.jsonl 中占一行。
+默认关闭，设置 CAPTCHA_CAPTURE_ENABLED=1 开启；目录总大小达到上限后停止采集。
+新代码可 from traffic_capture import traffic_capture
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import hashlib
+import threading
+from logger_config import logger
+from config import (TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_DIR, TRAFFIC_CAPTURE_SAMPLE_RATE,
+                    TRAFFIC_CAPTURE_MAX_MB)
+
+# 不小于该长度的字符串字段（base64 图片）存为 blob，其余字段直接写入索引
+BLOB_MIN_CHARS = 256
+# 不采集的字段（凭据）
+_EXCLUDED_FIELDS = ('api_key',)
+# 回放工具发出的请求带有该请求头，不再被采集
+REPLAY_HEADER = 'X-Replay'
+
+
+def blob_path(directory, digest):
+    return os.path.join(directory, 'blobs', digest[:2], digest)
+
+
+def read_index(directory):
+    """逐行读取采集索引（跳过损坏的行），供回放工具使用"""
+    path = os.path.join(directory, 'index.jsonl')
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_payload(directory, entry):
+    """由索引行还原请求体：blob 字段读回原始字符串"""
+    payload = dict(entry.get('params', {}))
+    for field, digest in entry.get('blobs', {}).items():
+        with open(blob_path(directory, digest), 'r', encoding='utf-8') as f:
+            payload[field] = f.read()
+    return payload
+
+
+class TrafficCapture:
+    """
+    采样采集器
+
+    请求线程只做采样判断并把数据放入有界队列（满则丢弃），哈希与写文件由后台线程完成，不增加识别延迟。
+    """
+
+    def __init__(self, directory=TRAFFIC_CAPTURE_DIR, sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE,
+                 max_bytes=TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024, enabled=TRAFFIC_CAPTURE_ENABLED,
+                 queue_size=1000):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.full = False
+        self.captured = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.total_bytes = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._index = None
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+            self.total_bytes = self._disk_usage()
+            self.full = self.total_bytes >= max_bytes
+            threading.Thread(target=self._run, daemon=True, name='TrafficCapture').start()
+            logger.info(f'🎥 [流量采集] 已开启：采样率 {sample_rate:.0%}，目录 {directory}'
+                        f'（已用 {self.total_bytes / 1024 / 1024:.1f} / {max_bytes / 1024 / 1024:.0f} MB）')
+
+    def _disk_usage(self):
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def capture(self, payload, response, duration):
+        """/hello 处理完成后调用：response 为视图函数的返回值（Response 或 (Response, 状态码, ...)）"""
+        if not self.enabled or self.full or not isinstance(payload, dict) or random.random() >= self.sample_rate:
+            return
+        resp, status = (response[0], response[1]) if isinstance(response, tuple) else (response, 200)
+        body = resp.get_json(silent=True) or {}
+        try:
+            self.queue.put_nowait((time.time(), payload, status, body, duration))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                self._write(*entry)
+            except Exception as e:
+                logger.warning(f'⚠️  [流量采集] 写入失败: {str(e)}')
+
+    def _write(self, timestamp, payload, status, body, duration):
+        # 先算出整条样本（新 blob + 索引行）的大小并一次预留，超出上限则整条不写，不留下无索引的 blob
+        blobs, params, new_blobs = {}, {}, {}
+        reused = 0
+        for field, value in payload.items():
+            if field in _EXCLUDED_FIELDS:
+                continue
+            if isinstance(value, str) and len(value) >= BLOB_MIN_CHARS:
+                data = value.encode('utf-8')
+                digest = hashlib.sha256(data).hexdigest()
+                blobs[field] = digest
+                if digest in new_blobs or os.path.exists(blob_path(self.directory, digest)):
+                    reused += 1
+                else:
+                    new_blobs[digest] = data
+            else:
+                params[field] = value
+        line = json.dumps({
+            'ts': timestamp,
+            'duration': duration,
+            'status': status,
+            'valid': body.get('valid'),
+            'result': body.get('data'),
+            'params': params,
+            'blobs': blobs,
+        }, ensure_ascii=False) + '\n'
+        if not self._reserve(len(line.encode('utf-8')) + sum(len(data) for data in new_blobs.values())):
+            return
+        for digest, data in new_blobs.items():
+            self._store_blob(digest, data)
+        if self._index is None:
+            self._index = open(os.path.join(self.directory, 'index.jsonl'), 'a', encoding='utf-8')
+        self._index.write(line)
+        self._index.flush()
+        self.deduplicated += reused
+        self.captured += 1
+
+    def _store_blob(self, digest, data):
+        """按内容寻址写入 blob（先写临时文件再改名，读到的 blob 总是完整的）"""
+        path = blob_path(self.directory, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def _reserve(self, size):
+        if self.total_bytes + size > self.max_bytes:
+            if not self.full:
+                logger.warning(f'⚠️  [流量采集] 已达到大小上限 {self.max_bytes / 1024 / 1024:.0f} MB，停止采集')
+            self.full = True
+            return False
+        self.total_bytes += size
+        return True
+
+    def get_stats(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'captured': self.captured,
+            'deduplicated': self.deduplicated,
+            'dropped': self.dropped,
+            'total_mb': round(self.total_bytes / 1024 / 1024, 2),
+            'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+            'full': self.full,
+        }
+
+
+traffic_capture = TrafficCapture()
+
+__all__ = ['TrafficCapture', 'traffic_capture', 'read_index', 'load_payload', 'blob_path', 'REPLAY_HEADER']